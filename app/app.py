@@ -18,11 +18,18 @@ st.set_page_config(
 # header_image = Image.open("path_to_your_image.png")
 # st.image(header_image, use_column_width=True)
 
-# Initialize the WikiRag class
-wiki_rag = WikiRag(
-    qdrant_url="http://localhost:6333",  # Adjust as necessary
-    qdrant_collection_name="olympics",   # Adjust as necessary
-)
+# Initialize the WikiRag class once per process: Streamlit reruns the script on every
+# interaction. The embedding model, the Qdrant client and the LLM are loaded in the
+# background while the page is rendered
+@st.cache_resource
+def load_wiki_rag() -> WikiRag:
+    return WikiRag(
+        qdrant_url="http://localhost:6333",  # Adjust as necessary
+        qdrant_collection_name="olympics",   # Adjust as necessary
+        background_warm_up=True,
+    )
+
+wiki_rag = load_wiki_rag()
 
 # Streamlit application title with custom markdown
 st.markdown("<h1 style='text-align: center; color: #F0FFFF;'>WikiRag Q&A System</h1>", unsafe_allow_html=True)
@@ -34,13 +41,19 @@ user_query = st.text_input("Inserisci la tua domanda:", placeholder="Es. Quale c
 # Button to submit the query with a custom button style
 if st.button("🔍 Chiedi"):
     if user_query:
+        # Stream the response from the WikiRag system: the sources arrive first, then the answer token by token
+        events = wiki_rag.stream(user_query)
         with st.spinner("Sto cercando la risposta..."):
-            # Get the response from the WikiRag system
-            response = wiki_rag.invoke(user_query)
+            sources = next(events)["sources"]
 
-        # Display the response with markdown styling
+        # Display the response with markdown styling, as it is generated
         st.markdown("### Risposta:")
-        st.write(response)
+        response = st.write_stream(event["answer"] for event in events)
+
+        if sources:
+            with st.expander("Fonti"):
+                for source in sources:
+                    st.markdown(f"- [{source.metadata.get('title', '')}]({source.metadata.get('url', '')})")
         
     else:
         st.error("Per favore, inserisci una domanda.")
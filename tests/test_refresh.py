@@ -0,0 +1,257 @@
+"""
+Tests of the incremental refresh (vectorization_pipeline/refresh.py) against a local
+stub of the MediaWiki API and an in-memory Qdrant collection.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vectorization_pipeline"))
+
+import document_acquisition
+from chunk_store import ChunkStoreWriter
+from page_manifest import PageManifest
+from refresh import plan_refresh, refresh, commit_refresh
+from wikipedia_fetcher import WikipediaFetcher
+
+LANGUAGE = "it"
+COLLECTION_NAME = "olympics"
+
+
+class StubWikipedia():
+    """
+    A class used to serve the pages of a fake Wikipedia with the MediaWiki API.
+    """
+
+    def __init__(self):
+        """
+        Constructor of the class
+        """
+        # By title, the revision id and the text of the page
+        self.pages = {}
+        # Titles whose text requests fail
+        self.failing = set()
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.api_url = f"http://127.0.0.1:{self.server.server_port}/{{language}}/api.php"
+
+    def url(self, title: str) -> str:
+        """
+        Method to get the URL of a page
+
+        Args:
+        title (str): the title of the page
+        """
+        return f"https://{LANGUAGE}.wikipedia.org/wiki/{title.replace(' ', '_')}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                titles = query["titles"].split("|")
+                with_text = "extracts" in query["prop"]
+                stub.requests.append((query["prop"], len(titles)))
+                if with_text and stub.failing.intersection(titles):
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+
+                normalized, pages = [], []
+                for title in titles:
+                    name = title.replace("_", " ")
+                    if name != title:
+                        normalized.append({"from": title, "to": name})
+                    if name not in stub.pages:
+                        pages.append({"title": name, "missing": True})
+                        continue
+                    revision_id, text = stub.pages[name]
+                    page = {
+                        "title": name,
+                        "fullurl": stub.url(name),
+                        "lastrevid": revision_id,
+                        "revisions": [{"revid": revision_id, "timestamp": f"2024-08-{revision_id % 28 + 1:02d}T00:00:00Z"}],
+                    }
+                    if with_text:
+                        page["extract"] = text
+                    pages.append(page)
+
+                body = json.dumps({"query": {"normalized": normalized, "pages": pages}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+@pytest.fixture(autouse=True)
+def no_stopwords(monkeypatch):
+    # The NLTK data is not needed to test the refresh
+    monkeypatch.setattr(document_acquisition, "get_stopwords", lambda language: frozenset())
+
+
+@pytest.fixture
+def wikipedia():
+    stub = StubWikipedia()
+    for index in range(3):
+        stub.pages[f"Page {index}"] = (100 + index, f"Giochi olimpici di prova numero {index} ad Atene nel 1896.")
+    thread = threading.Thread(target=stub.server.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def fetcher(wikipedia):
+    fetcher = WikipediaFetcher(workers=2, api_url=wikipedia.api_url, requests_per_second=0, max_retries=0)
+    yield fetcher
+    fetcher.close()
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = PageManifest(str(tmp_path / "manifest.sqlite"))
+    yield manifest
+    manifest.close()
+
+
+@pytest.fixture
+def qdrant_client(wikipedia):
+    client = QdrantClient(location=":memory:")
+    client.create_collection(COLLECTION_NAME, vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+    client.upsert(COLLECTION_NAME, points=[
+        PointStruct(id=index, vector=[1.0, float(index)], payload={"url": wikipedia.url(title)})
+        for index, title in enumerate(wikipedia.pages)
+    ])
+    return client
+
+
+def loaded_urls(qdrant_client):
+    points, _ = qdrant_client.scroll(COLLECTION_NAME, limit=100)
+    return {point.payload["url"] for point in points}
+
+
+def saved_documents(output_docs_dir):
+    return sorted(os.listdir(output_docs_dir))
+
+
+def test_fetch_revisions_batches_titles(wikipedia, fetcher):
+    titles = [f"Page_{index}" for index in range(3)] + [f"Missing {index}" for index in range(60)]
+
+    revisions = fetcher.fetch_revisions(titles, LANGUAGE)
+
+    assert revisions["Page_1"]["revision_id"] == 101
+    assert revisions["Page_1"]["url"] == wikipedia.url("Page 1")
+    assert revisions["Missing 0"] is None
+    assert sorted(count for _, count in wikipedia.requests) == [13, 50]
+
+
+def test_plan_refresh():
+    manifest_pages = {
+        "Same": {"revision_id": 1},
+        "Edited": {"revision_id": 1},
+        "Gone": {"revision_id": 1},
+        "Unlisted": {"revision_id": 1},
+    }
+    revisions = {
+        "Same": {"revision_id": 1},
+        "Edited": {"revision_id": 2},
+        "Gone": None,
+        "Added": {"revision_id": 1},
+        "Unknown": None,
+    }
+
+    assert plan_refresh(manifest_pages, revisions) == {
+        "new": ["Added"],
+        "changed": ["Edited"],
+        "unchanged": ["Same"],
+        "deleted": ["Gone", "Unlisted"],
+    }
+
+
+def test_refresh_commits_only_after_load(wikipedia, fetcher, manifest, qdrant_client, tmp_path):
+    output_docs_dir = str(tmp_path / "documents")
+    titles = list(wikipedia.pages)
+
+    stats = refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir, qdrant_client, COLLECTION_NAME)
+    assert stats["new"] == 3 and stats["saved"] == 3 and stats["pending"] == 3
+    assert manifest.get_all(LANGUAGE) == {}
+    assert loaded_urls(qdrant_client) == set()
+
+    # The load was skipped: the next refresh processes the same pages again
+    stats = refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir, qdrant_client, COLLECTION_NAME)
+    assert stats["new"] == 3 and stats["saved"] == 3
+    assert len(saved_documents(output_docs_dir)) == 3
+
+    assert commit_refresh(manifest, LANGUAGE) == 3
+    assert manifest.get_all(LANGUAGE)["Page 1"]["revision_id"] == 101
+    assert manifest.get_pending(LANGUAGE) == {}
+
+    stats = refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir, qdrant_client, COLLECTION_NAME)
+    assert stats["unchanged"] == 3 and stats["saved"] == 0
+    assert saved_documents(output_docs_dir) == []
+
+
+def test_refresh_keeps_documents_of_uncommitted_pages(wikipedia, fetcher, manifest, qdrant_client, tmp_path):
+    output_docs_dir = str(tmp_path / "documents")
+    titles = list(wikipedia.pages)
+    refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir)
+    commit_refresh(manifest, LANGUAGE)
+
+    wikipedia.pages["Page 1"] = (201, "Un nuovo testo sulle olimpiadi di Parigi.")
+    del wikipedia.pages["Page 2"]
+    stats = refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir, qdrant_client, COLLECTION_NAME)
+    assert stats["changed"] == 1 and stats["deleted"] == 1 and stats["unchanged"] == 1
+    assert saved_documents(output_docs_dir) == ["Page_1.json"]
+    assert loaded_urls(qdrant_client) == {wikipedia.url("Page 0")}
+
+    # The load failed and the changed page can't be fetched again: its staged revision
+    # and its document are kept until the refresh is committed
+    wikipedia.failing.add("Page 1")
+    stats = refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir, qdrant_client, COLLECTION_NAME)
+    assert stats["changed"] == 1 and stats["saved"] == 0
+    assert saved_documents(output_docs_dir) == ["Page_1.json"]
+    assert manifest.get_all(LANGUAGE)["Page 1"]["revision_id"] == 101
+
+    commit_refresh(manifest, LANGUAGE)
+    pages = manifest.get_all(LANGUAGE)
+    assert pages["Page 1"]["revision_id"] == 201
+    assert "Page 2" not in pages
+
+
+def test_commit_refuses_empty_chunks(wikipedia, fetcher, manifest, tmp_path):
+    output_docs_dir = str(tmp_path / "documents")
+    chunks_dir = str(tmp_path / "chunks")
+    titles = list(wikipedia.pages)
+    refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir)
+
+    # The chunking failed and wrote an empty store: the commit would mark the pages as loaded
+    with ChunkStoreWriter(chunks_dir, overwrite=True):
+        pass
+    with pytest.raises(ValueError):
+        commit_refresh(manifest, LANGUAGE, chunks_dir)
+    assert manifest.get_all(LANGUAGE) == {}
+    assert len(manifest.get_pending(LANGUAGE)) == 3
+
+    with ChunkStoreWriter(chunks_dir, overwrite=True) as writer:
+        writer.append([{"id": 1, "vector": [1.0, 0.0], "payload": {"url": wikipedia.url("Page 0")}}])
+    assert commit_refresh(manifest, LANGUAGE, chunks_dir) == 3
+
+    # Nothing changed, so no chunks are expected
+    refresh(titles, manifest, fetcher, LANGUAGE, output_docs_dir)
+    assert commit_refresh(manifest, LANGUAGE, str(tmp_path / "no_chunks")) == 0
@@ -0,0 +1,467 @@
+"""
+Benchmark Script
+
+This script measures the indexing and the query paths of WikiRag offline, on synthetic
+articles or on raw Wikipedia pages saved as text files, and emits the results as JSON so
+that runs on different commits can be compared:
+
+1. cleaning: `clean_text` and `remove_stopwords` throughput, in characters per second;
+2. chunking: splitting of the documents, in chunks per second;
+3. embedding: chunking, embedding and saving the chunks in a chunk store, in chunks per second;
+4. loading: `qdrant_loader` upload of the chunk store, in points per second, into a local
+   on-disk Qdrant database (or a Qdrant server with `--qdrant_url`);
+5. query: end-to-end `WikiRag.invoke` latency percentiles, overall and per stage (see
+   wiki_rag/tracing.py), for each concurrency level. The answers are generated by a stub
+   LLM with a fixed latency, and the chunks are searched in the chunk store (`--backend numpy`)
+   or in the Qdrant collection (`--backend qdrant`).
+
+No network is needed, but the embedding model must be in the local cache of
+sentence-transformers, or exported to ONNX (`--onnx_model_path`), and the NLTK stopwords
+must be installed (see document_acquisition.py); without them the stopwords are kept.
+
+Usage:
+    From the root directory of the repository:
+
+    python vectorization_pipeline/benchmark.py --output benchmarks/results.json
+
+    python vectorization_pipeline/benchmark.py --input_texts_dir data/raw_text --concurrency 1 4 16 --llm_latency 0.5 --output results.json
+
+Arguments:
+    --input_texts_dir: Optional directory of raw page texts ('.txt' files), synthetic articles are used if not given.
+    --articles: Number of synthetic articles.
+    --article_size: Size of each synthetic article in characters.
+    --language: Language of the articles ('en' for English, 'it' for Italian).
+    --stages: Stages to run ('cleaning', 'chunking', 'embedding', 'loading', 'query').
+    --chunk_size: Size of each chunk in characters.
+    --chunk_overlap: Overlap between chunks in characters.
+    --embedding_model: Name of the SentenceTransformer model to use for generating embeddings.
+    --onnx_model_path: Path of the ONNX model, possibly int8 quantized, exported from the embedding model.
+    --batch_size: Number of chunks embedded together.
+    --qdrant_url: Optional URL of a Qdrant server, the local mode is used if not given.
+    --backend: 'numpy' to search the chunk store in process, 'qdrant' to search the Qdrant collection.
+    --queries: Number of queries of each concurrency level.
+    --concurrency: Numbers of queries answered at the same time.
+    --llm_latency: Seconds the stub LLM takes to answer.
+    --web_search_latency: Seconds the stub web search takes, no web search if 0.
+    --work_dir: Optional directory of the chunk store and of the local Qdrant database, a temporary directory if not given.
+    --output: Optional path of the JSON results, printed if not given.
+    --seed: Seed of the synthetic articles and queries.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from qdrant_client import QdrantClient
+
+from document_acquisition import TOKENIZERS, clean_text, remove_stopwords
+from cleaning_benchmark import synthetic_articles, load_texts, measure
+from wikipedia_chunker import split_document, iter_document_chunks, save_chunks
+from qdrant_loader import create_qdrant_client, load_chunks_to_qdrant
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from wiki_rag import WikiRag, EmbeddingService, NumpyBackend, QdrantBackend, PrometheusExporter
+from wiki_rag.web_search import WebSearchBackend
+
+STAGES = ("cleaning", "chunking", "embedding", "loading", "query")
+COLLECTION_NAME = "wikirag_benchmark"
+
+class StubChatModel(BaseChatModel):
+    """
+    A chat model answering every question with the same text after a fixed latency.
+    """
+    answer: str = "La risposta è Atene, nel 1896."
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+class StubSearchBackend(WebSearchBackend):
+    """
+    A web search backend returning the same text after a fixed latency.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def search(self, query: str) -> str:
+        time.sleep(self.latency)
+        return f"Risultati della ricerca di '{query}'."
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize a list of latencies.
+
+    Args:
+        latencies (List[float]): The latencies in seconds.
+
+    Returns:
+        Dict[str, float]: The 'count', 'mean', 'p50', 'p90', 'p99' and 'max' latencies.
+    """
+    values = np.asarray(latencies, dtype=np.float64)
+    if not len(values):
+        return {"count": 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": len(values), "mean": float(values.mean()), "p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+def build_documents(texts: List[str], language: str) -> List[Dict]:
+    """
+    Build the documents of the articles, as the acquisition does.
+
+    Args:
+        texts (List[str]): The raw texts of the articles.
+        language (str): Language of the articles.
+
+    Returns:
+        List[Dict]: The documents.
+    """
+    documents = []
+    for index, text in enumerate(texts):
+        content = clean_text(text)
+        try:
+            content = remove_stopwords(content, language)
+        except LookupError as e:
+            if not documents:
+                print(f"Warning: Keeping the stopwords: {e}")
+        title = f"Articolo {index}"
+        documents.append({"title": title, "url": f"https://{language}.wikipedia.org/wiki/Articolo_{index}", "language": language, "content": content})
+    return documents
+
+def synthetic_queries(texts: List[str], num_queries: int, seed: int = 0) -> List[str]:
+    """
+    Generate distinct questions from random words of the articles, so that the query embeddings are not cached.
+
+    Args:
+        texts (List[str]): The texts of the articles.
+        num_queries (int): Number of questions.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[str]: The questions.
+    """
+    generator = random.Random(seed)
+    words = [word for text in texts[:10] for word in text.split()[:2000] if word.isalpha()]
+    return [f"{' '.join(generator.choices(words, k=generator.randint(5, 10)))} {index}?" for index in range(num_queries)]
+
+def benchmark_cleaning(texts: List[str], language: str, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Measure the text normalization of the acquisition.
+
+    Args:
+        texts (List[str]): The raw texts of the articles.
+        language (str): Language of the stopwords.
+        repeat (int): Number of runs of each stage, the fastest one is reported.
+
+    Returns:
+        Dict[str, Any]: By stage, the seconds and the characters and articles per second.
+    """
+    results = {}
+    cleaned = [clean_text(text) for text in texts]
+    stages = [("clean_text", clean_text, texts)]
+    for tokenizer in TOKENIZERS:
+        stages.append((f"remove_stopwords_{tokenizer}", lambda text, tokenizer=tokenizer: remove_stopwords(text, language, tokenizer), cleaned))
+    for name, stage, stage_texts in stages:
+        try:
+            seconds = measure(stage, stage_texts, repeat)
+        except LookupError as e:
+            print(f"Warning: Skipping {name}: {e}")
+            continue
+        size = sum(len(text) for text in stage_texts)
+        results[name] = {"seconds": seconds, "characters_per_second": size / seconds, "articles_per_second": len(stage_texts) / seconds}
+    return results
+
+def benchmark_chunking(documents: List[Dict], chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+    """
+    Measure the splitting of the documents into chunks.
+
+    Args:
+        documents (List[Dict]): The documents.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+
+    Returns:
+        Dict[str, Any]: The seconds, the number of chunks and the chunks per second.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    start = time.perf_counter()
+    num_chunks = sum(len(split_document(document, text_splitter)[0]) for document in documents)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "chunks": num_chunks, "chunks_per_second": num_chunks / seconds}
+
+def benchmark_embedding(documents: List[Dict], store_dir: str, chunk_size: int, chunk_overlap: int, embedding_model_name: str, onnx_model_path: Optional[str], batch_size: int) -> Dict[str, Any]:
+    """
+    Measure the chunking, the embedding and the saving of the chunks in a chunk store.
+
+    Args:
+        documents (List[Dict]): The documents.
+        store_dir (str): Directory of the chunk store.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+        batch_size (int): Number of chunks embedded together.
+
+    Returns:
+        Dict[str, Any]: The seconds, the number of chunks and the chunks per second.
+    """
+    # Load the model before the timing, it is measured by the startup and not by the throughput
+    EmbeddingService(embedding_model_name, backend="onnx" if onnx_model_path else "torch", onnx_model_path=onnx_model_path).get_sentence_embedding_dimension()
+
+    start = time.perf_counter()
+    chunks = iter_document_chunks(documents, chunk_size, chunk_overlap, embedding_model_name, batch_size, onnx_model_path=onnx_model_path)
+    num_chunks = save_chunks(chunks, store_dir, "store")
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "chunks": num_chunks, "chunks_per_second": num_chunks / seconds}
+
+def benchmark_loading(store_dir: str, qdrant_client: QdrantClient, batch_size: int = 256) -> Dict[str, Any]:
+    """
+    Measure the upload of a chunk store into a new Qdrant collection.
+
+    Args:
+        store_dir (str): Directory of the chunk store.
+        qdrant_client (QdrantClient): The Qdrant client.
+        batch_size (int): Number of points sent to Qdrant with each request.
+
+    Returns:
+        Dict[str, Any]: The seconds, the number of points and the points per second.
+    """
+    if qdrant_client.collection_exists(COLLECTION_NAME):
+        qdrant_client.delete_collection(COLLECTION_NAME)
+    start = time.perf_counter()
+    load_chunks_to_qdrant(store_dir, COLLECTION_NAME, qdrant_client, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    points = qdrant_client.count(COLLECTION_NAME, exact=True).count
+    return {"seconds": seconds, "points": points, "points_per_second": points / seconds}
+
+def benchmark_query(wiki_rag: WikiRag, queries: List[str], concurrency: int) -> Dict[str, Any]:
+    """
+    Measure the end-to-end latency of `WikiRag.invoke` with concurrent queries.
+
+    Args:
+        wiki_rag (WikiRag): The WikiRag instance.
+        queries (List[str]): The questions.
+        concurrency (int): Number of questions answered at the same time.
+
+    Returns:
+        Dict[str, Any]: The latency summary, the queries per second and the p50/p99 of each stage.
+    """
+    exporter = PrometheusExporter()
+    wiki_rag.metrics_exporter = exporter
+
+    def timed_invoke(query: str) -> float:
+        start = time.perf_counter()
+        wiki_rag.invoke(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed_invoke, queries))
+    seconds = time.perf_counter() - start
+
+    stages = {stage: summary for stage, summary in exporter.percentiles().items() if stage != "request"}
+    return {"seconds": seconds, "queries_per_second": len(queries) / seconds, "latency": latency_summary(latencies), "stages": stages}
+
+def get_environment() -> Dict[str, Any]:
+    """
+    Describe the commit and the machine of the run, to compare results across commits.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def main(
+        input_texts_dir: Optional[str],
+        articles: int,
+        article_size: int,
+        language: str,
+        stages: List[str],
+        chunk_size: int = 450,
+        chunk_overlap: int = 20,
+        embedding_model_name: str = "all-MiniLM-L6-v2",
+        onnx_model_path: Optional[str] = None,
+        batch_size: int = 64,
+        qdrant_url: Optional[str] = None,
+        backend: str = "numpy",
+        num_queries: int = 100,
+        concurrency: Optional[List[int]] = None,
+        llm_latency: float = 0.2,
+        web_search_latency: float = 0.0,
+        work_dir: Optional[str] = None,
+        output: Optional[str] = None,
+        seed: int = 0) -> Dict[str, Any]:
+    """
+    Main function to run the benchmark.
+
+    Args:
+        input_texts_dir (Optional[str]): Directory of raw page texts, synthetic articles are used if None.
+        articles (int): Number of synthetic articles.
+        article_size (int): Size of each synthetic article in characters.
+        language (str): Language of the articles.
+        stages (List[str]): Stages to run.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+        batch_size (int): Number of chunks embedded together.
+        qdrant_url (Optional[str]): URL of a Qdrant server, None uses the local mode.
+        backend (str): 'numpy' to search the chunk store, 'qdrant' to search the Qdrant collection.
+        num_queries (int): Number of queries of each concurrency level.
+        concurrency (Optional[List[int]]): Numbers of queries answered at the same time, 1 and 8 if None.
+        llm_latency (float): Seconds the stub LLM takes to answer.
+        web_search_latency (float): Seconds the stub web search takes, no web search if 0.
+        work_dir (Optional[str]): Directory of the chunk store and of the local Qdrant database, a temporary directory if None.
+        output (Optional[str]): Path of the JSON results, printed if None.
+        seed (int): Seed of the synthetic articles and queries.
+
+    Returns:
+        Dict[str, Any]: The results.
+    """
+    texts = load_texts(input_texts_dir) if input_texts_dir else synthetic_articles(articles, article_size, seed)
+    results: Dict[str, Any] = {
+        "environment": get_environment(),
+        "config": {
+            "articles": len(texts), "characters": sum(len(text) for text in texts), "language": language,
+            "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "embedding_model": embedding_model_name,
+            "onnx_model_path": onnx_model_path, "batch_size": batch_size, "backend": backend,
+            "qdrant": qdrant_url or "local", "queries": num_queries, "llm_latency": llm_latency,
+            "web_search_latency": web_search_latency,
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="wikirag_benchmark_") as temp_dir:
+        work_dir = work_dir or temp_dir
+        store_dir = os.path.join(work_dir, "chunk_store")
+
+        if "cleaning" in stages:
+            print("Benchmarking the cleaning...")
+            results["results"]["cleaning"] = benchmark_cleaning(texts, language)
+
+        documents = build_documents(texts, language)
+        if "chunking" in stages:
+            print("Benchmarking the chunking...")
+            results["results"]["chunking"] = benchmark_chunking(documents, chunk_size, chunk_overlap)
+
+        # The next stages need the chunk store, and the query with the qdrant backend the collection
+        needs_collection = "loading" in stages or ("query" in stages and backend == "qdrant")
+        if "embedding" in stages or needs_collection or "query" in stages:
+            print("Benchmarking the embedding...")
+            results["results"]["embedding"] = benchmark_embedding(documents, store_dir, chunk_size, chunk_overlap, embedding_model_name, onnx_model_path, batch_size)
+
+        qdrant_client = None
+        if needs_collection:
+            print("Benchmarking the loading...")
+            qdrant_client = create_qdrant_client(url=qdrant_url) if qdrant_url else QdrantClient(path=os.path.join(work_dir, "qdrant"))
+            results["results"]["loading"] = benchmark_loading(store_dir, qdrant_client)
+
+        if "query" in stages:
+            embeddings = EmbeddingService(embedding_model_name, backend="onnx" if onnx_model_path else "torch", onnx_model_path=onnx_model_path)
+            search_backend = NumpyBackend(store_dir) if backend == "numpy" else QdrantBackend(qdrant_client, COLLECTION_NAME)
+            wiki_rag = WikiRag(
+                backend=search_backend,
+                embeddings=embeddings,
+                llm=StubChatModel(latency=llm_latency),
+                expand_context=web_search_latency > 0,
+                web_search_backend=StubSearchBackend(web_search_latency),
+                web_search_cache_size=0,
+                score_threshold=0.0,
+            )
+            wiki_rag.invoke("Warm-up")
+
+            results["results"]["query"] = {}
+            for level in concurrency or [1, 8]:
+                print(f"Benchmarking the query with concurrency {level}...")
+                # New queries for each level, so that the query embeddings are not cached
+                queries = synthetic_queries(texts, num_queries, seed + level)
+                results["results"]["query"][str(level)] = benchmark_query(wiki_rag, queries, level)
+            wiki_rag.close()
+
+        if qdrant_client is not None:
+            qdrant_client.close()
+
+    report = json.dumps(results, indent=2)
+    if output:
+        output_dir = os.path.dirname(output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+        print(f"Results saved in '{output}'.")
+    else:
+        print(report)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WikiRag Benchmark")
+    parser.add_argument("--input_texts_dir", type=str, default=None, help="Optional directory of raw page texts ('.txt' files), synthetic articles are used if not given.")
+    parser.add_argument("--articles", type=int, default=50, help="Number of synthetic articles (default is 50).")
+    parser.add_argument("--article_size", type=int, default=20000, help="Size of each synthetic article in characters (default is 20000).")
+    parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the articles (default is 'it').")
+    parser.add_argument("--stages", type=str, nargs="+", default=list(STAGES), choices=list(STAGES), help="Stages to run (default is all of them).")
+    parser.add_argument("--chunk_size", type=int, default=450, help="Size of each chunk in characters (default is 450).")
+    parser.add_argument("--chunk_overlap", type=int, default=20, help="Overlap between chunks in characters (default is 20).")
+    parser.add_argument("--embedding_model", type=str, default="all-MiniLM-L6-v2", help="Name of the SentenceTransformer model to use (default is 'all-MiniLM-L6-v2').")
+    parser.add_argument("--onnx_model_path", type=str, default=None, help="Path of the ONNX model, possibly int8 quantized, exported from the embedding model (default is the torch model).")
+    parser.add_argument("--batch_size", type=int, default=64, help="Number of chunks embedded together (default is 64).")
+    parser.add_argument("--qdrant_url", type=str, default=None, help="Optional URL of a Qdrant server (default is the local mode).")
+    parser.add_argument("--backend", type=str, default="numpy", choices=["numpy", "qdrant"], help="'numpy' to search the chunk store, 'qdrant' to search the Qdrant collection (default is 'numpy').")
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries of each concurrency level (default is 100).")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Numbers of queries answered at the same time (default is 1 and 8).")
+    parser.add_argument("--llm_latency", type=float, default=0.2, help="Seconds the stub LLM takes to answer (default is 0.2).")
+    parser.add_argument("--web_search_latency", type=float, default=0.0, help="Seconds the stub web search takes, no web search if 0 (default is 0).")
+    parser.add_argument("--work_dir", type=str, default=None, help="Optional directory of the chunk store and of the local Qdrant database (default is a temporary directory).")
+    parser.add_argument("--output", type=str, default=None, help="Optional path of the JSON results (default is printed).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic articles and queries (default is 0).")
+
+    args = parser.parse_args()
+
+    main(
+        args.input_texts_dir,
+        args.articles,
+        args.article_size,
+        args.language,
+        args.stages,
+        args.chunk_size,
+        args.chunk_overlap,
+        args.embedding_model,
+        args.onnx_model_path,
+        args.batch_size,
+        args.qdrant_url,
+        args.backend,
+        args.queries,
+        args.concurrency,
+        args.llm_latency,
+        args.web_search_latency,
+        args.work_dir,
+        args.output,
+        args.seed,
+    )
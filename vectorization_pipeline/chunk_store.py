@@ -0,0 +1,323 @@
+"""
+Chunk Store Script
+
+This module contains a compact, columnar format for the chunks produced by the
+chunker, replacing the one-JSON-file-per-chunk layout. A chunk store is a directory with:
+
+- `vectors.npy`: a float32 matrix with one embedding per row, memory-mappable with `np.load(mmap_mode='r')`;
+- `payloads.jsonl`: one line per row with the point `id` and its `payload`.
+
+The store is written in append mode, so the chunker can add chunks as soon as they
+are embedded, and read zero-copy by the loader.
+
+The script converts an existing directory of JSON chunks into a chunk store.
+
+Usage:
+    conda env create -f wiki_rag.yaml
+    conda activate wiki_rag
+
+    From the root directory of the repository:
+
+    python vectorization_pipeline/chunk_store.py --chunks_dir data/chunks --store_dir data/chunk_store
+
+Arguments:
+    --chunks_dir: Directory containing JSON files of chunks.
+    --store_dir: Directory where the chunk store will be written.
+"""
+
+import os
+import json
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+PAYLOADS_FILE = "payloads.jsonl"
+
+
+def _write_vectors_header(vectors_file, num_rows: int, dim: int) -> None:
+    """
+    Write the .npy header of the vectors matrix at the beginning of the file.
+    """
+    vectors_file.seek(0)
+    np.lib.format.write_array_header_1_0(
+        vectors_file,
+        {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)), 'fortran_order': False, 'shape': (num_rows, dim)}
+    )
+
+
+def _read_vectors_header(vectors_path: str) -> Tuple[int, int, int]:
+    """
+    Read the .npy header of the vectors matrix.
+
+    Returns:
+        Tuple[int, int, int]: the number of rows in the header, the vector size and the header length in bytes.
+    """
+    with open(vectors_path, 'rb') as vectors_file:
+        np.lib.format.read_magic(vectors_file)
+        shape, _, _ = np.lib.format.read_array_header_1_0(vectors_file)
+        return shape[0], shape[1], vectors_file.tell()
+
+
+class ChunkStoreWriter:
+    """
+    A class used to append chunks to a chunk store.
+    """
+
+    def __init__(self, store_dir: str, dim: Optional[int] = None, overwrite: bool = False):
+        """
+        Constructor of the class. If the store already exists, new chunks are appended to it;
+        rows left by an interrupted writer are discarded.
+
+        Args:
+        store_dir (str): the directory of the chunk store
+        dim (Optional[int]): the size of the vectors, inferred from the first chunk if None
+        overwrite (bool): if True, an existing store is emptied instead of being appended to
+        """
+        self.store_dir = store_dir
+        self.dim = dim
+        self.count = 0
+        self._vectors_file = None
+        self._payloads_file = None
+
+        os.makedirs(store_dir, exist_ok=True)
+        vectors_path = os.path.join(store_dir, VECTORS_FILE)
+        if os.path.exists(vectors_path) and not overwrite:
+            self._reopen(vectors_path)
+        elif overwrite:
+            # Remove the previous store now, so that it doesn't survive a writer that appends no rows
+            for name in (VECTORS_FILE, PAYLOADS_FILE):
+                if os.path.exists(os.path.join(store_dir, name)):
+                    os.remove(os.path.join(store_dir, name))
+
+    def _reopen(self, vectors_path: str) -> None:
+        """
+        Reopen an existing store, keeping only the rows present in both files.
+        """
+        _, self.dim, self._header_size = _read_vectors_header(vectors_path)
+        vector_rows = (os.path.getsize(vectors_path) - self._header_size) // (4 * self.dim)
+
+        payloads_path = os.path.join(self.store_dir, PAYLOADS_FILE)
+        payload_offsets = []
+        with open(payloads_path, 'rb') as payloads_file:
+            offset = 0
+            for line in payloads_file:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                payload_offsets.append(offset)
+
+        self.count = min(vector_rows, len(payload_offsets))
+        self._vectors_file = open(vectors_path, 'r+b')
+        self._vectors_file.truncate(self._header_size + 4 * self.dim * self.count)
+        self._vectors_file.seek(0, os.SEEK_END)
+        self._payloads_file = open(payloads_path, 'r+b')
+        self._payloads_file.truncate(payload_offsets[self.count - 1] if self.count else 0)
+        self._payloads_file.seek(0, os.SEEK_END)
+
+    def _create(self, dim: int) -> None:
+        """
+        Create the files of an empty store.
+        """
+        self.dim = dim
+        self._vectors_file = open(os.path.join(self.store_dir, VECTORS_FILE), 'w+b')
+        _write_vectors_header(self._vectors_file, 0, dim)
+        self._header_size = self._vectors_file.tell()
+        self._payloads_file = open(os.path.join(self.store_dir, PAYLOADS_FILE), 'w+b')
+
+    def append(self, chunks: List[Dict]) -> None:
+        """
+        Method to append chunks to the store
+
+        Args:
+        chunks (List[Dict]): the chunks, following the schema of `wikipedia_chunker.process_documents`
+        """
+        if not chunks:
+            return
+        vectors = np.asarray([chunk['vector'] for chunk in chunks], dtype=np.float32)
+        self.append_arrays([chunk['id'] for chunk in chunks], vectors, [chunk['payload'] for chunk in chunks])
+
+    def append_arrays(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict]) -> None:
+        """
+        Method to append rows to the store
+
+        Args:
+        ids (List[str]): the point IDs
+        vectors (np.ndarray): the vectors, one per row
+        payloads (List[Dict]): the payloads
+        """
+        if self._vectors_file is None:
+            self._create(self.dim or vectors.shape[1])
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of size {self.dim}, got {vectors.shape[1]}")
+
+        self._vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._payloads_file.write(b''.join(
+            json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False).encode('utf-8') + b'\n'
+            for point_id, payload in zip(ids, payloads)
+        ))
+        self.count += len(ids)
+
+    def close(self) -> None:
+        """
+        Method to flush the store, updating the number of rows in the header of the vectors matrix
+        """
+        if self._vectors_file is None:
+            return
+        _write_vectors_header(self._vectors_file, self.count, self.dim)
+        if self._vectors_file.tell() != self._header_size:
+            raise RuntimeError("The header of the vectors matrix changed size")
+        self._vectors_file.close()
+        self._payloads_file.close()
+        self._vectors_file = None
+        self._payloads_file = None
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ChunkStoreReader:
+    """
+    A class used to read a chunk store, memory-mapping its vectors.
+    """
+
+    def __init__(self, store_dir: str):
+        """
+        Constructor of the class
+
+        Args:
+        store_dir (str): the directory of the chunk store
+        """
+        self.store_dir = store_dir
+        self.vectors = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode='r')
+
+    @property
+    def dim(self) -> int:
+        """
+        Size of the vectors
+        """
+        return self.vectors.shape[1]
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def iter_payloads(self, start: int = 0) -> Iterator[Tuple[str, Dict]]:
+        """
+        Method to iterate over the point IDs and payloads
+
+        Args:
+        start (int): the index of the first row
+
+        Returns:
+            Iterator[Tuple[str, Dict]]: the point ID and the payload of each row.
+        """
+        with open(os.path.join(self.store_dir, PAYLOADS_FILE), 'r', encoding='utf-8') as payloads_file:
+            for index, line in enumerate(payloads_file):
+                if index >= len(self):
+                    break
+                if index >= start:
+                    row = json.loads(line)
+                    yield row['id'], row['payload']
+
+    def iter_batches(self, batch_size: int, start: int = 0) -> Iterator[Tuple[int, List[str], np.ndarray, List[Dict]]]:
+        """
+        Method to iterate over the rows in batches. The vectors are views of the memory-mapped matrix.
+
+        Args:
+        batch_size (int): the number of rows of each batch
+        start (int): the index of the first row
+
+        Returns:
+            Iterator[Tuple[int, List[str], np.ndarray, List[Dict]]]: the index of the first row of the batch,
+            the point IDs, the vectors and the payloads.
+        """
+        ids, payloads = [], []
+        offset = start
+        for point_id, payload in self.iter_payloads(start):
+            ids.append(point_id)
+            payloads.append(payload)
+            if len(ids) == batch_size:
+                yield offset, ids, self.vectors[offset:offset + len(ids)], payloads
+                offset += len(ids)
+                ids, payloads = [], []
+        if ids:
+            yield offset, ids, self.vectors[offset:offset + len(ids)], payloads
+
+
+def is_chunk_store(path: str) -> bool:
+    """
+    Check whether a directory is a chunk store.
+
+    Args:
+        path (str): Path of the directory.
+
+    Returns:
+        bool: True if the directory contains a chunk store.
+    """
+    return os.path.exists(os.path.join(path, VECTORS_FILE))
+
+
+def merge_chunk_stores(source_dirs: List[str], store_dir: str) -> int:
+    """
+    Append the rows of many chunk stores to a single store.
+
+    Args:
+        source_dirs (List[str]): Directories of the chunk stores to merge.
+        store_dir (str): Directory of the merged chunk store.
+
+    Returns:
+        int: The number of rows in the merged store.
+    """
+    with ChunkStoreWriter(store_dir) as writer:
+        for source_dir in source_dirs:
+            if not is_chunk_store(source_dir):
+                continue
+            reader = ChunkStoreReader(source_dir)
+            for _, ids, vectors, payloads in reader.iter_batches(4096):
+                writer.append_arrays(ids, vectors, payloads)
+        return writer.count
+
+
+def convert_json_chunks(chunks_dir: str, store_dir: str, batch_size: int = 4096) -> int:
+    """
+    Convert a directory of JSON chunks into a chunk store.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks.
+        store_dir (str): Directory where the chunk store will be written, replacing an existing one.
+        batch_size (int): Number of chunks written together.
+
+    Returns:
+        int: The number of chunks converted.
+    """
+    with ChunkStoreWriter(store_dir, overwrite=True) as writer:
+        batch = []
+        for filename in os.listdir(chunks_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(chunks_dir, filename), 'r', encoding='utf-8') as json_file:
+                    batch.append(json.load(json_file))
+            except Exception as e:
+                print(f"Error: Failed to read chunk file {filename}: {e}")
+                continue
+            if len(batch) == batch_size:
+                writer.append(batch)
+                batch = []
+        writer.append(batch)
+        return writer.count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON chunks to chunk store converter")
+    parser.add_argument("--chunks_dir", type=str, required=True, help="Directory containing JSON files of chunks.")
+    parser.add_argument("--store_dir", type=str, required=True, help="Directory where the chunk store will be written.")
+
+    args = parser.parse_args()
+
+    count = convert_json_chunks(args.chunks_dir, args.store_dir)
+    print(f"Converted {count} chunks into '{args.store_dir}'.")
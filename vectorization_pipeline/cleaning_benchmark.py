@@ -0,0 +1,220 @@
+"""
+Text Cleaning Benchmark Script
+
+This script measures the throughput of the text normalization of the acquisition
+(`clean_text` and `remove_stopwords` of document_acquisition.py) over large articles,
+either synthetic ones or raw Wikipedia pages saved as text files. On big corpora the
+cleaning can cost as much CPU as the embedding.
+
+Before measuring, `clean_text` is checked against the original implementation on the
+benchmarked articles and on random short texts mixing references, links and short words:
+a different output would change the content hashes and the point IDs of the chunks.
+
+Usage:
+    From the root directory of the repository:
+
+    python vectorization_pipeline/cleaning_benchmark.py --articles 20 --article_size 1000000
+
+    python vectorization_pipeline/cleaning_benchmark.py --input_texts_dir data/raw_text --language en
+
+Arguments:
+    --input_texts_dir: Optional directory of raw page texts ('.txt' files), synthetic articles are used if not given.
+    --articles: Number of synthetic articles.
+    --article_size: Size of each synthetic article in characters.
+    --language: Language of the stopwords ('en' for English, 'it' for Italian).
+    --tokenizers: Tokenizers to benchmark ('simple', 'nltk').
+    --repeat: Number of runs of each stage, the fastest one is reported.
+    --parity_samples: Number of random texts of the parity check (default is 20000).
+"""
+
+import os
+import re
+import time
+import random
+import argparse
+from typing import Callable, List, Optional
+
+from document_acquisition import TOKENIZERS, clean_text, remove_stopwords
+
+# Words of a synthetic article, with short words, punctuation, references and links
+SYNTHETIC_WORDS = (
+    "I Giochi della I Olimpiade si svolsero ad Atene nel 1896 , e furono i primi Giochi olimpici "
+    "dell'era moderna . Vi parteciparono 241 atleti di 14 nazioni ; il barone Pierre de Coubertin "
+    "fondò il Comitato Olimpico Internazionale ( CIO ) . The Games were held in the Panathenaic "
+    "Stadium , which was renovated for the event [1] . See https://www.olympics.com/en/olympic-games/athens-1896"
+).split()
+
+def synthetic_articles(articles: int, article_size: int, seed: int = 0) -> List[str]:
+    """
+    Generate synthetic articles, paragraphs of random words.
+
+    Args:
+        articles (int): Number of articles.
+        article_size (int): Size of each article in characters.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[str]: The articles.
+    """
+    generator = random.Random(seed)
+    texts = []
+    for _ in range(articles):
+        words, size = [], 0
+        while size < article_size:
+            word = generator.choice(SYNTHETIC_WORDS)
+            # A paragraph every 80 words, as in the plain text of the Wikipedia pages
+            words.append(word + ("\n\n" if generator.random() < 1 / 80 else " "))
+            size += len(words[-1])
+        texts.append("".join(words))
+    return texts
+
+# Fragments of the random texts of the parity check
+PARITY_FRAGMENTS = ("[1]", "[", "]", "12", "http://", "https://", "://", "/", "a", "yy", "zzè", "x1a", " ", "\n", ".", "-", "_")
+
+def baseline_clean_text(text: str) -> str:
+    """
+    The original implementation of `clean_text`, the reference of the parity check.
+
+    Args:
+        text (str): The original text.
+
+    Returns:
+        str: The cleaned text.
+    """
+    text = re.sub(r'\[\d+\]', '', text)  # Remove references (e.g., [1], [2])
+    text = re.sub(r'https?:\/\/.*\/\w*', '', text)  # Remove hyperlinks
+    text = re.sub(r'\b\w{1,2}\b', '', text)  # Remove words with less than 2 characters
+    text = re.sub(r'[^\w\s]', ' ', text)  # Remove punctuation
+    text = re.sub(r'\s\s+', ' ', text).strip()  # Remove extra spaces
+    text = text.lower()  # Convert to lowercase
+    return text
+
+def parity_texts(samples: int, seed: int = 0) -> List[str]:
+    """
+    Generate random short texts of fragments that interact in the cleaning.
+
+    Args:
+        samples (int): Number of texts.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[str]: The texts.
+    """
+    generator = random.Random(seed)
+    return ["".join(generator.choices(PARITY_FRAGMENTS, k=generator.randint(1, 12))) for _ in range(samples)]
+
+def check_parity(texts: List[str]) -> Optional[str]:
+    """
+    Compare the words of `clean_text` with the ones of the original implementation.
+
+    Whitespace is not compared, since the cleaned text is split into words by `remove_stopwords`.
+
+    Args:
+        texts (List[str]): The texts.
+
+    Returns:
+        Optional[str]: The first text with different words, None if all of them match.
+    """
+    for text in texts:
+        if clean_text(text).split() != baseline_clean_text(text).split():
+            return text
+    return None
+
+def load_texts(input_texts_dir: str) -> List[str]:
+    """
+    Load the raw page texts of a directory.
+
+    Args:
+        input_texts_dir (str): Directory containing the '.txt' files.
+
+    Returns:
+        List[str]: The texts.
+    """
+    texts = []
+    for filename in sorted(os.listdir(input_texts_dir)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(input_texts_dir, filename), "r", encoding="utf-8") as file:
+                texts.append(file.read())
+    return texts
+
+def measure(stage: Callable[[str], str], texts: List[str], repeat: int) -> float:
+    """
+    Measure the fastest run of a stage over all the texts.
+
+    Args:
+        stage (Callable[[str], str]): The function processing a text.
+        texts (List[str]): The texts.
+        repeat (int): Number of runs.
+
+    Returns:
+        float: The seconds of the fastest run.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            stage(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(
+        input_texts_dir: str,
+        articles: int,
+        article_size: int,
+        language: str,
+        tokenizers: List[str],
+        repeat: int = 3,
+        parity_samples: int = 20000) -> None:
+    """
+    Main function to benchmark the text cleaning.
+
+    Args:
+        input_texts_dir (str): Optional directory of raw page texts, synthetic articles are used if None.
+        articles (int): Number of synthetic articles.
+        article_size (int): Size of each synthetic article in characters.
+        language (str): Language of the stopwords.
+        tokenizers (List[str]): Tokenizers to benchmark.
+        repeat (int): Number of runs of each stage.
+        parity_samples (int): Number of random texts of the parity check.
+    """
+    texts = load_texts(input_texts_dir) if input_texts_dir else synthetic_articles(articles, article_size)
+    size = sum(len(text) for text in texts)
+
+    mismatch = check_parity(texts + parity_texts(parity_samples))
+    if mismatch is not None:
+        raise ValueError(
+            f"clean_text differs from the original implementation on {mismatch!r}: "
+            f"{clean_text(mismatch)!r} instead of {baseline_clean_text(mismatch)!r}"
+        )
+    print(f"clean_text matches the original implementation on {len(texts) + parity_samples} texts.")
+    print(f"Benchmarking {len(texts)} articles, {size / 1e6:.1f} M characters, best of {repeat} runs.")
+
+    stages = [("clean_text", clean_text)]
+    cleaned = [clean_text(text) for text in texts]
+    for tokenizer in tokenizers:
+        stages.append((f"remove_stopwords ({tokenizer})", lambda text, tokenizer=tokenizer: remove_stopwords(text, language, tokenizer)))
+
+    for name, stage in stages:
+        # The stopwords are removed from the cleaned text, as in `build_document`
+        stage_texts = texts if name == "clean_text" else cleaned
+        try:
+            seconds = measure(stage, stage_texts, repeat)
+        except LookupError as e:
+            print(f"Warning: Skipping {name}: {e}")
+            continue
+        stage_size = sum(len(text) for text in stage_texts)
+        print(f"{name}: {seconds:.3f}s, {stage_size / 1e6 / seconds:.1f} M characters/s, {len(stage_texts) / seconds:.1f} articles/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Text Cleaning Benchmark")
+    parser.add_argument("--input_texts_dir", type=str, default=None, help="Optional directory of raw page texts ('.txt' files), synthetic articles are used if not given.")
+    parser.add_argument("--articles", type=int, default=20, help="Number of synthetic articles (default is 20).")
+    parser.add_argument("--article_size", type=int, default=1000000, help="Size of each synthetic article in characters (default is 1000000).")
+    parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the stopwords (default is 'it').")
+    parser.add_argument("--tokenizers", type=str, nargs="+", default=list(TOKENIZERS), choices=list(TOKENIZERS), help="Tokenizers to benchmark (default is all of them).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each stage, the fastest one is reported (default is 3).")
+    parser.add_argument("--parity_samples", type=int, default=20000, help="Number of random texts of the parity check (default is 20000).")
+
+    args = parser.parse_args()
+
+    main(args.input_texts_dir, args.articles, args.article_size, args.language, args.tokenizers, args.repeat, args.parity_samples)
@@ -13,28 +13,53 @@ Usage from the root directory of the repository:
 
     python vectorization_pipeline/document_acquisition.py --input_urls wikipedia_urls.txt --output_docs_dir data/raw_document
 
+    Concurrent acquisition with 16 workers:
+
+    python vectorization_pipeline/document_acquisition.py --input_urls wikipedia_urls.txt --output_docs_dir data/raw_document --workers 16
+
 Arguments:
     --input_urls_file: Path to the file containing Wikipedia URLs.
     --output_docs_dir: Directory where the processed JSON files will be saved.
     --language: Language of the Wikipedia pages ('en' for English, 'it' for Italian, etc.).
+    --workers: Number of pages fetched in parallel (default is 1, the serial wikipediaapi path).
+    --api_url: MediaWiki API endpoint used by the concurrent mode, '{language}' is replaced with the language.
+    --requests_per_second: Maximum number of requests per second sent to each host in concurrent mode.
+    --tokenizer: 'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer.
+
+The NLTK data is never downloaded: it is loaded from the directory of the NLTK_DATA
+environment variable, or from data/nltk_data. Download it once with:
+
+    python -m nltk.downloader -d data/nltk_data stopwords punkt_tab
 """
 
 import os
 import json
 import re
 import argparse
-from typing import List, Dict
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, List
 from urllib.parse import urlparse, unquote
 
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
 import wikipediaapi
 
-# Dowlnoad the stopwords 
-nltk.download('punkt', force=True)
-nltk.download('punkt_tab', force=True)
-nltk.download('stopwords', force=True)
+from wikipedia_fetcher import WikipediaFetcher, DEFAULT_API_URL
+
+# Local directory of the NLTK data, searched before the NLTK default paths
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA", os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "nltk_data")))
+
+# NLTK names of the supported languages
+LANGUAGES = {'en': 'english', 'it': 'italian'}
+
+TOKENIZERS = ('simple', 'nltk')
+
+# References (e.g. [1]) and hyperlinks, removed in this order before splitting the words.
+# The two passes must stay separate: a reference inside or after a link changes what the
+# link pattern matches, and any change of the content changes the point IDs of the chunks
+REFERENCE_PATTERN = re.compile(r'\[\d+\]')
+LINK_PATTERN = re.compile(r'https?:\/\/.*\/\w*')
+
+# Words of at least 3 characters: shorter words and punctuation are dropped while matching
+WORD_PATTERN = re.compile(r'\w{3,}')
 
 def load_wikipedia_urls(file_path: str) -> List[str]:
     """
@@ -72,15 +97,99 @@ def clean_text(text: str) -> str:
         text (str): The original text.
 
     Returns:
-        str: The cleaned text.
+        str: The cleaned text, lowercase words separated by single spaces.
+    """
+    # Most pages have no references nor links, the substring checks are much faster than the regex
+    if '[' in text:
+        text = REFERENCE_PATTERN.sub('', text)
+    if '://' in text:
+        text = LINK_PATTERN.sub('', text)
+    return ' '.join(WORD_PATTERN.findall(text)).lower()
+
+def load_nltk_resource(loader: Callable[[], Any], package: str) -> Any:
     """
-    text = re.sub(r'\[\d+\]', '', text)  # Remove references (e.g., [1], [2])
-    text = re.sub(r'https?:\/\/.*\/\w*', '', text)  # Remove hyperlinks
-    text = re.sub(r'\b\w{1,2}\b', '', text)  # Remove words with less than 2 characters
-    text = re.sub(r'[^\w\s]', ' ', text)  # Remove punctuation
-    text = re.sub(r'\s\s+', ' ', text).strip()  # Remove extra spaces
-    text = text.lower()  # Convert to lowercase
-    return text
+    Load an NLTK resource from the local NLTK data, without downloading it.
+
+    Args:
+        loader (Callable[[], Any]): Function loading the resource.
+        package (str): Name of the NLTK package of the resource.
+
+    Returns:
+        Any: The resource.
+    """
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    try:
+        return loader()
+    except LookupError:
+        raise LookupError(
+            f"The NLTK package '{package}' is missing, download it with: "
+            f"python -m nltk.downloader -d {NLTK_DATA_DIR} {package}"
+        ) from None
+
+@lru_cache(maxsize=None)
+def get_stopwords(language: str) -> FrozenSet[str]:
+    """
+    Get the stopwords of a language, loaded once and then reused.
+
+    Args:
+        language (str): The language of the stopwords.
+
+    Returns:
+        FrozenSet[str]: The stopwords.
+    """
+    if language not in LANGUAGES:
+        raise ValueError(f"Unsupported language: {language}")
+
+    def loader():
+        from nltk.corpus import stopwords
+        return frozenset(stopwords.words(LANGUAGES[language]))
+
+    return load_nltk_resource(loader, 'stopwords')
+
+def tokenize(content: str, language: str, tokenizer: str = 'simple') -> List[str]:
+    """
+    Split the content into words.
+
+    Args:
+        content (str): The text content to split.
+        language (str): The language of the content.
+        tokenizer (str): 'simple' to split on whitespace, enough for the output of `clean_text`,
+            or 'nltk' for the NLTK word tokenizer.
+
+    Returns:
+        List[str]: The words.
+    """
+    if tokenizer == 'simple':
+        return content.split()
+    if tokenizer != 'nltk':
+        raise ValueError(f"Unsupported tokenizer: {tokenizer}")
+
+    def loader():
+        from nltk.tokenize import word_tokenize
+        return word_tokenize(content, language=LANGUAGES.get(language, 'english'))
+
+    return load_nltk_resource(loader, 'punkt_tab')
+
+@lru_cache(maxsize=None)
+def get_wikipedia_client(language: str) -> wikipediaapi.Wikipedia:
+    """
+    Get the Wikipedia API client of a language, created once and then reused
+    so that its HTTP session keeps the connection alive between pages.
+
+    Args:
+        language (str): The language of the Wikipedia pages.
+
+    Returns:
+        wikipediaapi.Wikipedia: The Wikipedia API client.
+    """
+    return wikipediaapi.Wikipedia(
+        user_agent='WikiRag (mauo.andretta222@gmail.com)',
+        language=language,
+        extract_format=wikipediaapi.ExtractFormat.WIKI
+    )
 
 def scrape_wikipedia(title: str, language: str) -> wikipediaapi.WikipediaPage:
     """
@@ -93,36 +202,60 @@ def scrape_wikipedia(title: str, language: str) -> wikipediaapi.WikipediaPage:
     Returns:
         wikipediaapi.WikipediaPage: The Wikipedia API object for the page.
     """
-    wiki_wiki = wikipediaapi.Wikipedia(
-        user_agent='WikiRag (mauo.andretta222@gmail.com)',
-        language=language,
-        extract_format=wikipediaapi.ExtractFormat.WIKI
-    )
+    wiki_wiki = get_wikipedia_client(language)
     p_wiki = wiki_wiki.page(title)
     return p_wiki
 
-def remove_stopwords(content: str, language: str) -> str:
+def remove_stopwords(content: str, language: str, tokenizer: str = 'simple') -> str:
     """
     Tokenize the content and remove stopwords based on the specified language.
 
     Args:
         content (str): The text content to process.
         language (str): The language of the content.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
 
     Returns:
         str: The content with stopwords removed.
     """
-    if language == 'en':
-        stop_words = set(stopwords.words('english'))
-    elif language == 'it':
-        stop_words = set(stopwords.words('italian'))
-    else:
-        raise ValueError(f"Unsupported language: {language}")
-        
-    tokens = word_tokenize(content)
+    stop_words = get_stopwords(language)
+    tokens = tokenize(content, language, tokenizer)
     filtered_content = [token for token in tokens if token.lower() not in stop_words]
     return ' '.join(filtered_content)
 
+def build_document(title: str, url: str, language: str, text: str, tokenizer: str = 'simple') -> Dict:
+    """
+    Build a processed document from the raw text of a Wikipedia page.
+
+    Args:
+        title (str): The title of the Wikipedia page.
+        url (str): The URL of the Wikipedia page.
+        language (str): The language of the Wikipedia page.
+        text (str): The raw text of the Wikipedia page.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+
+    Returns:
+        Dict: The document with cleaned content and stopwords removed.
+    """
+    return {
+        'title': title,
+        'url': url,
+        'language': language,
+        'content': remove_stopwords(clean_text(text), language, tokenizer),
+    }
+
+def document_filename(title: str) -> str:
+    """
+    Get the name of the JSON file of a document.
+
+    Args:
+        title (str): The title of the document.
+
+    Returns:
+        str: The name of the file.
+    """
+    return f"{title.replace(' ', '_').replace('/', '_')}.json"
+
 def save_documents_as_json(documents: Dict[str, Dict], output_dir: str) -> None:
     """
     Save the processed documents as individual JSON files in the specified directory.
@@ -134,15 +267,52 @@ def save_documents_as_json(documents: Dict[str, Dict], output_dir: str) -> None:
     os.makedirs(output_dir, exist_ok=True)
 
     for title, doc in documents.items():
-        filename = f"{title.replace(' ', '_').replace('/', '_')}.json"
-        filepath = os.path.join(output_dir, filename)
+        filepath = os.path.join(output_dir, document_filename(title))
         
         with open(filepath, 'w', encoding='utf-8') as json_file:
             json.dump(doc, json_file, ensure_ascii=False, indent=4)
 
         print(f"Document for '{title}' saved as '{filepath}'")
 
-def main(input_urls_file: str, output_dir: str, language: str) -> None:
+def acquire_documents_concurrently(
+        titles: List[str],
+        output_dir: str,
+        language: str,
+        workers: int,
+        api_url: str = DEFAULT_API_URL,
+        requests_per_second: float = 20.0,
+        tokenizer: str = 'simple') -> None:
+    """
+    Fetch the Wikipedia pages in parallel and save each document as soon as it is processed.
+
+    Args:
+        titles (List[str]): Titles of the Wikipedia pages.
+        output_dir (str): Directory where the processed JSON files will be saved.
+        language (str): Language of the Wikipedia pages.
+        workers (int): Number of pages fetched in parallel.
+        api_url (str): MediaWiki API endpoint, '{language}' is replaced with the language.
+        requests_per_second (float): Maximum number of requests per second sent to each host.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+    """
+    fetcher = WikipediaFetcher(workers=workers, api_url=api_url, requests_per_second=requests_per_second)
+    try:
+        for title, page in fetcher.fetch_pages(titles, language):
+            if page is None:
+                print(f"Warning: Page '{title}' not found. Skipping page.")
+                continue
+            document = build_document(page['title'], page['url'], page['language'], page['text'], tokenizer)
+            save_documents_as_json({title: document}, output_dir)
+    finally:
+        fetcher.close()
+
+def main(
+        input_urls_file: str,
+        output_dir: str,
+        language: str,
+        workers: int = 1,
+        api_url: str = DEFAULT_API_URL,
+        requests_per_second: float = 20.0,
+        tokenizer: str = 'simple') -> None:
     """
     Main function to process Wikipedia pages.
 
@@ -150,6 +320,10 @@ def main(input_urls_file: str, output_dir: str, language: str) -> None:
         input_urls_file (str): Path to the file containing Wikipedia URLs.
         output_dir (str): Directory where the processed JSON files will be saved.
         language (str): Language of the Wikipedia pages.
+        workers (int): Number of pages fetched in parallel, 1 keeps the serial wikipediaapi path.
+        api_url (str): MediaWiki API endpoint used by the concurrent mode.
+        requests_per_second (float): Maximum number of requests per second sent to each host in concurrent mode.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
     """
     # Load Wikipedia URLs from the file
     urls = load_wikipedia_urls(input_urls_file)
@@ -157,6 +331,10 @@ def main(input_urls_file: str, output_dir: str, language: str) -> None:
     # Extract titles from URLs
     titles = [get_title_from_url(url) for url in urls]
 
+    if workers > 1:
+        acquire_documents_concurrently(titles, output_dir, language, workers, api_url, requests_per_second, tokenizer)
+        return
+
     # Scrape content and clean text
     documents = {}
     for title in titles:
@@ -170,7 +348,7 @@ def main(input_urls_file: str, output_dir: str, language: str) -> None:
 
     # Remove stopwords
     for title, document in documents.items():
-        documents[title]['content'] = remove_stopwords(document['content'], document['language'])
+        documents[title]['content'] = remove_stopwords(document['content'], document['language'], tokenizer)
 
     # Save the documents as JSON files
     save_documents_as_json(documents, output_dir)
@@ -180,7 +358,11 @@ if __name__ == "__main__":
     parser.add_argument("--input_urls_file", type=str, required=True, help="Path to the file containing Wikipedia URLs.")
     parser.add_argument("--output_docs_dir", type=str, required=True, help="Directory where the processed JSON files will be saved.")
     parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the Wikipedia pages (default is 'it').")
+    parser.add_argument("--workers", type=int, default=1, help="Number of pages fetched in parallel (default is 1, serial acquisition).")
+    parser.add_argument("--api_url", type=str, default=DEFAULT_API_URL, help="MediaWiki API endpoint used in concurrent mode, '{language}' is replaced with the language.")
+    parser.add_argument("--requests_per_second", type=float, default=20.0, help="Maximum number of requests per second sent to each host in concurrent mode (default is 20).")
+    parser.add_argument("--tokenizer", type=str, default="simple", choices=list(TOKENIZERS), help="'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer (default is 'simple').")
 
     args = parser.parse_args()
 
-    main(args.input_urls_file, args.output_docs_dir, args.language)
+    main(args.input_urls_file, args.output_docs_dir, args.language, args.workers, args.api_url, args.requests_per_second, args.tokenizer)
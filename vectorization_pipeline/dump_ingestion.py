@@ -0,0 +1,528 @@
+"""
+Wikipedia Dump Ingestion Script
+
+This script builds the corpus from a local Wikipedia dump instead of the live API, so a
+large corpus is processed at disk speed, without network and rate limits. Two dump
+formats are supported, optionally compressed with bz2 or gzip:
+
+- 'xml': the `pages-articles` XML dump, whose wikitext is converted to plain text;
+- 'cirrus': the CirrusSearch JSON dump (`cirrussearch-content.json.gz`), which already
+  holds the plain text and the categories of the pages.
+
+The dump is streamed in constant memory: a reader thread decompresses and parses it,
+keeping only the articles of a title list (`--input_urls_file`) and/or of a set of
+categories (`--categories`), while a pool of worker processes converts and cleans the
+pages (`clean_text` and stopwords removal of document_acquisition.py). The documents
+are sent straight to the chunker (`--output_chunks_dir`) and/or saved as JSON files
+(`--output_docs_dir`).
+
+Usage:
+    conda env create -f wiki_rag.yaml
+    conda activate wiki_rag
+
+    From the root directory of the repository:
+
+    python vectorization_pipeline/dump_ingestion.py --dump_file data/itwiki-latest-pages-articles.xml.bz2 --input_urls_file wikipedia_urls.txt --output_chunks_dir data/chunk_store --output_format store
+
+    python vectorization_pipeline/dump_ingestion.py --dump_file data/itwiki-cirrussearch-content.json.gz --categories "Giochi olimpici" --output_docs_dir data/raw_document
+
+Arguments:
+    --dump_file: Path of the dump, optionally compressed ('.bz2', '.gz').
+    --dump_format: 'xml', 'cirrus' or 'auto' to infer it from the file name.
+    --language: Language of the dump ('en' for English, 'it' for Italian).
+    --input_urls_file: Optional file of Wikipedia URLs, only their pages are kept.
+    --categories: Optional categories, only their pages are kept.
+    --max_pages: Optional maximum number of pages to ingest.
+    --workers: Number of worker processes converting and cleaning the pages.
+    --tokenizer: 'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer.
+    --output_docs_dir: Optional directory where the documents will be saved as JSON files.
+    --output_chunks_dir: Optional directory where the chunks will be saved.
+    --output_format: 'json' for one JSON file per chunk, 'store' for a columnar chunk store.
+    --chunk_size: Size of each chunk in characters.
+    --chunk_overlap: Overlap between chunks in characters.
+    --embedding_model: Name of the SentenceTransformer model to use for generating embeddings.
+    --onnx_model_path: Path of the ONNX model, possibly int8 quantized, exported from the embedding model.
+    --batch_size: Number of chunks, possibly from different documents, embedded together.
+    --num_threads: Number of threads used by torch, or ONNX Runtime, to compute the embeddings.
+    --cache_path: Path of a SQLite embedding cache, so that re-runs only embed the new or changed chunks.
+"""
+
+import os
+import re
+import bz2
+import gzip
+import html
+import json
+import queue
+import sys
+import argparse
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from document_acquisition import TOKENIZERS, load_wikipedia_urls, get_title_from_url, build_document, save_documents_as_json
+from progress import ThroughputReporter
+
+DUMP_FORMATS = ('xml', 'cirrus')
+
+# Number of pages sent together to a worker process
+PAGES_PER_TASK = 64
+
+# A raw page of the dump: title, text (wikitext for the XML dumps) and format
+RawPage = Tuple[str, str, str]
+
+# Namespaces of the links dropped from the text (files and categories)
+DROPPED_LINK_NAMESPACES = {'file', 'image', 'category', 'categoria', 'immagine'}
+
+CATEGORY_PATTERN = re.compile(r'\[\[\s*(?:category|categoria)\s*:\s*([^\]|]+)', re.IGNORECASE)
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+DROPPED_TAGS_PATTERN = re.compile(r'<(ref|math|gallery|timeline|syntaxhighlight|score)\b[^>/]*?(?:/>|>.*?</\1\s*>)', re.DOTALL | re.IGNORECASE)
+TEMPLATE_PATTERN = re.compile(r'\{\{[^{}]*\}\}')
+TABLE_PATTERN = re.compile(r'\{\|(?:(?!\{\|).)*?\|\}', re.DOTALL)
+LINK_PATTERN = re.compile(r'\[\[([^\[\]]*)\]\]')
+EXTERNAL_LINK_PATTERN = re.compile(r'\[(?:https?:)?//[^\s\]]+\s*([^\]]*)\]')
+HEADING_PATTERN = re.compile(r'^(=+)\s*(.*?)\s*\1\s*$', re.MULTILINE)
+FORMATTING_PATTERN = re.compile(r"'{2,}")
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize a page title as MediaWiki does: spaces instead of underscores and uppercase first letter.
+
+    Args:
+        title (str): The title.
+
+    Returns:
+        str: The normalized title.
+    """
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+def page_url(title: str, language: str) -> str:
+    """
+    Build the URL of a page, as returned by the MediaWiki API, so that the chunks of a page
+    ingested from a dump and fetched from the API share the 'url' payload.
+
+    Args:
+        title (str): The title of the page.
+        language (str): The language of the page.
+
+    Returns:
+        str: The URL of the page.
+    """
+    return f"https://{language}.wikipedia.org/wiki/{quote(title.replace(' ', '_'), safe=';@$!*(),/~:')}"
+
+def _replace_innermost(pattern: re.Pattern, replacement, text: str) -> str:
+    """
+    Apply a substitution until the text stops changing, to remove nested markup from the inside.
+    """
+    while True:
+        text, count = pattern.subn(replacement, text)
+        if not count:
+            return text
+
+def _replace_link(match: re.Match) -> str:
+    parts = match.group(1).split('|')
+    namespace = parts[0].split(':', 1)[0].strip().lower() if ':' in parts[0] else ''
+    return '' if namespace in DROPPED_LINK_NAMESPACES else parts[-1]
+
+def wikitext_to_text(wikitext: str) -> str:
+    """
+    Convert the wikitext of a page to plain text, dropping templates, tables, references,
+    files and categories, and keeping the text of the links and of the headings.
+
+    Args:
+        wikitext (str): The wikitext of the page.
+
+    Returns:
+        str: The plain text.
+    """
+    text = COMMENT_PATTERN.sub('', wikitext)
+    text = DROPPED_TAGS_PATTERN.sub('', text)
+    text = _replace_innermost(TEMPLATE_PATTERN, '', text)
+    text = _replace_innermost(TABLE_PATTERN, '', text)
+    text = _replace_innermost(LINK_PATTERN, _replace_link, text)
+    text = EXTERNAL_LINK_PATTERN.sub(r'\1', text)
+    text = HEADING_PATTERN.sub(r'\2', text)
+    text = FORMATTING_PATTERN.sub('', text)
+    text = TAG_PATTERN.sub('', text)
+    return html.unescape(text)
+
+def open_dump(dump_file: str) -> IO[bytes]:
+    """
+    Open a dump as a binary stream, decompressing it on the fly.
+
+    Args:
+        dump_file (str): Path of the dump.
+
+    Returns:
+        IO[bytes]: The stream.
+    """
+    if dump_file.endswith('.bz2'):
+        return bz2.open(dump_file, 'rb')
+    if dump_file.endswith('.gz'):
+        return gzip.open(dump_file, 'rb')
+    return open(dump_file, 'rb')
+
+def detect_dump_format(dump_file: str) -> str:
+    """
+    Infer the format of a dump from its file name.
+
+    Args:
+        dump_file (str): Path of the dump.
+
+    Returns:
+        str: 'xml' or 'cirrus'.
+    """
+    name = os.path.basename(dump_file).lower()
+    for extension in ('.bz2', '.gz'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    if name.endswith('.xml'):
+        return 'xml'
+    if name.endswith(('.json', '.ndjson')):
+        return 'cirrus'
+    raise ValueError(f"Cannot infer the format of the dump '{dump_file}', use --dump_format")
+
+def iter_xml_pages(stream: IO[bytes]) -> Iterator[Tuple[str, str, List[str]]]:
+    """
+    Stream the articles of a `pages-articles` XML dump, skipping redirects and the other namespaces.
+
+    Args:
+        stream (IO[bytes]): The decompressed dump.
+
+    Returns:
+        Iterator[Tuple[str, str, List[str]]]: The title, the wikitext and the categories of each article.
+    """
+    context = ElementTree.iterparse(stream, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end' or not element.tag.endswith('}page'):
+            continue
+        namespace = title = text = None
+        redirect = False
+        for child in element.iter():
+            tag = child.tag.rsplit('}', 1)[-1]
+            if tag == 'ns':
+                namespace = child.text
+            elif tag == 'title':
+                title = child.text
+            elif tag == 'redirect':
+                redirect = True
+            elif tag == 'text':
+                text = child.text or ''
+        # Drop the parsed pages, so that the memory usage doesn't grow with the dump
+        root.clear()
+        if namespace == '0' and not redirect and title:
+            yield title, text, [category.strip() for category in CATEGORY_PATTERN.findall(text)]
+
+def iter_cirrus_pages(stream: IO[bytes]) -> Iterator[Tuple[str, str, List[str]]]:
+    """
+    Stream the articles of a CirrusSearch dump, made of alternated index and page lines.
+
+    Args:
+        stream (IO[bytes]): The decompressed dump.
+
+    Returns:
+        Iterator[Tuple[str, str, List[str]]]: The title, the plain text and the categories of each article.
+    """
+    for line in stream:
+        page = json.loads(line)
+        if 'index' in page or page.get('namespace', 0) != 0 or not page.get('title'):
+            continue
+        yield page['title'], page.get('text', ''), page.get('category', [])
+
+def iter_raw_pages(
+        dump_file: str,
+        dump_format: str,
+        titles: Optional[Set[str]] = None,
+        categories: Optional[Set[str]] = None,
+        max_pages: Optional[int] = None) -> Iterator[RawPage]:
+    """
+    Stream the articles of a dump that match the filters. With a title list only, the
+    reading stops as soon as all the titles were found.
+
+    Args:
+        dump_file (str): Path of the dump.
+        dump_format (str): 'xml' or 'cirrus'.
+        titles (Optional[Set[str]]): Normalized titles of the pages to keep, None keeps all the pages.
+        categories (Optional[Set[str]]): Normalized categories of the pages to keep, None keeps all the pages.
+        max_pages (Optional[int]): Maximum number of pages, None reads the whole dump.
+
+    Returns:
+        Iterator[RawPage]: The title, the text and the format of each page.
+    """
+    remaining_titles = set(titles) if titles else None
+    count = 0
+    with open_dump(dump_file) as stream:
+        pages = iter_xml_pages(stream) if dump_format == 'xml' else iter_cirrus_pages(stream)
+        for title, text, page_categories in pages:
+            if titles or categories:
+                in_titles = bool(titles) and normalize_title(title) in titles
+                in_categories = bool(categories) and any(normalize_title(category) in categories for category in page_categories)
+                if not in_titles and not in_categories:
+                    continue
+                if in_titles:
+                    remaining_titles.discard(normalize_title(title))
+
+            yield title, text, dump_format
+            count += 1
+            if max_pages is not None and count >= max_pages:
+                return
+            if remaining_titles is not None and not remaining_titles and not categories:
+                return
+
+def process_pages(pages: List[RawPage], language: str, tokenizer: str = 'simple') -> List[Dict]:
+    """
+    Convert and clean a batch of raw pages. Runs in a worker process.
+
+    Args:
+        pages (List[RawPage]): The raw pages.
+        language (str): Language of the pages.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+
+    Returns:
+        List[Dict]: The documents, with the schema of `document_acquisition.build_document`.
+    """
+    documents = []
+    for title, text, dump_format in pages:
+        if dump_format == 'xml':
+            text = wikitext_to_text(text)
+        documents.append(build_document(title, page_url(title, language), language, text, tokenizer))
+    return documents
+
+def _read_batches(raw_pages: Iterator[RawPage], batches: queue.Queue, stop: threading.Event) -> None:
+    """
+    Read the dump in a thread, so that the decompression and the parsing overlap with the workers.
+    A reading error is passed through the queue, to be raised by the consumer.
+    """
+    batch = []
+    try:
+        for page in raw_pages:
+            batch.append(page)
+            if len(batch) == PAGES_PER_TASK:
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+                batch = []
+        if batch:
+            batches.put(batch)
+    except Exception as e:
+        batches.put(e)
+    finally:
+        batches.put(None)
+
+def iter_dump_documents(
+        dump_file: str,
+        language: str,
+        dump_format: str = 'auto',
+        titles: Optional[Set[str]] = None,
+        categories: Optional[Set[str]] = None,
+        max_pages: Optional[int] = None,
+        workers: int = 4,
+        tokenizer: str = 'simple') -> Iterator[Dict]:
+    """
+    Stream the processed documents of a dump. Pages are yielded as soon as they are processed,
+    so their order is not preserved.
+
+    Args:
+        dump_file (str): Path of the dump.
+        language (str): Language of the dump.
+        dump_format (str): 'xml', 'cirrus' or 'auto' to infer it from the file name.
+        titles (Optional[Set[str]]): Titles of the pages to keep, None keeps all the pages.
+        categories (Optional[Set[str]]): Categories of the pages to keep, None keeps all the pages.
+        max_pages (Optional[int]): Maximum number of pages, None reads the whole dump.
+        workers (int): Number of worker processes converting and cleaning the pages.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+
+    Returns:
+        Iterator[Dict]: The documents, with the schema of `document_acquisition.build_document`.
+
+    Raises:
+        RuntimeError: If the dump can't be read, or after the last document if some pages failed to be processed.
+    """
+    if dump_format == 'auto':
+        dump_format = detect_dump_format(dump_file)
+    if dump_format not in DUMP_FORMATS:
+        raise ValueError(f"Unsupported dump format: {dump_format}")
+
+    raw_pages = iter_raw_pages(
+        dump_file,
+        dump_format,
+        {normalize_title(title) for title in titles} if titles else None,
+        {normalize_title(category) for category in categories} if categories else None,
+        max_pages,
+    )
+    reporter = ThroughputReporter("dump", unit="pages")
+
+    # The queue and the in-flight tasks are bounded, so the memory usage doesn't depend on the dump size
+    max_in_flight = max(workers, 1) * 2
+    batches = queue.Queue(maxsize=max_in_flight)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_batches, args=(raw_pages, batches, stop), name="dump-reader", daemon=True)
+    reader.start()
+
+    # Spawn fresh interpreters so that no torch thread pool is inherited by the workers
+    with ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=multiprocessing.get_context("spawn")) as executor:
+        try:
+            # The number of pages of each task
+            in_flight: Dict[Future, int] = {}
+            end_of_dump = False
+            while in_flight or not end_of_dump:
+                while not end_of_dump and len(in_flight) < max_in_flight:
+                    batch = batches.get()
+                    if batch is None:
+                        end_of_dump = True
+                    elif isinstance(batch, Exception):
+                        raise RuntimeError(f"Failed to read the dump '{dump_file}': {batch}") from batch
+                    else:
+                        in_flight[executor.submit(process_pages, batch, language, tokenizer)] = len(batch)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    num_pages = in_flight.pop(future)
+                    try:
+                        documents = future.result()
+                    except Exception as e:
+                        print(f"Error: Failed to process a batch of pages: {e}")
+                        reporter.update(done=0, failed=num_pages)
+                        continue
+                    reporter.update(len(documents))
+                    yield from documents
+        finally:
+            stop.set()
+            for future in in_flight:
+                future.cancel()
+    reporter.report()
+    if reporter.failed:
+        raise RuntimeError(f"Failed to process {reporter.failed} pages of the dump '{dump_file}'")
+
+def main(
+        dump_file: str,
+        language: str,
+        dump_format: str = 'auto',
+        input_urls_file: Optional[str] = None,
+        categories: Optional[List[str]] = None,
+        max_pages: Optional[int] = None,
+        workers: int = 4,
+        tokenizer: str = 'simple',
+        output_docs_dir: Optional[str] = None,
+        output_chunks_dir: Optional[str] = None,
+        output_format: str = "json",
+        chunk_size: int = 450,
+        chunk_overlap: int = 20,
+        embedding_model_name: str = "all-MiniLM-L6-v2",
+        onnx_model_path: Optional[str] = None,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        cache_path: Optional[str] = None) -> bool:
+    """
+    Main function to ingest a Wikipedia dump.
+
+    Args:
+        dump_file (str): Path of the dump.
+        language (str): Language of the dump.
+        dump_format (str): 'xml', 'cirrus' or 'auto' to infer it from the file name.
+        input_urls_file (Optional[str]): File of Wikipedia URLs, only their pages are kept.
+        categories (Optional[List[str]]): Categories, only their pages are kept.
+        max_pages (Optional[int]): Maximum number of pages, None reads the whole dump.
+        workers (int): Number of worker processes converting and cleaning the pages.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+        output_docs_dir (Optional[str]): Directory where the documents will be saved as JSON files.
+        output_chunks_dir (Optional[str]): Directory where the chunks will be saved.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a chunk store.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+
+    Returns:
+        bool: True if the whole dump was ingested, False if the dump couldn't be read or some pages failed.
+    """
+    titles = {get_title_from_url(url) for url in load_wikipedia_urls(input_urls_file) if url} if input_urls_file else None
+    documents = iter_dump_documents(dump_file, language, dump_format, titles, set(categories or []), max_pages, workers, tokenizer)
+
+    try:
+        if output_docs_dir:
+            documents = _save_documents(documents, output_docs_dir)
+        if output_chunks_dir:
+            # The chunker, with langchain and the embedding model, is not imported by the worker processes
+            from wikipedia_chunker import iter_document_chunks, save_chunks
+            chunks = iter_document_chunks(documents, chunk_size, chunk_overlap, embedding_model_name, batch_size, num_threads, cache_path, onnx_model_path)
+            save_chunks(chunks, output_chunks_dir, output_format)
+        else:
+            for _ in documents:
+                pass
+    except Exception as e:
+        print(f"Error: The dump ingestion failed: {e}")
+        return False
+    return True
+
+def _save_documents(documents: Iterator[Dict], output_docs_dir: str) -> Iterator[Dict]:
+    """
+    Save the documents as JSON files while passing them on.
+    """
+    for document in documents:
+        save_documents_as_json({document['title']: document}, output_docs_dir)
+        yield document
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wikipedia Dump Ingestion")
+    parser.add_argument("--dump_file", type=str, required=True, help="Path of the dump, optionally compressed ('.bz2', '.gz').")
+    parser.add_argument("--dump_format", type=str, default="auto", choices=["auto", *DUMP_FORMATS], help="Format of the dump (default is 'auto', inferred from the file name).")
+    parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the dump (default is 'it').")
+    parser.add_argument("--input_urls_file", type=str, default=None, help="Optional file of Wikipedia URLs, only their pages are kept.")
+    parser.add_argument("--categories", type=str, nargs="+", default=None, help="Optional categories, only their pages are kept.")
+    parser.add_argument("--max_pages", type=int, default=None, help="Optional maximum number of pages to ingest.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes converting and cleaning the pages (default is the number of CPU cores).")
+    parser.add_argument("--tokenizer", type=str, default="simple", choices=list(TOKENIZERS), help="'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer (default is 'simple').")
+    parser.add_argument("--output_docs_dir", type=str, default=None, help="Optional directory where the documents will be saved as JSON files.")
+    parser.add_argument("--output_chunks_dir", type=str, default=None, help="Optional directory where the chunks will be saved.")
+    parser.add_argument("--output_format", type=str, default="json", choices=["json", "store"], help="'json' for one JSON file per chunk, 'store' for a columnar chunk store (default is 'json').")
+    parser.add_argument("--chunk_size", type=int, default=450, help="Size of each chunk in characters (default is 450).")
+    parser.add_argument("--chunk_overlap", type=int, default=20, help="Overlap between chunks in characters (default is 20).")
+    parser.add_argument("--embedding_model", type=str, default="all-MiniLM-L6-v2", help="Name of the SentenceTransformer model to use (default is 'all-MiniLM-L6-v2').")
+    parser.add_argument("--onnx_model_path", type=str, default=None, help="Path of the ONNX model, possibly int8 quantized, exported from the embedding model (default is the torch model).")
+    parser.add_argument("--batch_size", type=int, default=64, help="Number of chunks embedded together (default is 64).")
+    parser.add_argument("--num_threads", type=int, default=None, help="Number of threads used by torch (default is the torch default).")
+    parser.add_argument("--cache_path", type=str, default=None, help="Path of the SQLite embedding cache (default is no cache).")
+
+    args = parser.parse_args()
+    if not args.output_docs_dir and not args.output_chunks_dir:
+        parser.error("at least one of --output_docs_dir and --output_chunks_dir is required")
+
+    # A non-zero exit status stops the tasks chaining the ingestion, e.g. before uploading a partial corpus
+    if not main(
+        args.dump_file,
+        args.language,
+        args.dump_format,
+        args.input_urls_file,
+        args.categories,
+        args.max_pages,
+        args.workers,
+        args.tokenizer,
+        args.output_docs_dir,
+        args.output_chunks_dir,
+        args.output_format,
+        args.chunk_size,
+        args.chunk_overlap,
+        args.embedding_model,
+        args.onnx_model_path,
+        args.batch_size,
+        args.num_threads,
+        args.cache_path,
+    ):
+        sys.exit(1)
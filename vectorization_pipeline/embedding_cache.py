@@ -0,0 +1,127 @@
+"""
+Embedding Cache
+
+This module contains a persistent, SQLite backed cache of chunk embeddings. Each
+embedding is stored under the hash of the embedding model name and of the chunk
+text, so re-running the chunker only embeds the chunks whose text changed.
+
+The same hash is used to derive deterministic point IDs, so re-uploading the
+chunks of an unchanged page overwrites the existing Qdrant points instead of
+duplicating them.
+"""
+
+import uuid
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+# Namespace of the deterministic point IDs
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/MauroAndretta/WikiRag")
+
+
+def content_hash(model_name: str, text: str) -> str:
+    """
+    Compute the hash identifying the embedding of a text.
+
+    Args:
+        model_name (str): Name of the embedding model.
+        text (str): Text of the chunk.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest.
+    """
+    return hashlib.sha256(f"{model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+
+def point_id(url: str, text_hash: str) -> str:
+    """
+    Compute the deterministic ID of the point of a chunk. The page URL is part of the ID
+    so that identical texts found in different pages are kept as separate points.
+
+    Args:
+        url (str): URL of the Wikipedia page the chunk comes from.
+        text_hash (str): Hash of the chunk computed with `content_hash`.
+
+    Returns:
+        str: The point ID, as a UUID string.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{url}\x00{text_hash}"))
+
+
+class EmbeddingCache:
+    """
+    A class used to persist chunk embeddings in a SQLite database.
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor of the class
+
+        Args:
+        path (str): path of the SQLite database, created if it doesn't exist
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # WAL lets the chunker worker processes read and write the cache concurrently
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._connection.commit()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Method to look up the embeddings of many chunks
+
+        Args:
+        hashes (List[str]): the hashes of the chunks
+
+        Returns:
+            Dict[str, np.ndarray]: the cached embeddings, by hash.
+        """
+        found = {}
+        unique_hashes = list(set(hashes))
+        with self._lock:
+            # Stay below the SQLite limit on the number of query parameters
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+
+            self.hits += sum(1 for text_hash in hashes if text_hash in found)
+            self.misses += sum(1 for text_hash in hashes if text_hash not in found)
+        return found
+
+    def put_many(self, embeddings: Dict[str, np.ndarray]) -> None:
+        """
+        Method to store the embeddings of many chunks
+
+        Args:
+        embeddings (Dict[str, np.ndarray]): the embeddings, by hash
+        """
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, vector) VALUES (?, ?)",
+                [(text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in embeddings.items()]
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Method to close the database, printing the hit rate
+        """
+        total = self.hits + self.misses
+        if total:
+            print(f"Embedding cache: {self.hits}/{total} hits ({100 * self.hits / total:.1f}%).")
+        self._connection.close()
@@ -0,0 +1,209 @@
+"""
+Page Manifest
+
+This module contains a SQLite backed manifest of the Wikipedia pages of the corpus.
+For each page it records the revision that was fetched, its timestamp and the hash
+of the processed content, so that the incremental refresh (see refresh.py) only
+processes the pages that changed since the last run.
+
+The revisions found by a refresh are first staged as pending, and only committed to
+the manifest once the changed pages have been chunked and loaded: until then, the
+next refresh still sees these pages as changed.
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+
+def document_hash(content: str) -> str:
+    """
+    Compute the hash of the processed content of a page.
+
+    Args:
+        content (str): The processed content.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest.
+    """
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class PageManifest:
+    """
+    A class used to persist the revisions of the Wikipedia pages in a SQLite database.
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor of the class
+
+        Args:
+        path (str): path of the SQLite database, created if it doesn't exist
+        """
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "title TEXT NOT NULL, language TEXT NOT NULL, page_title TEXT, url TEXT, "
+            "revision_id INTEGER, timestamp TEXT, content_hash TEXT, updated REAL, "
+            "PRIMARY KEY (title, language))"
+        )
+        # Same columns, deleted pages have deleted = 1 and pages with a document to load have saved = 1
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "title TEXT NOT NULL, language TEXT NOT NULL, page_title TEXT, url TEXT, "
+            "revision_id INTEGER, timestamp TEXT, content_hash TEXT, deleted INTEGER NOT NULL DEFAULT 0, "
+            "saved INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (title, language))"
+        )
+        self._connection.commit()
+
+    def get_all(self, language: str) -> Dict[str, Dict]:
+        """
+        Method to get all the pages of a language
+
+        Args:
+        language (str): the language of the pages
+
+        Returns:
+            Dict[str, Dict]: by requested title, a dictionary with 'title', 'url', 'revision_id',
+            'timestamp' and 'content_hash' keys.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT title, page_title, url, revision_id, timestamp, content_hash FROM pages WHERE language = ?",
+                (language,)
+            ).fetchall()
+        return {
+            title: {'title': page_title, 'url': url, 'revision_id': revision_id, 'timestamp': timestamp, 'content_hash': content_hash}
+            for title, page_title, url, revision_id, timestamp, content_hash in rows
+        }
+
+    def put_many(self, pages: Dict[str, Dict], language: str) -> None:
+        """
+        Method to store the pages, replacing the previous revisions
+
+        Args:
+        pages (Dict[str, Dict]): by requested title, the pages with the keys returned by `get_all`
+        language (str): the language of the pages
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO pages (title, language, page_title, url, revision_id, timestamp, content_hash, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (title, language, page['title'], page['url'], page['revision_id'], page['timestamp'], page['content_hash'], now)
+                    for title, page in pages.items()
+                ]
+            )
+            self._connection.commit()
+
+    def delete_many(self, titles: List[str], language: str) -> None:
+        """
+        Method to remove pages from the manifest
+
+        Args:
+        titles (List[str]): the requested titles of the pages
+        language (str): the language of the pages
+        """
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM pages WHERE title = ? AND language = ?",
+                [(title, language) for title in titles]
+            )
+            self._connection.commit()
+
+    def get_pending(self, language: str) -> Dict[str, Optional[Dict]]:
+        """
+        Method to get the changes of a language staged by the last refresh and not committed yet
+
+        Args:
+        language (str): the language of the pages
+
+        Returns:
+            Dict[str, Optional[Dict]]: by requested title, the page with the keys returned by `get_all`,
+            None for the pages to delete.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT title, page_title, url, revision_id, timestamp, content_hash, deleted FROM pending WHERE language = ?",
+                (language,)
+            ).fetchall()
+        return {
+            title: None if deleted else {'title': page_title, 'url': url, 'revision_id': revision_id, 'timestamp': timestamp, 'content_hash': content_hash}
+            for title, page_title, url, revision_id, timestamp, content_hash, deleted in rows
+        }
+
+    def set_pending(self, pages: Dict[str, Dict], deleted_titles: List[str], language: str, saved_titles: Optional[List[str]] = None) -> None:
+        """
+        Method to stage the changes of a refresh, replacing the ones staged by the previous refresh
+
+        Args:
+        pages (Dict[str, Dict]): by requested title, the new revisions of the pages with the keys returned by `get_all`
+        deleted_titles (List[str]): the requested titles of the pages to remove
+        language (str): the language of the pages
+        saved_titles (Optional[List[str]]): the requested titles of the pages whose document must be loaded before the commit
+        """
+        saved = set(saved_titles or [])
+        with self._lock:
+            self._connection.execute("DELETE FROM pending WHERE language = ?", (language,))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO pending (title, language, page_title, url, revision_id, timestamp, content_hash, deleted, saved) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                [
+                    (title, language, page['title'], page['url'], page['revision_id'], page['timestamp'], page['content_hash'], int(title in saved))
+                    for title, page in pages.items()
+                ]
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO pending (title, language, deleted) VALUES (?, ?, 1)",
+                [(title, language) for title in deleted_titles]
+            )
+            self._connection.commit()
+
+    def count_pending_documents(self, language: str) -> int:
+        """
+        Method to count the staged pages of a language whose document must be loaded before the commit
+
+        Args:
+        language (str): the language of the pages
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM pending WHERE language = ? AND saved = 1", (language,)
+            ).fetchone()[0]
+
+    def commit_pending(self, language: str) -> int:
+        """
+        Method to apply the staged changes of a language to the manifest, once the changed pages are loaded
+
+        Args:
+        language (str): the language of the pages
+
+        Returns:
+            int: the number of committed changes.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (title, language, page_title, url, revision_id, timestamp, content_hash, updated) "
+                "SELECT title, language, page_title, url, revision_id, timestamp, content_hash, ? FROM pending "
+                "WHERE language = ? AND deleted = 0",
+                (time.time(), language)
+            )
+            self._connection.execute(
+                "DELETE FROM pages WHERE language = ? AND title IN "
+                "(SELECT title FROM pending WHERE language = ? AND deleted = 1)",
+                (language, language)
+            )
+            return self._connection.execute("DELETE FROM pending WHERE language = ?", (language,)).rowcount
+
+    def close(self) -> None:
+        """
+        Method to close the database
+        """
+        self._connection.close()
@@ -0,0 +1,74 @@
+"""
+Progress reporting helpers shared by the vectorization pipeline scripts.
+"""
+
+import time
+import threading
+from typing import Optional
+
+
+class ThroughputReporter:
+    """
+    Thread-safe counter that periodically prints progress and throughput of a pipeline stage.
+    """
+
+    def __init__(self, stage: str, unit: str = "items", total: Optional[int] = None, report_every: float = 5.0):
+        """
+        Constructor of the class
+
+        Args:
+        stage (str): name of the stage printed in every report (e.g. 'acquisition')
+        unit (str): name of the counted items (e.g. 'pages', 'chunks')
+        total (Optional[int]): expected number of items, if known
+        report_every (float): minimum number of seconds between two reports
+        """
+        self.stage = stage
+        self.unit = unit
+        self.total = total
+        self.report_every = report_every
+
+        self.done = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self._last_report = self.start_time
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Seconds elapsed since the reporter was created
+        """
+        return time.perf_counter() - self.start_time
+
+    @property
+    def rate(self) -> float:
+        """
+        Number of processed items per second
+        """
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, done: int = 1, failed: int = 0) -> None:
+        """
+        Record processed items and print a report if enough time has passed.
+
+        Args:
+        done (int): number of items processed successfully
+        failed (int): number of items that failed
+        """
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            now = time.perf_counter()
+            if now - self._last_report < self.report_every:
+                return
+            self._last_report = now
+        self.report()
+
+    def report(self) -> None:
+        """
+        Print the current progress and throughput
+        """
+        progress = f"{self.done}/{self.total}" if self.total is not None else f"{self.done}"
+        print(f"[{self.stage}] {progress} {self.unit} "
+              f"({self.rate:.1f} {self.unit}/s, {self.failed} failed, {self.elapsed:.1f}s elapsed)")
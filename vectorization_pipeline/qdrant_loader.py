@@ -1,9 +1,14 @@
 """
 Qdrant Chunk Loader Script
 
-This script loads all JSON chunks from a specified directory into a Qdrant collection.
-Each chunk is inserted as a point in the collection, with error handling to ensure
-that the process continues even if some chunks fail to load.
+This script loads all the chunks from a specified directory into a Qdrant collection.
+The directory can contain one JSON file per chunk or a chunk store (see chunk_store.py).
+Chunks are sent in batches by a pool of parallel upload workers, with error handling
+to ensure that the process continues even if some batches fail to load.
+
+The progress is saved in a checkpoint file, so an interrupted load resumes from the
+first row that was not uploaded yet. The checkpoint is ignored if the chunks changed
+since it was written, and removed once the load completes.
 
 Usage:
     conda env create -f wiki_rag.yaml
@@ -13,95 +18,718 @@ Usage:
 
     python vectorization_pipeline/qdrant_loader.py --chunks_dir data/chunks --collection_name olympics
 
+    python vectorization_pipeline/qdrant_loader.py --chunks_dir data/chunk_store --collection_name olympics --batch_size 512 --parallel 4 --prefer_grpc --checkpoint_file data/olympics.checkpoint.json
+
 Arguments:
-    --chunks_dir: Directory containing JSON files of chunks to be loaded into Qdrant.
+    --chunks_dir: Directory containing JSON files of chunks, or a chunk store (see chunk_store.py), to be loaded into Qdrant.
     --collection_name: Name of the Qdrant collection where the chunks will be stored.
+    --url: Qdrant instance URL, takes precedence over host and port.
     --host: Qdrant instance host (default is 'localhost').
     --port: Qdrant instance port (default is 6333).
+    --location: Qdrant location, e.g. ':memory:' for the in-memory local mode.
+    --path: Path of a local on-disk Qdrant database.
+    --prefer_grpc: Use the gRPC interface of Qdrant.
+    --batch_size: Number of points sent to Qdrant with each request (default is 256).
+    --parallel: Number of batches uploaded in parallel (default is 4).
+    --no_wait: Do not wait for each batch to be applied before sending the next ones.
+    --checkpoint_file: Path of the checkpoint file used to resume an interrupted load.
+    --profile: Collection profile used when the collection is created:
+        'default' (Qdrant defaults), 'bulk' (indexing deferred until the end of the load),
+        'scalar' (int8 quantization, original vectors on disk), 'binary' (binary quantization,
+        vectors and payload on disk) or 'high_recall' (denser HNSW graph).
+    --sparse: Also store a sparse keyword vector of each chunk, used by the hybrid retrieval of WikiRag.
+        Collections created with sparse vectors always receive them, even without this flag.
 """
 
 import os
+import sys
 import json
+import time
+import hashlib
 import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    VectorParams,
+    Distance,
+    Batch,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    PayloadSchemaType,
+    SparseVector,
+    SparseVectorParams,
+    Modifier,
+    Filter,
+    FieldCondition,
+    MatchAny,
+    FilterSelector,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+)
+from qdrant_client.local.qdrant_local import QdrantLocal
+
+from chunk_store import VECTORS_FILE, PAYLOADS_FILE, ChunkStoreReader, is_chunk_store
+from progress import ThroughputReporter
+
+# The sparse encoding is shared with WikiRag, which encodes the queries
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Named collection settings. Quantized profiles keep the compressed vectors in RAM and the
+# original ones on disk, the search rescores the candidates with the original vectors.
+# With deferred indexing the HNSW graph is built once after the bulk load instead of while loading.
+COLLECTION_PROFILES = {
+    "default": {},
+    "bulk": {
+        "deferred_indexing": True,
+    },
+    "scalar": {
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "quantization": "scalar",
+        "on_disk_vectors": True,
+        "deferred_indexing": True,
+    },
+    "binary": {
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "quantization": "binary",
+        "on_disk_vectors": True,
+        "on_disk_payload": True,
+        "deferred_indexing": True,
+    },
+    "high_recall": {
+        "hnsw_m": 32,
+        "hnsw_ef_construct": 256,
+        "deferred_indexing": True,
+    },
+}
+
+# Payload fields of the chunks used to filter the search, e.g. by language or by page
+PAYLOAD_INDEX_FIELDS = ["language", "title", "url"]
+
+# Qdrant default number of kilobytes of vectors above which a segment is indexed
+DEFAULT_INDEXING_THRESHOLD = 20000
+
+# A batch of rows: index of the first row, number of rows read, point IDs, vectors and payloads
+RowBatch = Tuple[int, int, List[str], List[List[float]], List[Dict]]
 
-def load_chunks_to_qdrant(chunks_dir: str, collection_name: str) -> None:
+def create_qdrant_client(
+        url: Optional[str] = None,
+        host: str = "localhost",
+        port: int = 6333,
+        location: Optional[str] = None,
+        path: Optional[str] = None,
+        prefer_grpc: bool = False) -> QdrantClient:
     """
-    Load all JSON chunks from a directory into a Qdrant collection.
+    Create a Qdrant client for a server, the in-memory local mode or a local on-disk database.
 
     Args:
-        chunks_dir (str): Directory containing JSON files of chunks to be loaded into Qdrant.
-        collection_name (str): Name of the Qdrant collection where the chunks will be stored.
-        host (str): Qdrant instance host (default is 'localhost').
-        port (int): Qdrant instance port (default is 6333).
+        url (Optional[str]): Qdrant instance URL, takes precedence over host and port.
+        host (str): Qdrant instance host.
+        port (int): Qdrant instance port.
+        location (Optional[str]): Qdrant location, e.g. ':memory:'.
+        path (Optional[str]): Path of a local on-disk Qdrant database.
+        prefer_grpc (bool): Use the gRPC interface of Qdrant.
+
+    Returns:
+        QdrantClient: The Qdrant client.
     """
-    # Connect to Qdrant instance
-    qdrant_client = QdrantClient(host="localhost", port=6333)
-
-    processed_chunks = []
-    unprocessed_chunks = []
-    
-    # Create the collection if it doesn't exist
-    if not qdrant_client.collection_exists(collection_name):
-        qdrant_client.create_collection(
+    if location:
+        return QdrantClient(location=location)
+    if path:
+        return QdrantClient(path=path)
+    if url:
+        return QdrantClient(url=url, prefer_grpc=prefer_grpc)
+    return QdrantClient(host=host, port=port, prefer_grpc=prefer_grpc)
+
+def is_local_client(qdrant_client: QdrantClient) -> bool:
+    """
+    Check whether a client runs Qdrant locally (in memory or on disk) instead of connecting to a server.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+
+    Returns:
+        bool: True for the local mode.
+    """
+    return isinstance(getattr(qdrant_client, '_client', None), QdrantLocal)
+
+def create_collection_if_missing(qdrant_client: QdrantClient, collection_name: str, vector_size: int = 384, profile: str = "default", sparse: bool = False) -> None:
+    """
+    Create the Qdrant collection if it doesn't exist.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        vector_size (int): Size of the vectors stored in the collection.
+        profile (str): Name of the collection profile in COLLECTION_PROFILES.
+        sparse (bool): Also store a sparse keyword vector of each chunk, weighted by Qdrant with the IDF.
+    """
+    if qdrant_client.collection_exists(collection_name):
+        print(f"Collection '{collection_name}' already exists in Qdrant.")
+        return
+
+    settings = COLLECTION_PROFILES[profile]
+
+    hnsw_config = None
+    if "hnsw_m" in settings or "hnsw_ef_construct" in settings:
+        hnsw_config = HnswConfigDiff(m=settings.get("hnsw_m"), ef_construct=settings.get("hnsw_ef_construct"))
+
+    quantization_config = None
+    if settings.get("quantization") == "scalar":
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    elif settings.get("quantization") == "binary":
+        quantization_config = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+
+    qdrant_client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(
+            size=vector_size,
+            distance=Distance.COSINE,
+            on_disk=settings.get("on_disk_vectors"),
+        ),
+        sparse_vectors_config=get_sparse_vectors_config() if sparse else None,
+        hnsw_config=hnsw_config,
+        quantization_config=quantization_config,
+        on_disk_payload=settings.get("on_disk_payload"),
+    )
+    print(f"Collection '{collection_name}' created in Qdrant with the '{profile}' profile.")
+
+def get_sparse_vectors_config() -> Dict[str, SparseVectorParams]:
+    """
+    Get the configuration of the sparse keyword vectors of a collection.
+
+    Returns:
+        Dict[str, SparseVectorParams]: The sparse vectors configuration, by vector name.
+    """
+    from wiki_rag.sparse import SPARSE_VECTOR_NAME
+
+    return {SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)}
+
+def has_sparse_vectors(qdrant_client: QdrantClient, collection_name: str) -> bool:
+    """
+    Check whether a collection stores the sparse keyword vectors of the chunks.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+
+    Returns:
+        bool: True if the collection has sparse vectors.
+    """
+    return bool(qdrant_client.get_collection(collection_name).config.params.sparse_vectors)
+
+def build_vectors(vectors: List, payloads: List[Dict], sparse: bool):
+    """
+    Build the vectors of a batch of points, adding the sparse keyword vectors computed
+    from the text of the chunks if needed.
+
+    Args:
+        vectors (List): The dense vectors.
+        payloads (List[Dict]): The payloads of the chunks.
+        sparse (bool): Add the sparse vectors.
+
+    Returns:
+        The dense vectors, or the dense and sparse vectors by vector name.
+    """
+    if not sparse:
+        return vectors
+    from wiki_rag.sparse import SPARSE_VECTOR_NAME, encode_document
+
+    sparse_vectors = []
+    for payload in payloads:
+        indices, values = encode_document(payload.get('content', ''))
+        sparse_vectors.append(SparseVector(indices=indices, values=values))
+    return {"": vectors, SPARSE_VECTOR_NAME: sparse_vectors}
+
+def create_payload_indexes(qdrant_client: QdrantClient, collection_name: str, fields: List[str] = PAYLOAD_INDEX_FIELDS) -> None:
+    """
+    Create keyword indexes on the payload fields used to filter the search, so that
+    filtered searches are answered by the HNSW index instead of by post-filtering.
+    Indexes that already exist are left unchanged.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        fields (List[str]): Payload fields to index.
+    """
+    if is_local_client(qdrant_client):
+        # Payload indexes have no effect in local mode
+        return
+    existing_fields = qdrant_client.get_collection(collection_name).payload_schema
+    for field in fields:
+        if field not in existing_fields:
+            qdrant_client.create_payload_index(collection_name, field_name=field, field_schema=PayloadSchemaType.KEYWORD)
+            print(f"Payload index on '{field}' created in collection '{collection_name}'.")
+
+def set_indexing(qdrant_client: QdrantClient, collection_name: str, profile: str, enabled: bool) -> None:
+    """
+    Disable the HNSW indexing before a bulk load and enable it again afterwards,
+    if the collection profile defers the indexing.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        profile (str): Name of the collection profile in COLLECTION_PROFILES.
+        enabled (bool): True to enable the indexing, False to disable it.
+    """
+    if not COLLECTION_PROFILES[profile].get("deferred_indexing"):
+        return
+    qdrant_client.update_collection(
+        collection_name=collection_name,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=DEFAULT_INDEXING_THRESHOLD if enabled else 0),
+    )
+    print(f"Indexing of collection '{collection_name}' {'enabled' if enabled else 'disabled'}.")
+
+def bump_collection_version(qdrant_client: QdrantClient, collection_name: str) -> None:
+    """
+    Mark a change of the content of a collection with a new version alias, so that the
+    answers cached by WikiRag for the previous content are dropped.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+    """
+    from wiki_rag.vector_stores import VERSION_ALIAS_SEPARATOR
+
+    prefix = f"{collection_name}{VERSION_ALIAS_SEPARATOR}"
+    aliases = qdrant_client.get_collection_aliases(collection_name).aliases
+    operations = [
+        DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias.alias_name))
+        for alias in aliases if alias.alias_name.startswith(prefix)
+    ]
+    operations.append(CreateAliasOperation(create_alias=CreateAlias(
+        collection_name=collection_name,
+        alias_name=f"{prefix}{time.time_ns()}",
+    )))
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+
+def delete_pages(qdrant_client: QdrantClient, collection_name: str, urls: List[str], batch_size: int = 256) -> None:
+    """
+    Delete all the chunks of some Wikipedia pages, selected by the 'url' payload field,
+    e.g. before loading the new chunks of the changed pages.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        urls (List[str]): URLs of the pages.
+        batch_size (int): Number of pages deleted with each request.
+    """
+    if not urls or not qdrant_client.collection_exists(collection_name):
+        return
+    for start in range(0, len(urls), batch_size):
+        qdrant_client.delete(
             collection_name=collection_name,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            points_selector=FilterSelector(
+                filter=Filter(must=[FieldCondition(key="url", match=MatchAny(any=urls[start:start + batch_size]))])
+            ),
+            wait=True,
+        )
+    bump_collection_version(qdrant_client, collection_name)
+    print(f"Deleted the chunks of {len(urls)} pages from collection '{collection_name}'.")
+
+def upsert_chunks(qdrant_client: QdrantClient, collection_name: str, chunks: List[Dict], sparse: bool = False) -> None:
+    """
+    Insert a batch of chunks into a Qdrant collection with a single request.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        chunks (List[Dict]): The chunks to insert.
+        sparse (bool): Also insert the sparse keyword vectors of the chunks.
+    """
+    if not chunks:
+        return
+    qdrant_client.upsert(
+        collection_name=collection_name,
+        points=Batch(
+            ids=[chunk['id'] for chunk in chunks],
+            vectors=build_vectors([chunk['vector'] for chunk in chunks], [chunk['payload'] for chunk in chunks], sparse),
+            payloads=[chunk['payload'] for chunk in chunks],
         )
-        print(f"Collection '{collection_name}' created in Qdrant.")
+    )
+
+def source_fingerprint(chunks_dir: str) -> str:
+    """
+    Fingerprint the chunks of a directory, so that a checkpoint is not applied to rewritten chunks.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks, or a chunk store.
+
+    Returns:
+        str: A hash of the names, sizes and modification times of the chunk files.
+    """
+    if is_chunk_store(chunks_dir):
+        filenames = [VECTORS_FILE, PAYLOADS_FILE]
     else:
-        print(f"Collection '{collection_name}' already exists in Qdrant.")
-    
-    # Iterate over all chunk files in the directory
-    for filename in os.listdir(chunks_dir):
-        if filename.endswith('.json'):
-            filepath = os.path.join(chunks_dir, filename)
+        filenames = sorted(filename for filename in os.listdir(chunks_dir) if filename.endswith('.json'))
+
+    digest = hashlib.sha1()
+    for filename in filenames:
+        stat = os.stat(os.path.join(chunks_dir, filename))
+        digest.update(f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+class LoadCheckpoint:
+    """
+    A class used to persist how many rows of a source have been uploaded.
+
+    Batches may complete out of order when they are uploaded in parallel, so only the
+    number of rows before the first batch still in flight is saved. The checkpoint
+    records a fingerprint of the source, and is ignored if the source changed.
+    """
+
+    def __init__(self, path: Optional[str], source: str, collection_name: str):
+        """
+        Constructor of the class
 
-            print(f"Processing file '{filename}'...")
+        Args:
+        path (Optional[str]): path of the checkpoint file, None disables the checkpoint
+        source (str): the directory the chunks are loaded from
+        collection_name (str): the name of the Qdrant collection
+        """
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.fingerprint = source_fingerprint(source) if path else None
+        self.collection_name = collection_name
+        self.completed_rows = 0
+        self._done_batches: Dict[int, int] = {}
 
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if state.get('source') != self.source or state.get('collection_name') != collection_name:
+                print(f"Warning: Checkpoint '{path}' refers to another source or collection. Ignoring it.")
+            elif state.get('fingerprint') != self.fingerprint:
+                print(f"Warning: The chunks changed since checkpoint '{path}' was written. Ignoring it.")
+            else:
+                self.completed_rows = state.get('completed_rows', 0)
+                print(f"Resuming from checkpoint '{path}': {self.completed_rows} rows already loaded.")
+
+    def mark_done(self, start: int, num_rows: int) -> None:
+        """
+        Method to record an uploaded batch, saving the checkpoint if the uploaded prefix grew
+
+        Args:
+        start (int): the index of the first row of the batch
+        num_rows (int): the number of rows of the batch
+        """
+        self._done_batches[start] = num_rows
+        advanced = False
+        while self.completed_rows in self._done_batches:
+            self.completed_rows += self._done_batches.pop(self.completed_rows)
+            advanced = True
+        if advanced:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Method to atomically write the checkpoint file
+        """
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+            json.dump({
+                'source': self.source,
+                'fingerprint': self.fingerprint,
+                'collection_name': self.collection_name,
+                'completed_rows': self.completed_rows,
+            }, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def complete(self) -> None:
+        """
+        Method to remove the checkpoint file once all the rows have been uploaded
+        """
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+def iter_json_chunk_batches(chunks_dir: str, batch_size: int, start: int = 0) -> Iterator[RowBatch]:
+    """
+    Read the JSON chunks of a directory in batches, in a stable (sorted) order.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks.
+        batch_size (int): Number of chunks of each batch.
+        start (int): Index of the first chunk to read.
+
+    Returns:
+        Iterator[RowBatch]: The batches of rows.
+    """
+    filenames = sorted(filename for filename in os.listdir(chunks_dir) if filename.endswith('.json'))
+    for offset in range(start, len(filenames), batch_size):
+        ids, vectors, payloads = [], [], []
+        batch_filenames = filenames[offset:offset + batch_size]
+        for filename in batch_filenames:
             try:
-                with open(filepath, 'r', encoding='utf-8') as json_file:
+                with open(os.path.join(chunks_dir, filename), 'r', encoding='utf-8') as json_file:
                     chunk = json.load(json_file)
-                    point_id = chunk['id']
-                    
-                    # Insert the point into Qdrant
-                    qdrant_client.upsert(
-                        collection_name=collection_name,
-                        points=[
-                            PointStruct(
-                                id=point_id,
-                                vector=chunk['vector'],
-                                payload=chunk['payload']
-                            )
-                        ]
-                    )
-                    print(f"Point {point_id} inserted into Qdrant.")
-                    processed_chunks.append(filepath)
+                ids.append(chunk['id'])
+                vectors.append(chunk['vector'])
+                payloads.append(chunk['payload'])
             except Exception as e:
                 print(f"Error processing file '{filename}': {e}")
-                unprocessed_chunks.append(filepath)
-    
+        yield offset, len(batch_filenames), ids, vectors, payloads
+
+def iter_chunk_store_batches(store_dir: str, batch_size: int, start: int = 0) -> Iterator[RowBatch]:
+    """
+    Read a chunk store in batches, taking the vectors from its memory-mapped matrix.
+
+    Args:
+        store_dir (str): Directory of the chunk store.
+        batch_size (int): Number of chunks of each batch.
+        start (int): Index of the first chunk to read.
+
+    Returns:
+        Iterator[RowBatch]: The batches of rows.
+    """
+    reader = ChunkStoreReader(store_dir)
+    for offset, ids, vectors, payloads in reader.iter_batches(batch_size, start):
+        yield offset, len(ids), ids, np.asarray(vectors).tolist(), payloads
+
+def count_rows(chunks_dir: str) -> Tuple[int, int]:
+    """
+    Count the chunks of a directory and find their vector size.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks, or a chunk store.
+
+    Returns:
+        Tuple[int, int]: The number of chunks and the size of their vectors.
+    """
+    if is_chunk_store(chunks_dir):
+        reader = ChunkStoreReader(chunks_dir)
+        return len(reader), reader.dim
+
+    filenames = [filename for filename in os.listdir(chunks_dir) if filename.endswith('.json')]
+    vector_size = 384
+    if filenames:
+        with open(os.path.join(chunks_dir, filenames[0]), 'r', encoding='utf-8') as json_file:
+            vector_size = len(json.load(json_file)['vector'])
+    return len(filenames), vector_size
+
+def upsert_batch(
+        qdrant_client: QdrantClient,
+        collection_name: str,
+        batch: RowBatch,
+        wait_for_result: bool,
+        max_retries: int = 3,
+        sparse: bool = False) -> int:
+    """
+    Upload a batch of rows with a single request, retrying with exponential backoff on failure.
+
+    Args:
+        qdrant_client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the Qdrant collection.
+        batch (RowBatch): The rows to upload.
+        wait_for_result (bool): Wait for the batch to be applied before returning.
+        max_retries (int): Maximum number of retries.
+        sparse (bool): Also upload the sparse keyword vectors of the chunks.
+
+    Returns:
+        int: The number of uploaded points.
+    """
+    _, _, ids, vectors, payloads = batch
+    if not ids:
+        return 0
+    vectors = build_vectors(vectors, payloads, sparse)
+    for attempt in range(max_retries + 1):
+        try:
+            qdrant_client.upsert(
+                collection_name=collection_name,
+                points=Batch(ids=ids, vectors=vectors, payloads=payloads),
+                wait=wait_for_result,
+            )
+            return len(ids)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(0.5 * (2 ** attempt))
+
+def load_chunks_to_qdrant(
+        chunks_dir: str,
+        collection_name: str,
+        qdrant_client: Optional[QdrantClient] = None,
+        batch_size: int = 256,
+        parallel: int = 4,
+        wait_for_result: bool = True,
+        checkpoint_file: Optional[str] = None,
+        profile: str = "default",
+        sparse: bool = False) -> int:
+    """
+    Load all the chunks from a directory into a Qdrant collection.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks, or a chunk store, to be loaded into Qdrant.
+        collection_name (str): Name of the Qdrant collection where the chunks will be stored.
+        qdrant_client (Optional[QdrantClient]): The Qdrant client, a client for 'localhost:6333' if None.
+        batch_size (int): Number of points sent to Qdrant with each request.
+        parallel (int): Number of batches uploaded in parallel.
+        wait_for_result (bool): Wait for each batch to be applied; if False the requests are
+            pipelined and Qdrant applies them asynchronously.
+        checkpoint_file (Optional[str]): Path of the checkpoint file used to resume an interrupted load.
+        profile (str): Name of the collection profile in COLLECTION_PROFILES.
+        sparse (bool): Create the collection with sparse keyword vectors. Collections
+            with sparse vectors always receive them.
+
+    Returns:
+        int: The number of chunks that failed to load.
+    """
+    # Connect to Qdrant instance
+    if qdrant_client is None:
+        qdrant_client = create_qdrant_client()
+
+    # The local mode is not thread-safe, so batches are uploaded one at a time
+    if is_local_client(qdrant_client) and parallel > 1:
+        print("Qdrant local mode detected, uploading one batch at a time.")
+        parallel = 1
+
+    num_rows, vector_size = count_rows(chunks_dir)
+
+    # Create the collection if it doesn't exist, with the vector size of the chunks
+    create_collection_if_missing(qdrant_client, collection_name, vector_size=vector_size, profile=profile, sparse=sparse)
+    create_payload_indexes(qdrant_client, collection_name)
+    sparse = has_sparse_vectors(qdrant_client, collection_name)
+    set_indexing(qdrant_client, collection_name, profile, enabled=False)
+
+    checkpoint = LoadCheckpoint(checkpoint_file, chunks_dir, collection_name)
+    iter_batches = iter_chunk_store_batches if is_chunk_store(chunks_dir) else iter_json_chunk_batches
+    batches = iter_batches(chunks_dir, batch_size, checkpoint.completed_rows)
+
+    reporter = ThroughputReporter("upload", unit="points", total=num_rows - checkpoint.completed_rows)
+    unprocessed_batches = []
+
+    try:
+        # Keep a bounded number of batches in flight, so that reading overlaps with uploading
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            in_flight = {}
+            for batch in batches:
+                in_flight[executor.submit(upsert_batch, qdrant_client, collection_name, batch, wait_for_result, sparse=sparse)] = batch
+                if len(in_flight) < 2 * parallel:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _handle_upload_result(future, in_flight.pop(future), checkpoint, reporter, unprocessed_batches)
+
+            for future in list(in_flight):
+                future.exception()
+                _handle_upload_result(future, in_flight.pop(future), checkpoint, reporter, unprocessed_batches)
+    finally:
+        set_indexing(qdrant_client, collection_name, profile, enabled=True)
+        bump_collection_version(qdrant_client, collection_name)
+
+    reporter.report()
     print(f"\nSummary:")
-    print(f"Processed {len(processed_chunks)} chunks successfully.")
-    print(f"Failed to process {len(unprocessed_chunks)} chunks.")
-    if unprocessed_chunks:
-        print(f"Failed chunks: {unprocessed_chunks}")
+    print(f"Processed {reporter.done} chunks successfully.")
+    print(f"Failed to process {reporter.failed} chunks.")
+    if unprocessed_batches:
+        print(f"Failed row ranges: {unprocessed_batches}")
+        print("The checkpoint stops before the first failed batch, re-run the loader to retry from there.")
+    else:
+        checkpoint.complete()
+    return reporter.failed
+
+def _handle_upload_result(future, batch: RowBatch, checkpoint: LoadCheckpoint, reporter: ThroughputReporter, unprocessed_batches: List) -> None:
+    """
+    Record the outcome of an uploaded batch.
+    """
+    start, num_rows, ids, _, _ = batch
+    try:
+        reporter.update(future.result(), failed=num_rows - len(ids))
+        checkpoint.mark_done(start, num_rows)
+    except Exception as e:
+        print(f"Error loading rows {start}-{start + num_rows - 1}: {e}")
+        reporter.update(0, failed=num_rows)
+        unprocessed_batches.append((start, start + num_rows - 1))
 
-def main(chunks_dir: str, collection_name: str) -> None:
+def main(
+        chunks_dir: str,
+        collection_name: str,
+        url: Optional[str] = None,
+        host: str = "localhost",
+        port: int = 6333,
+        location: Optional[str] = None,
+        path: Optional[str] = None,
+        prefer_grpc: bool = False,
+        batch_size: int = 256,
+        parallel: int = 4,
+        wait_for_result: bool = True,
+        checkpoint_file: Optional[str] = None,
+        profile: str = "default",
+        sparse: bool = False) -> int:
     """
     Main function to load chunks into Qdrant.
 
     Args:
-        chunks_dir (str): Directory containing JSON files of chunks to be loaded into Qdrant.
+        chunks_dir (str): Directory containing JSON files of chunks, or a chunk store, to be loaded into Qdrant.
         collection_name (str): Name of the Qdrant collection where the chunks will be stored.
+        url (Optional[str]): Qdrant instance URL, takes precedence over host and port.
+        host (str): Qdrant instance host.
+        port (int): Qdrant instance port.
+        location (Optional[str]): Qdrant location, e.g. ':memory:'.
+        path (Optional[str]): Path of a local on-disk Qdrant database.
+        prefer_grpc (bool): Use the gRPC interface of Qdrant.
+        batch_size (int): Number of points sent to Qdrant with each request.
+        parallel (int): Number of batches uploaded in parallel.
+        wait_for_result (bool): Wait for each batch to be applied before sending the next ones.
+        checkpoint_file (Optional[str]): Path of the checkpoint file used to resume an interrupted load.
+        profile (str): Name of the collection profile in COLLECTION_PROFILES.
+        sparse (bool): Create the collection with sparse keyword vectors.
+
+    Returns:
+        int: The number of chunks that failed to load.
     """
-    load_chunks_to_qdrant(chunks_dir, collection_name)
+    qdrant_client = create_qdrant_client(url, host, port, location, path, prefer_grpc)
+    return load_chunks_to_qdrant(chunks_dir, collection_name, qdrant_client, batch_size, parallel, wait_for_result, checkpoint_file, profile, sparse)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Qdrant Chunk Loader")
-    parser.add_argument("--chunks_dir", type=str, required=True, help="Directory containing JSON files of chunks to be loaded into Qdrant.")
+    parser.add_argument("--chunks_dir", type=str, required=True, help="Directory containing JSON files of chunks, or a chunk store, to be loaded into Qdrant.")
     parser.add_argument("--collection_name", type=str, required=True, default="olympics",help="Name of the Qdrant collection where the chunks will be stored.")
-    
+    parser.add_argument("--url", type=str, default=None, help="Qdrant instance URL, takes precedence over host and port.")
+    parser.add_argument("--host", type=str, default="localhost", help="Qdrant instance host (default is 'localhost').")
+    parser.add_argument("--port", type=int, default=6333, help="Qdrant instance port (default is 6333).")
+    parser.add_argument("--location", type=str, default=None, help="Qdrant location, e.g. ':memory:' for the in-memory local mode.")
+    parser.add_argument("--path", type=str, default=None, help="Path of a local on-disk Qdrant database.")
+    parser.add_argument("--prefer_grpc", action="store_true", help="Use the gRPC interface of Qdrant.")
+    parser.add_argument("--batch_size", type=int, default=256, help="Number of points sent to Qdrant with each request (default is 256).")
+    parser.add_argument("--parallel", type=int, default=4, help="Number of batches uploaded in parallel (default is 4).")
+    parser.add_argument("--no_wait", action="store_true", help="Do not wait for each batch to be applied before sending the next ones.")
+    parser.add_argument("--checkpoint_file", type=str, default=None, help="Path of the checkpoint file used to resume an interrupted load.")
+    parser.add_argument("--profile", type=str, default="default", choices=list(COLLECTION_PROFILES), help="Collection profile used when the collection is created (default is 'default').")
+    parser.add_argument("--sparse", action="store_true", help="Also store a sparse keyword vector of each chunk, for the hybrid retrieval.")
+
     args = parser.parse_args()
 
-    main(args.chunks_dir, args.collection_name)
+    # A non-zero exit status stops the tasks chaining the load, e.g. before committing a refresh
+    failed = main(
+        args.chunks_dir,
+        args.collection_name,
+        args.url,
+        args.host,
+        args.port,
+        args.location,
+        args.path,
+        args.prefer_grpc,
+        args.batch_size,
+        args.parallel,
+        not args.no_wait,
+        args.checkpoint_file,
+        args.profile,
+        args.sparse,
+    )
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,316 @@
+"""
+Incremental Refresh Script
+
+This script refreshes a corpus that was already acquired, processing only the Wikipedia
+pages that changed since the last run. A manifest (see page_manifest.py) records the
+revision and the content hash of every page:
+
+1. the latest revision of all the pages is checked, 50 titles per request;
+2. only the new pages and the pages with a new revision are fetched and processed;
+   pages whose processed content didn't change are skipped;
+3. the changed documents are saved in the output directory, which only holds the pages
+   changed by the last refresh, to be chunked and loaded as usual;
+4. the chunks of the changed pages, of the pages deleted from Wikipedia and of the pages
+   removed from the URL list are deleted from the Qdrant collection by their 'url' payload;
+5. the new revisions are staged in the manifest, and committed with `--commit` once the
+   changed documents have been chunked and loaded.
+
+Until the refresh is committed, the next refresh processes the same pages again: a failed
+or skipped load is therefore retried, and the documents of the pages that can't be fetched
+again are kept in the output directory.
+
+A daily refresh therefore costs one request per 50 pages plus the processing of the
+changed pages, instead of the processing of the whole corpus. The first run, with an
+empty manifest, processes all the pages.
+
+Usage:
+    conda env create -f wiki_rag.yaml
+    conda activate wiki_rag
+
+    From the root directory of the repository:
+
+    python vectorization_pipeline/refresh.py --input_urls_file wikipedia_urls.txt --manifest_path data/manifest.sqlite --output_docs_dir data/refresh_document --collection_name olympics
+
+    Then chunk and load the changed pages, and commit the refresh (or run `invoke refresh-vectorization-pipeline`):
+
+    python vectorization_pipeline/wikipedia_chunker.py --input_docs_dir data/refresh_document --output_chunks_dir data/refresh_chunks --output_format store
+    python vectorization_pipeline/qdrant_loader.py --chunks_dir data/refresh_chunks --collection_name olympics
+    python vectorization_pipeline/refresh.py --commit --manifest_path data/manifest.sqlite --chunks_dir data/refresh_chunks
+
+Arguments:
+    --input_urls_file: Path to the file containing Wikipedia URLs, required unless --commit is given.
+    --manifest_path: Path of the SQLite manifest of the pages, created on the first run.
+    --output_docs_dir: Directory where the changed documents will be saved, its previous JSON files are removed.
+    --language: Language of the Wikipedia pages ('en' for English, 'it' for Italian).
+    --collection_name: Optional name of the Qdrant collection from which the stale chunks are deleted.
+    --qdrant_url: URL of the Qdrant server (default is 'http://localhost:6333').
+    --workers: Number of requests sent in parallel.
+    --api_url: MediaWiki API endpoint, '{language}' is replaced with the language.
+    --requests_per_second: Maximum number of requests per second sent to each host.
+    --tokenizer: 'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer.
+    --commit: Commit the revisions staged by the last refresh, after its documents were chunked and loaded.
+    --chunks_dir: With --commit, the chunks of the refresh, which can't be empty if the refresh saved documents.
+"""
+
+import os
+import sys
+import argparse
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from document_acquisition import TOKENIZERS, load_wikipedia_urls, get_title_from_url, build_document, document_filename, save_documents_as_json
+from wikipedia_fetcher import WikipediaFetcher, DEFAULT_API_URL
+from page_manifest import PageManifest, document_hash
+from chunk_store import ChunkStoreReader, is_chunk_store
+
+# The Qdrant client is only imported when a collection is refreshed
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+
+def plan_refresh(manifest_pages: Dict[str, Dict], revisions: Dict[str, Optional[Dict]]) -> Dict[str, List[str]]:
+    """
+    Compare the latest revisions of the pages with the manifest.
+
+    Args:
+        manifest_pages (Dict[str, Dict]): The pages of the manifest, by requested title.
+        revisions (Dict[str, Optional[Dict]]): The latest revisions, by requested title, None for missing pages.
+
+    Returns:
+        Dict[str, List[str]]: The titles of the 'new', 'changed', 'unchanged' and 'deleted' pages.
+    """
+    plan = {'new': [], 'changed': [], 'unchanged': [], 'deleted': []}
+    for title, revision in revisions.items():
+        known = manifest_pages.get(title)
+        if revision is None:
+            if known is not None:
+                plan['deleted'].append(title)
+            else:
+                print(f"Warning: Page '{title}' not found. Skipping page.")
+        elif known is None:
+            plan['new'].append(title)
+        elif known['revision_id'] != revision['revision_id']:
+            plan['changed'].append(title)
+        else:
+            plan['unchanged'].append(title)
+
+    # Pages removed from the URL list
+    plan['deleted'].extend(title for title in manifest_pages if title not in revisions)
+    return plan
+
+def clear_documents(output_docs_dir: str, keep: Optional[List[str]] = None) -> None:
+    """
+    Create the directory of the changed documents, removing the JSON documents saved by the previous refresh.
+
+    Args:
+        output_docs_dir (str): Directory of the changed documents.
+        keep (Optional[List[str]]): Titles of the documents that are not removed.
+    """
+    keep_filenames = {document_filename(title) for title in keep or []}
+    os.makedirs(output_docs_dir, exist_ok=True)
+    for filename in os.listdir(output_docs_dir):
+        if filename.endswith('.json') and filename not in keep_filenames:
+            os.remove(os.path.join(output_docs_dir, filename))
+
+def refresh(
+        titles: List[str],
+        manifest: PageManifest,
+        fetcher: WikipediaFetcher,
+        language: str,
+        output_docs_dir: str,
+        qdrant_client: Optional["QdrantClient"] = None,
+        collection_name: Optional[str] = None,
+        tokenizer: str = 'simple') -> Dict[str, int]:
+    """
+    Process the pages changed since the last committed refresh, delete their stale chunks
+    and stage their new revisions in the manifest.
+
+    Args:
+        titles (List[str]): Titles of the Wikipedia pages of the corpus.
+        manifest (PageManifest): The manifest of the pages, where the new revisions are staged.
+        fetcher (WikipediaFetcher): The fetcher of the Wikipedia pages.
+        language (str): Language of the Wikipedia pages.
+        output_docs_dir (str): Directory where the changed documents will be saved.
+        qdrant_client (Optional[QdrantClient]): The Qdrant client, None keeps the collection unchanged.
+        collection_name (Optional[str]): Name of the Qdrant collection.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+
+    Returns:
+        Dict[str, int]: The number of 'new', 'changed', 'unchanged' and 'deleted' pages, of 'saved'
+        documents and of 'pending' changes staged in the manifest.
+    """
+    manifest_pages = manifest.get_all(language)
+    previous_pending = manifest.get_pending(language)
+    if previous_pending:
+        print(f"Warning: The {len(previous_pending)} changes of the previous refresh were not committed, "
+              f"their pages are processed again.")
+    plan = plan_refresh(manifest_pages, fetcher.fetch_revisions(titles, language))
+    print(f"Revision check: {len(plan['new'])} new, {len(plan['changed'])} changed, "
+          f"{len(plan['unchanged'])} unchanged and {len(plan['deleted'])} deleted pages.")
+
+    saved_titles = []
+    updated_pages = {}
+    stale_urls = [manifest_pages[title]['url'] for title in plan['deleted']]
+    for title, page in fetcher.fetch_pages(plan['new'] + plan['changed'], language):
+        # Pages that could not be fetched keep their previous revision, and are retried by the next refresh
+        if page is None:
+            continue
+        document = build_document(page['title'], page['url'], page['language'], page['text'], tokenizer)
+        content_hash = document_hash(document['content'])
+        known = manifest_pages.get(title)
+        updated_pages[title] = {
+            'title': page['title'],
+            'url': page['url'],
+            'revision_id': page['revision_id'],
+            'timestamp': page['timestamp'],
+            'content_hash': content_hash,
+        }
+        # Edits outside of the text, e.g. of the categories, leave the chunks unchanged
+        if known is not None and known['content_hash'] == content_hash and known['url'] == page['url']:
+            continue
+
+        # The chunks of new pages are deleted too, in case they were loaded before the manifest existed
+        stale_urls.extend(url for url in (page['url'], known and known['url']) if url)
+        save_documents_as_json({title: document}, output_docs_dir)
+        saved_titles.append(title)
+
+    # Pages staged by the previous refresh that could not be fetched again keep their staged
+    # revision and their document, since their stale chunks were already deleted
+    kept_titles = [
+        title for title in plan['new'] + plan['changed']
+        if title not in updated_pages and previous_pending.get(title) is not None
+    ]
+    for title in kept_titles:
+        updated_pages[title] = previous_pending[title]
+    clear_documents(output_docs_dir, keep=saved_titles + kept_titles)
+
+    if qdrant_client is not None and collection_name:
+        from qdrant_loader import delete_pages
+        delete_pages(qdrant_client, collection_name, list(dict.fromkeys(stale_urls)))
+
+    manifest.set_pending(updated_pages, plan['deleted'], language, saved_titles + kept_titles)
+    pending = len(updated_pages) + len(plan['deleted'])
+
+    print(f"Saved {len(saved_titles)} changed documents in '{output_docs_dir}'.")
+    print(f"Staged {pending} changes in the manifest, commit them with --commit once the documents are chunked and loaded.")
+    return {**{key: len(value) for key, value in plan.items()}, 'saved': len(saved_titles), 'pending': pending}
+
+def count_chunks(chunks_dir: str) -> int:
+    """
+    Count the chunks of a directory.
+
+    Args:
+        chunks_dir (str): Directory containing JSON files of chunks, or a chunk store.
+
+    Returns:
+        int: The number of chunks, 0 if the directory doesn't exist.
+    """
+    if not os.path.isdir(chunks_dir):
+        return 0
+    if is_chunk_store(chunks_dir):
+        return len(ChunkStoreReader(chunks_dir))
+    return sum(1 for filename in os.listdir(chunks_dir) if filename.endswith('.json'))
+
+def commit_refresh(manifest: PageManifest, language: str, chunks_dir: Optional[str] = None) -> int:
+    """
+    Commit the revisions staged by the last refresh, once its documents have been chunked and loaded.
+
+    Args:
+        manifest (PageManifest): The manifest of the pages.
+        language (str): Language of the Wikipedia pages.
+        chunks_dir (Optional[str]): The chunks of the refresh, checked not to be empty if the refresh
+            saved documents, None skips the check.
+
+    Returns:
+        int: The number of committed changes.
+    """
+    # A chunking that failed without an error status would otherwise commit pages whose chunks were deleted
+    saved_documents = manifest.count_pending_documents(language)
+    if chunks_dir is not None and saved_documents and not count_chunks(chunks_dir):
+        raise ValueError(
+            f"The last refresh saved {saved_documents} documents, but '{chunks_dir}' has no chunks: "
+            f"chunk and load them before committing"
+        )
+    committed = manifest.commit_pending(language)
+    print(f"Committed {committed} changes to the manifest.")
+    return committed
+
+def main(
+        input_urls_file: Optional[str],
+        manifest_path: str,
+        output_docs_dir: str,
+        language: str,
+        collection_name: Optional[str] = None,
+        qdrant_url: str = "http://localhost:6333",
+        workers: int = 8,
+        api_url: str = DEFAULT_API_URL,
+        requests_per_second: float = 20.0,
+        tokenizer: str = 'simple',
+        commit: bool = False,
+        chunks_dir: Optional[str] = None) -> bool:
+    """
+    Main function to refresh the corpus, or to commit the last refresh.
+
+    Args:
+        input_urls_file (Optional[str]): Path to the file containing Wikipedia URLs, unused with `commit`.
+        manifest_path (str): Path of the SQLite manifest of the pages.
+        output_docs_dir (str): Directory where the changed documents will be saved.
+        language (str): Language of the Wikipedia pages.
+        collection_name (Optional[str]): Name of the Qdrant collection from which the stale chunks are deleted.
+        qdrant_url (str): URL of the Qdrant server.
+        workers (int): Number of requests sent in parallel.
+        api_url (str): MediaWiki API endpoint, '{language}' is replaced with the language.
+        requests_per_second (float): Maximum number of requests per second sent to each host.
+        tokenizer (str): 'simple' to split on whitespace, 'nltk' for the NLTK word tokenizer.
+        commit (bool): Commit the revisions staged by the last refresh instead of refreshing.
+        chunks_dir (Optional[str]): With `commit`, the chunks of the refresh, None skips their check.
+
+    Returns:
+        bool: False if the commit was refused.
+    """
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    manifest = PageManifest(manifest_path)
+    if commit:
+        try:
+            commit_refresh(manifest, language, chunks_dir)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        finally:
+            manifest.close()
+        return True
+
+    titles = [get_title_from_url(url) for url in load_wikipedia_urls(input_urls_file)]
+    fetcher = WikipediaFetcher(workers=workers, api_url=api_url, requests_per_second=requests_per_second)
+    qdrant_client = None
+    if collection_name:
+        from qdrant_loader import create_qdrant_client
+        qdrant_client = create_qdrant_client(url=qdrant_url)
+    try:
+        refresh(titles, manifest, fetcher, language, output_docs_dir, qdrant_client, collection_name, tokenizer)
+    finally:
+        fetcher.close()
+        manifest.close()
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental Corpus Refresh")
+    parser.add_argument("--input_urls_file", type=str, default=None, help="Path to the file containing Wikipedia URLs, required unless --commit is given.")
+    parser.add_argument("--manifest_path", type=str, default="data/manifest.sqlite", help="Path of the SQLite manifest of the pages (default is 'data/manifest.sqlite').")
+    parser.add_argument("--output_docs_dir", type=str, default="data/refresh_document", help="Directory where the changed documents will be saved (default is 'data/refresh_document').")
+    parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the Wikipedia pages (default is 'it').")
+    parser.add_argument("--collection_name", type=str, default=None, help="Name of the Qdrant collection from which the stale chunks are deleted (default is none).")
+    parser.add_argument("--qdrant_url", type=str, default="http://localhost:6333", help="URL of the Qdrant server (default is 'http://localhost:6333').")
+    parser.add_argument("--workers", type=int, default=8, help="Number of requests sent in parallel (default is 8).")
+    parser.add_argument("--api_url", type=str, default=DEFAULT_API_URL, help="MediaWiki API endpoint, '{language}' is replaced with the language.")
+    parser.add_argument("--requests_per_second", type=float, default=20.0, help="Maximum number of requests per second sent to each host (default is 20).")
+    parser.add_argument("--tokenizer", type=str, default="simple", choices=list(TOKENIZERS), help="'simple' to split the cleaned text on whitespace, 'nltk' for the NLTK word tokenizer (default is 'simple').")
+    parser.add_argument("--commit", action="store_true", help="Commit the revisions staged by the last refresh, after its documents were chunked and loaded.")
+    parser.add_argument("--chunks_dir", type=str, default=None, help="With --commit, the chunks of the refresh, which can't be empty if the refresh saved documents (default is no check).")
+
+    args = parser.parse_args()
+    if not args.commit and not args.input_urls_file:
+        parser.error("--input_urls_file is required unless --commit is given")
+
+    if not main(args.input_urls_file, args.manifest_path, args.output_docs_dir, args.language, args.collection_name, args.qdrant_url, args.workers, args.api_url, args.requests_per_second, args.tokenizer, args.commit, args.chunks_dir):
+        sys.exit(1)
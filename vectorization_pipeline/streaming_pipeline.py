@@ -0,0 +1,402 @@
+"""
+Streaming Vectorization Pipeline Script
+
+This script runs the whole vectorization pipeline in a single process: Wikipedia
+pages are fetched, cleaned, chunked, embedded and uploaded to Qdrant while the
+next pages are still being downloaded. The stages are connected by bounded queues,
+so they overlap and the peak memory depends on the queue sizes rather than on the
+size of the corpus. Nothing is written to disk unless a checkpoint directory is given.
+
+Usage:
+    conda env create -f wiki_rag.yaml
+    conda activate wiki_rag
+
+    From the root directory of the repository:
+
+    python vectorization_pipeline/streaming_pipeline.py --input_urls_file wikipedia_urls.txt --collection_name olympics
+
+Arguments:
+    --input_urls_file: Path to the file containing Wikipedia URLs.
+    --collection_name: Name of the Qdrant collection where the chunks will be stored.
+    --qdrant_url: URL of the Qdrant server (default is 'http://localhost:6333').
+    --language: Language of the Wikipedia pages ('en' for English, 'it' for Italian).
+    --workers: Number of pages fetched in parallel.
+    --api_url: MediaWiki API endpoint, '{language}' is replaced with the language.
+    --requests_per_second: Maximum number of requests per second sent to each host.
+    --queue_size: Maximum number of items waiting between two stages.
+    --upload_batch_size: Number of points sent to Qdrant with each request.
+    --chunk_size: Size of each chunk in characters.
+    --chunk_overlap: Overlap between chunks in characters.
+    --embedding_model: Name of the SentenceTransformer model to use for generating embeddings.
+    --onnx_model_path: Path of the ONNX model, possibly int8 quantized, exported from the embedding model (see wiki_rag/embeddings.py).
+    --embedding_batch_size: Number of chunks, possibly from different documents, embedded together.
+    --num_threads: Number of threads used by torch, or ONNX Runtime, to compute the embeddings.
+    --cache_path: Path of a SQLite embedding cache, so that re-runs only embed the new or changed chunks.
+    --checkpoint_docs_dir: Optional directory where the processed documents are also saved as JSON files.
+    --checkpoint_chunks_dir: Optional directory where the chunks are also saved as JSON files.
+    --profile: Collection profile used when the collection is created (see `qdrant_loader.COLLECTION_PROFILES`).
+    --sparse: Also store a sparse keyword vector of each chunk, used by the hybrid retrieval of WikiRag.
+"""
+
+import queue
+import argparse
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+
+from document_acquisition import load_wikipedia_urls, get_title_from_url, build_document, save_documents_as_json
+from wikipedia_fetcher import WikipediaFetcher, DEFAULT_API_URL
+from wikipedia_chunker import EmbeddingBatcher, EmbeddingService, split_document, save_chunk_to_json
+from qdrant_loader import COLLECTION_PROFILES, create_collection_if_missing, create_payload_indexes, has_sparse_vectors, set_indexing, upsert_chunks, bump_collection_version
+from embedding_cache import EmbeddingCache
+from progress import ThroughputReporter
+
+# Marks the end of the stream in a queue
+END_OF_STREAM = object()
+
+
+class StreamingPipeline:
+    """
+    A class used to run acquisition, chunking, embedding and upload as overlapping stages.
+    """
+
+    def __init__(
+            self,
+            qdrant_client: QdrantClient,
+            collection_name: str,
+            language: str = "it",
+            workers: int = 8,
+            api_url: str = DEFAULT_API_URL,
+            requests_per_second: float = 20.0,
+            chunk_size: int = 450,
+            chunk_overlap: int = 20,
+            embedding_model_name: str = "all-MiniLM-L6-v2",
+            embedding_batch_size: int = 64,
+            num_threads: Optional[int] = None,
+            cache_path: Optional[str] = None,
+            queue_size: int = 64,
+            upload_batch_size: int = 256,
+            checkpoint_docs_dir: Optional[str] = None,
+            checkpoint_chunks_dir: Optional[str] = None,
+            profile: str = "default",
+            sparse: bool = False,
+            onnx_model_path: Optional[str] = None):
+        """
+        Constructor of the class
+
+        Args:
+        qdrant_client (QdrantClient): the client of the Qdrant server
+        collection_name (str): the name of the collection where the chunks will be stored
+        language (str): the language of the Wikipedia pages
+        workers (int): the number of pages fetched in parallel
+        api_url (str): the MediaWiki API endpoint, '{language}' is replaced with the language
+        requests_per_second (float): the maximum number of requests per second sent to each host
+        chunk_size (int): the size of each chunk in characters
+        chunk_overlap (int): the overlap between chunks in characters
+        embedding_model_name (str): the name of the SentenceTransformer model
+        embedding_batch_size (int): the number of chunks, possibly from different documents, embedded together
+        num_threads (Optional[int]): the number of torch threads, None keeps the torch default
+        cache_path (Optional[str]): the path of the SQLite embedding cache, None disables the cache
+        queue_size (int): the maximum number of items waiting between two stages
+        upload_batch_size (int): the number of points sent to Qdrant with each request
+        checkpoint_docs_dir (Optional[str]): if set, the documents are also saved in this directory
+        checkpoint_chunks_dir (Optional[str]): if set, the chunks are also saved in this directory
+        profile (str): the collection profile used when the collection is created
+        sparse (bool): if True, the collection is created with sparse keyword vectors
+        onnx_model_path (Optional[str]): the path of the ONNX model exported from the embedding model, None uses torch
+        """
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.language = language
+        self.fetcher = WikipediaFetcher(workers=workers, api_url=api_url, requests_per_second=requests_per_second)
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.embedding_model_name = embedding_model_name
+        self.embedding_batch_size = embedding_batch_size
+        self.num_threads = num_threads
+        self.cache_path = cache_path
+        self.upload_batch_size = upload_batch_size
+        self.checkpoint_docs_dir = checkpoint_docs_dir
+        self.checkpoint_chunks_dir = checkpoint_chunks_dir
+        self.profile = profile
+        self.sparse = sparse
+        self.onnx_model_path = onnx_model_path
+
+        self.documents_queue = queue.Queue(maxsize=queue_size)
+        self.chunks_queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def _put(self, target_queue: queue.Queue, item: Any) -> bool:
+        """
+        Put an item in a queue, giving up if another stage failed.
+
+        Returns:
+            bool: False if the pipeline has been stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source_queue: queue.Queue) -> Any:
+        """
+        Get an item from a queue, returning END_OF_STREAM if another stage failed.
+        """
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return END_OF_STREAM
+
+    def _run_stage(self, stage: Callable, *args: Any) -> None:
+        """
+        Run a stage, stopping the whole pipeline if it fails.
+        """
+        try:
+            stage(*args)
+        except BaseException as e:
+            print(f"Error: Stage '{stage.__name__}' failed: {e}")
+            self._errors.append(e)
+            self._stop.set()
+
+    def fetch_stage(self, titles: List[str]) -> None:
+        """
+        Stage fetching and cleaning the Wikipedia pages.
+
+        Args:
+        titles (List[str]): the titles of the Wikipedia pages
+        """
+        try:
+            for title, page in self.fetcher.fetch_pages(titles, self.language):
+                if page is None:
+                    print(f"Warning: Page '{title}' not found. Skipping page.")
+                    continue
+                document = build_document(page['title'], page['url'], page['language'], page['text'])
+                if self.checkpoint_docs_dir:
+                    save_documents_as_json({title: document}, self.checkpoint_docs_dir)
+                if not self._put(self.documents_queue, document):
+                    return
+        finally:
+            self.fetcher.close()
+            self._put(self.documents_queue, END_OF_STREAM)
+
+    def _put_chunks(self, chunks: List[Dict]) -> bool:
+        """
+        Put embedded chunks in the chunks queue, saving them first if a checkpoint directory is set.
+
+        Returns:
+            bool: False if the pipeline has been stopped.
+        """
+        for chunk in chunks:
+            if self.checkpoint_chunks_dir:
+                save_chunk_to_json(chunk, self.checkpoint_chunks_dir)
+            if not self._put(self.chunks_queue, chunk):
+                return False
+        return True
+
+    def chunk_stage(self, embedding_model: EmbeddingService) -> None:
+        """
+        Stage splitting the documents into chunks and creating their embeddings in
+        batches that span consecutive documents.
+
+        Args:
+        embedding_model (EmbeddingService): the service used to create the embeddings
+        """
+        cache = EmbeddingCache(self.cache_path) if self.cache_path else None
+        batcher = EmbeddingBatcher(embedding_model, embedding_model.name, batch_size=self.embedding_batch_size, cache=cache)
+        try:
+            while (document := self._get(self.documents_queue)) is not END_OF_STREAM:
+                texts, metadata = split_document(document, self.text_splitter)
+                if not self._put_chunks(batcher.add(texts, metadata)):
+                    return
+            if not self._stop.is_set():
+                self._put_chunks(batcher.flush())
+                batcher.reporter.report()
+        finally:
+            if cache is not None:
+                cache.close()
+            self._put(self.chunks_queue, END_OF_STREAM)
+
+    def upload_stage(self) -> None:
+        """
+        Stage uploading the chunks to Qdrant in batches.
+        """
+        reporter = ThroughputReporter("upload", unit="points")
+        batch = []
+        while (chunk := self._get(self.chunks_queue)) is not END_OF_STREAM:
+            batch.append(chunk)
+            if len(batch) >= self.upload_batch_size:
+                upsert_chunks(self.qdrant_client, self.collection_name, batch, sparse=self.sparse)
+                reporter.update(len(batch))
+                batch = []
+
+        if batch and not self._stop.is_set():
+            upsert_chunks(self.qdrant_client, self.collection_name, batch, sparse=self.sparse)
+            reporter.update(len(batch))
+        reporter.report()
+
+    def run(self, titles: List[str]) -> None:
+        """
+        Method to run the pipeline on a list of Wikipedia pages
+
+        Args:
+        titles (List[str]): the titles of the Wikipedia pages
+        """
+        embedding_model = EmbeddingService(
+            self.embedding_model_name,
+            backend="onnx" if self.onnx_model_path else "torch",
+            onnx_model_path=self.onnx_model_path,
+            batch_size=self.embedding_batch_size,
+            num_threads=self.num_threads,
+        )
+        create_collection_if_missing(
+            self.qdrant_client,
+            self.collection_name,
+            vector_size=embedding_model.get_sentence_embedding_dimension(),
+            profile=self.profile,
+            sparse=self.sparse
+        )
+        create_payload_indexes(self.qdrant_client, self.collection_name)
+        # Collections created with sparse vectors always receive them
+        self.sparse = has_sparse_vectors(self.qdrant_client, self.collection_name)
+        set_indexing(self.qdrant_client, self.collection_name, self.profile, enabled=False)
+
+        stages = [
+            threading.Thread(target=self._run_stage, args=(self.fetch_stage, titles), name="fetch"),
+            threading.Thread(target=self._run_stage, args=(self.chunk_stage, embedding_model), name="chunk"),
+            threading.Thread(target=self._run_stage, args=(self.upload_stage,), name="upload"),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        set_indexing(self.qdrant_client, self.collection_name, self.profile, enabled=True)
+        bump_collection_version(self.qdrant_client, self.collection_name)
+
+        if self._errors:
+            raise RuntimeError("The streaming pipeline failed") from self._errors[0]
+
+def main(
+        input_urls_file: str,
+        collection_name: str,
+        qdrant_url: str,
+        language: str,
+        workers: int,
+        api_url: str,
+        requests_per_second: float,
+        queue_size: int,
+        upload_batch_size: int,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        embedding_batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        cache_path: Optional[str] = None,
+        checkpoint_docs_dir: Optional[str] = None,
+        checkpoint_chunks_dir: Optional[str] = None,
+        profile: str = "default",
+        sparse: bool = False,
+        onnx_model_path: Optional[str] = None) -> None:
+    """
+    Main function to run the streaming vectorization pipeline.
+
+    Args:
+        input_urls_file (str): Path to the file containing Wikipedia URLs.
+        collection_name (str): Name of the Qdrant collection where the chunks will be stored.
+        qdrant_url (str): URL of the Qdrant server.
+        language (str): Language of the Wikipedia pages.
+        workers (int): Number of pages fetched in parallel.
+        api_url (str): MediaWiki API endpoint, '{language}' is replaced with the language.
+        requests_per_second (float): Maximum number of requests per second sent to each host.
+        queue_size (int): Maximum number of items waiting between two stages.
+        upload_batch_size (int): Number of points sent to Qdrant with each request.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        embedding_batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        checkpoint_docs_dir (Optional[str]): Optional directory where the documents are also saved.
+        checkpoint_chunks_dir (Optional[str]): Optional directory where the chunks are also saved.
+        profile (str): Collection profile used when the collection is created.
+        sparse (bool): Create the collection with sparse keyword vectors.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+    """
+    titles = [get_title_from_url(url) for url in load_wikipedia_urls(input_urls_file)]
+
+    pipeline = StreamingPipeline(
+        qdrant_client=QdrantClient(url=qdrant_url),
+        collection_name=collection_name,
+        language=language,
+        workers=workers,
+        api_url=api_url,
+        requests_per_second=requests_per_second,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model_name=embedding_model_name,
+        embedding_batch_size=embedding_batch_size,
+        num_threads=num_threads,
+        cache_path=cache_path,
+        queue_size=queue_size,
+        upload_batch_size=upload_batch_size,
+        checkpoint_docs_dir=checkpoint_docs_dir,
+        checkpoint_chunks_dir=checkpoint_chunks_dir,
+        profile=profile,
+        sparse=sparse,
+        onnx_model_path=onnx_model_path,
+    )
+    pipeline.run(titles)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming Vectorization Pipeline")
+    parser.add_argument("--input_urls_file", type=str, required=True, help="Path to the file containing Wikipedia URLs.")
+    parser.add_argument("--collection_name", type=str, default="olympics", help="Name of the Qdrant collection where the chunks will be stored.")
+    parser.add_argument("--qdrant_url", type=str, default="http://localhost:6333", help="URL of the Qdrant server (default is 'http://localhost:6333').")
+    parser.add_argument("--language", type=str, default="it", choices=["it", "en"], help="Language of the Wikipedia pages (default is 'it').")
+    parser.add_argument("--workers", type=int, default=8, help="Number of pages fetched in parallel (default is 8).")
+    parser.add_argument("--api_url", type=str, default=DEFAULT_API_URL, help="MediaWiki API endpoint, '{language}' is replaced with the language.")
+    parser.add_argument("--requests_per_second", type=float, default=20.0, help="Maximum number of requests per second sent to each host (default is 20).")
+    parser.add_argument("--queue_size", type=int, default=64, help="Maximum number of items waiting between two stages (default is 64).")
+    parser.add_argument("--upload_batch_size", type=int, default=256, help="Number of points sent to Qdrant with each request (default is 256).")
+    parser.add_argument("--chunk_size", type=int, default=450, help="Size of each chunk in characters (default is 450).")
+    parser.add_argument("--chunk_overlap", type=int, default=20, help="Overlap between chunks in characters (default is 20).")
+    parser.add_argument("--embedding_model", type=str, default="all-MiniLM-L6-v2", help="Name of the SentenceTransformer model to use (default is 'all-MiniLM-L6-v2').")
+    parser.add_argument("--onnx_model_path", type=str, default=None, help="Path of the ONNX model, possibly int8 quantized, exported from the embedding model (default is the torch model).")
+    parser.add_argument("--embedding_batch_size", type=int, default=64, help="Number of chunks embedded together (default is 64).")
+    parser.add_argument("--num_threads", type=int, default=None, help="Number of threads used by torch (default is the torch default).")
+    parser.add_argument("--cache_path", type=str, default=None, help="Path of the SQLite embedding cache (default is no cache).")
+    parser.add_argument("--checkpoint_docs_dir", type=str, default=None, help="Optional directory where the processed documents are also saved as JSON files.")
+    parser.add_argument("--checkpoint_chunks_dir", type=str, default=None, help="Optional directory where the chunks are also saved as JSON files.")
+    parser.add_argument("--profile", type=str, default="default", choices=list(COLLECTION_PROFILES), help="Collection profile used when the collection is created (default is 'default').")
+    parser.add_argument("--sparse", action="store_true", help="Also store a sparse keyword vector of each chunk, for the hybrid retrieval.")
+
+    args = parser.parse_args()
+
+    main(
+        args.input_urls_file,
+        args.collection_name,
+        args.qdrant_url,
+        args.language,
+        args.workers,
+        args.api_url,
+        args.requests_per_second,
+        args.queue_size,
+        args.upload_batch_size,
+        args.chunk_size,
+        args.chunk_overlap,
+        args.embedding_model,
+        args.embedding_batch_size,
+        args.num_threads,
+        args.cache_path,
+        args.checkpoint_docs_dir,
+        args.checkpoint_chunks_dir,
+        args.profile,
+        args.sparse,
+        args.onnx_model_path,
+    )
@@ -16,6 +16,19 @@ You can also execute each task individually if needed:
 - Document Chunking: invoke chunk-documents
 - Qdrant Upload: invoke upload-to-qdrant
 
+The same steps can also run as a single in-process streaming pipeline, where the
+stages overlap and no intermediate JSON directories are written:
+
+    invoke streaming-vectorization-pipeline
+
+To refresh a corpus already loaded, processing only the pages changed since the last run:
+
+    invoke refresh-vectorization-pipeline
+
+To build the corpus from a local Wikipedia dump instead of the API:
+
+    invoke dump-vectorization-pipeline --dump-file=data/itwiki-latest-pages-articles.xml.bz2
+
 Invoke the pipeline with all custom parameters as needed. For example:
 
 invoke full_vectorization_pipeline --input-urls="custom_urls.txt" --output-docs-dir="custom_raw_docs_dir" --input-docs-dir="custom_raw_docs_dir" --output-chunks-dir="custom_chunks_dir" --chunks-dir="custom_chunks_dir" --collection-name="custom_collection_name"
@@ -25,7 +38,7 @@ invoke full_vectorization_pipeline --input-urls="custom_urls.txt" --output-docs-
 from invoke import task
 
 @task
-def acquire_documents(c, input_urls="wikipedia_urls.txt", output_docs_dir="data/raw_document_pipe"):
+def acquire_documents(c, input_urls="wikipedia_urls.txt", output_docs_dir="data/raw_document_pipe", workers=1):
     """
     Task to download documents.
 
@@ -33,16 +46,17 @@ def acquire_documents(c, input_urls="wikipedia_urls.txt", output_docs_dir="data/
         c (Context): The Invoke context.
         input_urls (str): Path to the file containing URLs to download.
         output_docs_dir (str): Directory where the downloaded documents will be saved.
+        workers (int): Number of pages fetched in parallel.
 
     Example:
-        invoke acquire-documents --input-urls=custom_urls.txt --output_docs_dir=custom_output_chunks_dir
+        invoke acquire-documents --input-urls=custom_urls.txt --output_docs_dir=custom_output_chunks_dir --workers=16
     """
     print("Starting document acquisition...")
-    c.run(f"python vectorization_pipeline/document_acquisition.py --input_urls {input_urls} --output_docs_dir {output_docs_dir}")
+    c.run(f"python vectorization_pipeline/document_acquisition.py --input_urls {input_urls} --output_docs_dir {output_docs_dir} --workers {workers}")
     print("Document acquisition completed.")
 
 @task
-def chunk_documents(c, input_docs_dir="data/raw_document_pipe", output_chunks_dir="data/chunks_pipe"):
+def chunk_documents(c, input_docs_dir="data/raw_document_pipe", output_chunks_dir="data/chunks_pipe", workers=1, output_format="json"):
     """
     Task to chunk the documents.
 
@@ -50,16 +64,18 @@ def chunk_documents(c, input_docs_dir="data/raw_document_pipe", output_chunks_di
         c (Context): The Invoke context.
         input_docs_dir (str): Directory containing raw documents.
         output_chunks_dir (str): Directory where the document chunks will be saved.
+        workers (int): Number of worker processes chunking the documents.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a columnar chunk store.
 
     Example:
-        invoke chunk-documents --input-dir=custom_input_docs_dir --output-dir=custom_output_chunks_dir
+        invoke chunk-documents --input-dir=custom_input_docs_dir --output-dir=custom_output_chunks_dir --workers=8 --output-format=store
     """
     print("Starting document chunking...")
-    c.run(f"python vectorization_pipeline/wikipedia_chunker.py --input_docs_dir {input_docs_dir} --output_chunks_dir {output_chunks_dir}")
+    c.run(f"python vectorization_pipeline/wikipedia_chunker.py --input_docs_dir {input_docs_dir} --output_chunks_dir {output_chunks_dir} --workers {workers} --output_format {output_format}")
     print("Document chunking completed.")
 
 @task
-def upload_to_qdrant(c, chunks_dir="data/chunks_pipe", collection_name="olympics_pipe"):
+def upload_to_qdrant(c, chunks_dir="data/chunks_pipe", collection_name="olympics_pipe", profile="default"):
     """
     Task to upload chunks to Qdrant.
 
@@ -67,12 +83,13 @@ def upload_to_qdrant(c, chunks_dir="data/chunks_pipe", collection_name="olympics
         c (Context): The Invoke context.
         chunks_dir (str): Directory containing document chunks.
         collection_name (str): The name of the collection in the Qdrant database.
+        profile (str): Collection profile used when the collection is created.
 
     Example:
-        invoke upload-to-qdrant --chunks-dir=custom_chunks_dir --collection-name=custom_collection
+        invoke upload-to-qdrant --chunks-dir=custom_chunks_dir --collection-name=custom_collection --profile=scalar
     """
     print("Starting Qdrant upload...")
-    c.run(f"python vectorization_pipeline/qdrant_loader.py --chunks_dir {chunks_dir} --collection_name {collection_name}")
+    c.run(f"python vectorization_pipeline/qdrant_loader.py --chunks_dir {chunks_dir} --collection_name {collection_name} --profile {profile}")
     print("Qdrant upload completed.")
 
 @task(pre=[acquire_documents, chunk_documents, upload_to_qdrant])
@@ -87,3 +104,79 @@ def full_vectorization_pipeline(c):
         invoke full_vectorization_pipeline
     """
     print("Pipeline executed successfully!")
+
+
+@task
+def streaming_vectorization_pipeline(c, input_urls="wikipedia_urls.txt", collection_name="olympics_pipe", workers=8, checkpoint_docs_dir=None, checkpoint_chunks_dir=None):
+    """
+    Task to run acquisition, chunking and upload as a single streaming pipeline.
+
+    Args:
+        c (Context): The Invoke context.
+        input_urls (str): Path to the file containing URLs to download.
+        collection_name (str): The name of the collection in the Qdrant database.
+        workers (int): Number of pages fetched in parallel.
+        checkpoint_docs_dir (str): Optional directory where the documents are also saved.
+        checkpoint_chunks_dir (str): Optional directory where the chunks are also saved.
+
+    Example:
+        invoke streaming-vectorization-pipeline --input-urls=custom_urls.txt --collection-name=custom_collection --workers=16
+    """
+    command = f"python vectorization_pipeline/streaming_pipeline.py --input_urls_file {input_urls} --collection_name {collection_name} --workers {workers}"
+    if checkpoint_docs_dir:
+        command += f" --checkpoint_docs_dir {checkpoint_docs_dir}"
+    if checkpoint_chunks_dir:
+        command += f" --checkpoint_chunks_dir {checkpoint_chunks_dir}"
+
+    print("Starting streaming pipeline...")
+    c.run(command)
+    print("Streaming pipeline completed.")
+
+
+@task
+def refresh_vectorization_pipeline(c, input_urls="wikipedia_urls.txt", manifest_path="data/manifest_pipe.sqlite", output_docs_dir="data/refresh_document_pipe", output_chunks_dir="data/refresh_chunks_pipe", collection_name="olympics_pipe", workers=8):
+    """
+    Task to refresh the corpus: only the pages changed since the last refresh are
+    acquired, chunked and uploaded, after deleting their stale chunks from Qdrant.
+    The new revisions are committed to the manifest only if the upload succeeds.
+
+    Args:
+        c (Context): The Invoke context.
+        input_urls (str): Path to the file containing URLs to download.
+        manifest_path (str): Path of the SQLite manifest of the pages.
+        output_docs_dir (str): Directory where the changed documents will be saved.
+        output_chunks_dir (str): Directory of the chunk store of the changed documents.
+        collection_name (str): The name of the collection in the Qdrant database.
+        workers (int): Number of requests sent in parallel.
+
+    Example:
+        invoke refresh-vectorization-pipeline --input-urls=custom_urls.txt --collection-name=custom_collection
+    """
+    print("Starting corpus refresh...")
+    c.run(f"python vectorization_pipeline/refresh.py --input_urls_file {input_urls} --manifest_path {manifest_path} --output_docs_dir {output_docs_dir} --collection_name {collection_name} --workers {workers}")
+    chunk_documents(c, input_docs_dir=output_docs_dir, output_chunks_dir=output_chunks_dir, output_format="store")
+    upload_to_qdrant(c, chunks_dir=output_chunks_dir, collection_name=collection_name)
+    c.run(f"python vectorization_pipeline/refresh.py --commit --manifest_path {manifest_path} --chunks_dir {output_chunks_dir}")
+    print("Corpus refresh completed.")
+
+@task
+def dump_vectorization_pipeline(c, dump_file, input_urls="wikipedia_urls.txt", output_chunks_dir="data/dump_chunks_pipe", collection_name="olympics_pipe", workers=4):
+    """
+    Task to build the corpus from a local Wikipedia dump instead of the API: the pages
+    of the URL list are read from the dump, chunked and uploaded.
+
+    Args:
+        c (Context): The Invoke context.
+        dump_file (str): Path of the `pages-articles` XML or CirrusSearch JSON dump.
+        input_urls (str): Path to the file containing the URLs of the pages to keep.
+        output_chunks_dir (str): Directory of the chunk store.
+        collection_name (str): The name of the collection in the Qdrant database.
+        workers (int): Number of worker processes converting and cleaning the pages.
+
+    Example:
+        invoke dump-vectorization-pipeline --dump-file=data/itwiki-latest-pages-articles.xml.bz2 --collection-name=custom_collection
+    """
+    print("Starting dump ingestion...")
+    c.run(f"python vectorization_pipeline/dump_ingestion.py --dump_file {dump_file} --input_urls_file {input_urls} --output_chunks_dir {output_chunks_dir} --output_format store --workers {workers}")
+    upload_to_qdrant(c, chunks_dir=output_chunks_dir, collection_name=collection_name)
+    print("Dump ingestion completed.")
@@ -19,17 +19,334 @@ Arguments:
     --chunk_size: Size of each chunk in characters.
     --chunk_overlap: Overlap between chunks in characters.
     --embedding_model: Name of the SentenceTransformer model to use for generating embeddings.
+    --onnx_model_path: Path of the ONNX model, possibly int8 quantized, exported from the embedding model (see wiki_rag/embeddings.py).
+    --batch_size: Number of chunks, possibly from different documents, embedded together.
+    --num_threads: Number of threads used by torch, or ONNX Runtime, to compute the embeddings.
+    --workers: Number of worker processes, each one with its own embedding model, chunking a shard of the documents.
+    --cache_path: Path of a SQLite embedding cache, so that re-runs only embed the new or changed chunks.
+    --output_format: 'json' for one JSON file per chunk, 'store' for a columnar chunk store (see chunk_store.py).
 """
 
 import os
 import json
-import uuid
+import shutil
 import argparse
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import sys
+import multiprocessing
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Dict, Optional, Tuple
 
-def process_documents(input_docs_dir: str, chunk_size: int, chunk_overlap: int, embedding_model_name: str) -> List[Dict]:
+import numpy as np
+
+from progress import ThroughputReporter
+from embedding_cache import EmbeddingCache, content_hash, point_id
+from chunk_store import ChunkStoreWriter, VECTORS_FILE, PAYLOADS_FILE, merge_chunk_stores
+
+# The embedding service is shared with WikiRag, so that the chunks and the queries are embedded the same way
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from wiki_rag.embeddings import EmbeddingService
+
+# langchain is imported by the chunking, not by the CLI startup and the modules importing the helpers
+if TYPE_CHECKING:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+def list_document_files(input_docs_dir: str) -> List[str]:
+    """
+    List the JSON files of processed Wikipedia pages in a directory.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+
+    Returns:
+        List[str]: The names of the JSON files.
+    """
+    return sorted(filename for filename in os.listdir(input_docs_dir) if filename.endswith('.json'))
+
+def shard_document_files(input_docs_dir: str, num_shards: int) -> List[List[str]]:
+    """
+    Split the JSON files of a directory into shards of similar total size, assigning
+    the largest files first to the shard with the smallest load.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+        num_shards (int): Number of shards.
+
+    Returns:
+        List[List[str]]: The names of the JSON files of each shard.
+    """
+    sizes = {
+        filename: os.path.getsize(os.path.join(input_docs_dir, filename))
+        for filename in list_document_files(input_docs_dir)
+    }
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    for filename in sorted(sizes, key=sizes.get, reverse=True):
+        shard = loads.index(min(loads))
+        shards[shard].append(filename)
+        loads[shard] += sizes[filename]
+    return shards
+
+def load_documents(input_docs_dir: str, filenames: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Lazily load the processed Wikipedia pages stored as JSON files in a directory.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+        filenames (Optional[List[str]]): Names of the files to load, all the JSON files of the directory if None.
+
+    Returns:
+        Iterator[Dict]: The documents, one at a time.
+    """
+    if filenames is None:
+        filenames = list_document_files(input_docs_dir)
+
+    for filename in filenames:
+        filepath = os.path.join(input_docs_dir, filename)
+
+        try:
+            with open(filepath, 'r', encoding='utf-8') as json_file:
+                doc = json.load(json_file)
+        except json.JSONDecodeError:
+            print(f"Error: Failed to decode JSON file {filename}. Skipping file.")
+            continue
+        except Exception as e:
+            print(f"Error: An unexpected error occurred with file {filename}: {e}")
+            continue
+
+        yield doc
+
+def split_document(doc: Dict, text_splitter: "RecursiveCharacterTextSplitter") -> Tuple[List[str], Dict]:
+    """
+    Split the content of a document into chunk texts.
+
+    Args:
+        doc (Dict): The processed Wikipedia page.
+        text_splitter (RecursiveCharacterTextSplitter): The splitter used to create the chunks.
+
+    Returns:
+        Tuple[List[str], Dict]: The texts of the chunks and the metadata shared by all of them.
+    """
+    # Extract the necessary information
+    metadata = {
+        "language": doc.get('language', 'Unknown'),
+        "title": doc.get('title', 'Unknown Title'),
+        "url": doc.get('url', 'Unknown URL'),
+    }
+    content = doc.get('content', '')
+
+    if not content:
+        print(f"Warning: No content found in '{metadata['title']}'. Skipping document.")
+        return [], metadata
+
+    # Split the content into chunks
+    return text_splitter.split_text(content), metadata
+
+def make_chunk(text: str, vector: np.ndarray, metadata: Dict, text_hash: str) -> Dict:
+    """
+    Create a chunk following the schema of `process_documents`.
+
+    Args:
+        text (str): The textual content of the chunk.
+        vector (np.ndarray): The embedding of the chunk.
+        metadata (Dict): The language, title and url of the page the chunk comes from.
+        text_hash (str): The hash of the embedding model name and of the text.
+
+    Returns:
+        Dict: The chunk.
+    """
+    return {
+        "id": point_id(metadata['url'], text_hash),  # Deterministic identifier
+        "vector": vector.tolist(),  # Convert NumPy array to list
+        "payload": {
+            "content": text,
+            **metadata,
+        }
+    }
+
+class EmbeddingBatcher:
+    """
+    A class used to embed the chunks of many documents in fixed-size batches.
+
+    Chunks are collected across documents until `batch_size * sort_window` texts are
+    pending, then they are sorted by length, so that texts of similar length share a
+    batch and padding is minimised, and encoded `batch_size` texts at a time.
+    If an embedding cache is given, only the texts missing from the cache are encoded.
+    """
+
+    def __init__(
+            self,
+            embedding_model: EmbeddingService,
+            model_name: str,
+            batch_size: int = 64,
+            sort_window: int = 8,
+            cache: Optional[EmbeddingCache] = None):
+        """
+        Constructor of the class
+
+        Args:
+        embedding_model (EmbeddingService): the service used to create the embeddings
+        model_name (str): the name of the embeddings, part of the hash of every chunk
+        batch_size (int): the number of texts encoded together
+        sort_window (int): the number of batches collected before sorting the texts by length
+        cache (Optional[EmbeddingCache]): the cache of previously computed embeddings
+        """
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.window_size = batch_size * max(sort_window, 1)
+        self.cache = cache
+        self.reporter = ThroughputReporter("embedding", unit="chunks")
+
+        self._pending: List[Tuple[str, Dict]] = []
+
+    def add(self, texts: List[str], metadata: Dict) -> List[Dict]:
+        """
+        Method to add the chunk texts of a document
+
+        Args:
+        texts (List[str]): the texts of the chunks
+        metadata (Dict): the metadata shared by the chunks
+
+        Returns:
+            List[Dict]: the chunks embedded so far, possibly belonging to previous documents.
+        """
+        self._pending.extend((text, metadata) for text in texts)
+        if len(self._pending) < self.window_size:
+            return []
+        return self.flush()
+
+    def flush(self) -> List[Dict]:
+        """
+        Method to embed all the pending chunk texts
+
+        Returns:
+            List[Dict]: the embedded chunks.
+        """
+        pending = self._pending
+        self._pending = []
+
+        hashes = [content_hash(self.model_name, text) for text, _ in pending]
+        vectors = self.cache.get_many(hashes) if self.cache is not None else {}
+
+        # Encode each missing text once, shortest first
+        missing = {text_hash: text for (text, _), text_hash in zip(pending, hashes) if text_hash not in vectors}
+        missing = sorted(missing.items(), key=lambda item: len(item[1]))
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embeddings = self.embedding_model.encode([text for _, text in batch], batch_size=self.batch_size)
+            computed = {text_hash: vector for (text_hash, _), vector in zip(batch, embeddings)}
+            if self.cache is not None:
+                self.cache.put_many(computed)
+            vectors.update(computed)
+
+        self.reporter.update(len(pending))
+        return [
+            make_chunk(text, vectors[text_hash], metadata, text_hash)
+            for (text, metadata), text_hash in zip(pending, hashes)
+        ]
+
+def iter_document_chunks(
+        documents: Iterable[Dict],
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        cache_path: Optional[str] = None,
+        onnx_model_path: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Lazily process documents from any source, e.g. a dump (see dump_ingestion.py), embedding
+    the chunks of consecutive documents together in fixed-size batches so that the whole
+    corpus never has to be held in memory.
+
+    Args:
+        documents (Iterable[Dict]): The processed Wikipedia pages, with 'title', 'url', 'language' and 'content' keys.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+
+    Returns:
+        Iterator[Dict]: The chunks, following the schema of `process_documents`.
+    """
+    # Initialize the text splitter
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    # Initialize the embedding model
+    embedding_model = EmbeddingService(
+        embedding_model_name,
+        backend="onnx" if onnx_model_path else "torch",
+        onnx_model_path=onnx_model_path,
+        batch_size=batch_size,
+        num_threads=num_threads,
+    )
+    cache = EmbeddingCache(cache_path) if cache_path else None
+    batcher = EmbeddingBatcher(embedding_model, embedding_model.name, batch_size=batch_size, cache=cache)
+
+    try:
+        for doc in documents:
+            try:
+                texts, metadata = split_document(doc, text_splitter)
+                yield from batcher.add(texts, metadata)
+            except Exception as e:
+                print(f"Error: An unexpected error occurred with document '{doc.get('title')}': {e}")
+
+        yield from batcher.flush()
+        batcher.reporter.report()
+    finally:
+        if cache is not None:
+            cache.close()
+
+def iter_chunks(
+        input_docs_dir: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        filenames: Optional[List[str]] = None,
+        cache_path: Optional[str] = None,
+        onnx_model_path: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Lazily process the documents of a directory, see `iter_document_chunks`.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        filenames (Optional[List[str]]): Names of the files to process, all the JSON files of the directory if None.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+
+    Returns:
+        Iterator[Dict]: The chunks, following the schema of `process_documents`.
+    """
+    return iter_document_chunks(
+        load_documents(input_docs_dir, filenames),
+        chunk_size,
+        chunk_overlap,
+        embedding_model_name,
+        batch_size,
+        num_threads,
+        cache_path,
+        onnx_model_path,
+    )
+
+def process_documents(
+        input_docs_dir: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        cache_path: Optional[str] = None,
+        onnx_model_path: Optional[str] = None) -> List[Dict]:
     """
     Process documents by splitting them into chunks and creating embeddings.
 
@@ -38,6 +355,10 @@ def process_documents(input_docs_dir: str, chunk_size: int, chunk_overlap: int,
         chunk_size (int): Size of each chunk in characters.
         chunk_overlap (int): Overlap between chunks in characters.
         embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
 
     Returns:
         List[Dict]: A list of dictionaries, each representing a chunk with its embedding.
@@ -45,7 +366,7 @@ def process_documents(input_docs_dir: str, chunk_size: int, chunk_overlap: int,
     Expected chunk schema:
     {
 
-    "id": uuid.uuid() #vector in vector db
+    "id": str # deterministic uuid of the vector in vector db, derived from the url and the content hash
     "vector": List[float] # The embedding of the chunk
     "payload": {
 
@@ -56,59 +377,7 @@ def process_documents(input_docs_dir: str, chunk_size: int, chunk_overlap: int,
         }
     }
     """
-    # Initialize the text splitter
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    
-    # Initialize the embedding model
-    embedding_model = SentenceTransformer(embedding_model_name)
-    
-    # List to hold all the chunks
-    all_chunks = []
-    
-    # Iterate over all JSON files in the directory
-    for filename in os.listdir(input_docs_dir):
-        if filename.endswith('.json'):
-            filepath = os.path.join(input_docs_dir, filename)
-            
-            try:
-                with open(filepath, 'r', encoding='utf-8') as json_file:
-                    doc = json.load(json_file)
-                    
-                    # Extract the necessary information
-                    title = doc.get('title', 'Unknown Title')
-                    content = doc.get('content', '')
-                    language = doc.get('language', 'Unknown')
-                    url = doc.get('url', 'Unknown URL')
-                    
-                    if not content:
-                        print(f"Warning: No content found in {filename}. Skipping file.")
-                        continue
-                    
-                    # Split the content into chunks
-                    texts = text_splitter.split_text(content)
-                    
-                    # Create embeddings for each chunk
-                    embeddings = embedding_model.encode(texts)
-                    
-                    # Create a chunk for each piece of text
-                    for _, (text, vector) in enumerate(zip(texts, embeddings)):
-                        chunk = {
-                            "id": str(uuid.uuid4()),  # Unique identifier
-                            "vector": vector.tolist(),  # Convert NumPy array to list
-                            "payload": {
-                                "content": text,
-                                "language": language,
-                                "title": title,
-                                "url": url,
-                            }
-                        }
-                        all_chunks.append(chunk)
-            except json.JSONDecodeError:
-                print(f"Error: Failed to decode JSON file {filename}. Skipping file.")
-            except Exception as e:
-                print(f"Error: An unexpected error occurred with file {filename}: {e}")
-    
-    return all_chunks
+    return list(iter_chunks(input_docs_dir, chunk_size, chunk_overlap, embedding_model_name, batch_size, num_threads, cache_path=cache_path, onnx_model_path=onnx_model_path))
 
 def save_chunk_to_json(chunk: Dict, output_chunks_dir: str) -> None:
     """
@@ -134,7 +403,143 @@ def save_chunk_to_json(chunk: Dict, output_chunks_dir: str) -> None:
     except Exception as e:
         print(f"Error: Failed to save chunk {chunk['id']} to {filepath}: {e}")
 
-def main(input_docs_dir: str, output_chunks_dir: str, chunk_size: int, chunk_overlap: int, embedding_model_name: str) -> None:
+def save_chunks(chunks: Iterator[Dict], output_chunks_dir: str, output_format: str = "json", store_batch_size: int = 1024) -> int:
+    """
+    Save chunks as soon as they are created, either as individual JSON files or appended to a chunk store.
+
+    Args:
+        chunks (Iterator[Dict]): The chunks to save.
+        output_chunks_dir (str): Directory where the chunks will be saved.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a chunk store.
+        store_batch_size (int): Number of chunks appended together to the chunk store.
+
+    Returns:
+        int: The number of chunks saved.
+    """
+    num_chunks = 0
+    if output_format == "json":
+        for chunk in chunks:
+            save_chunk_to_json(chunk, output_chunks_dir)
+            num_chunks += 1
+        return num_chunks
+
+    with ChunkStoreWriter(output_chunks_dir, overwrite=True) as writer:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == store_batch_size:
+                writer.append(batch)
+                batch = []
+        writer.append(batch)
+        num_chunks = writer.count
+    print(f"Saved {num_chunks} chunks in the chunk store '{output_chunks_dir}'.")
+    return num_chunks
+
+def chunk_shard(
+        input_docs_dir: str,
+        filenames: List[str],
+        output_chunks_dir: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int,
+        num_threads: Optional[int],
+        cache_path: Optional[str] = None,
+        output_format: str = "json",
+        onnx_model_path: Optional[str] = None) -> int:
+    """
+    Chunk a shard of the documents and save its chunks. Runs in a worker process,
+    which loads its own embedding model.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+        filenames (List[str]): Names of the files of the shard.
+        output_chunks_dir (str): Directory where the chunked JSON files will be saved.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads of the worker.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a chunk store.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+
+    Returns:
+        int: The number of chunks saved.
+    """
+    chunks = iter_chunks(input_docs_dir, chunk_size, chunk_overlap, embedding_model_name, batch_size, num_threads, filenames, cache_path, onnx_model_path)
+    return save_chunks(chunks, output_chunks_dir, output_format)
+
+def chunk_documents_in_parallel(
+        input_docs_dir: str,
+        output_chunks_dir: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int,
+        num_threads: Optional[int],
+        workers: int,
+        cache_path: Optional[str] = None,
+        output_format: str = "json",
+        onnx_model_path: Optional[str] = None) -> None:
+    """
+    Shard the documents across worker processes, each one with its own embedding model
+    and a pinned number of torch threads, writing all the chunks to the same output.
+
+    Args:
+        input_docs_dir (str): Directory containing JSON files of processed Wikipedia pages.
+        output_chunks_dir (str): Directory where the chunked JSON files will be saved.
+        chunk_size (int): Size of each chunk in characters.
+        chunk_overlap (int): Overlap between chunks in characters.
+        embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads of each worker, None splits the CPU cores evenly.
+        workers (int): Number of worker processes.
+        cache_path (Optional[str]): Path of the SQLite embedding cache shared by the workers, None disables the cache.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a chunk store.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+    """
+    shards = [shard for shard in shard_document_files(input_docs_dir, workers) if shard]
+    threads_per_worker = num_threads or max(1, (os.cpu_count() or 1) // workers)
+    print(f"Chunking {sum(len(shard) for shard in shards)} documents with {len(shards)} workers, {threads_per_worker} threads each.")
+
+    # Chunk stores are written one per worker and merged at the end
+    if output_format == "json":
+        shard_outputs = [output_chunks_dir] * len(shards)
+    else:
+        shard_outputs = [os.path.join(output_chunks_dir, f".shard_{index}") for index in range(len(shards))]
+
+    # Spawn fresh interpreters so that no torch thread pool is inherited by the workers
+    with multiprocessing.get_context("spawn").Pool(processes=len(shards)) as pool:
+        num_chunks = pool.starmap(
+            chunk_shard,
+            [
+                (input_docs_dir, shard, shard_output, chunk_size, chunk_overlap, embedding_model_name, batch_size, threads_per_worker, cache_path, output_format, onnx_model_path)
+                for shard, shard_output in zip(shards, shard_outputs)
+            ]
+        )
+
+    if output_format == "store":
+        for name in (VECTORS_FILE, PAYLOADS_FILE):
+            if os.path.exists(os.path.join(output_chunks_dir, name)):
+                os.remove(os.path.join(output_chunks_dir, name))
+        merge_chunk_stores(shard_outputs, output_chunks_dir)
+        for shard_output in shard_outputs:
+            shutil.rmtree(shard_output, ignore_errors=True)
+    print(f"Saved {sum(num_chunks)} chunks in '{output_chunks_dir}'.")
+
+def main(
+        input_docs_dir: str,
+        output_chunks_dir: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        embedding_model_name: str,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        workers: int = 1,
+        cache_path: Optional[str] = None,
+        output_format: str = "json",
+        onnx_model_path: Optional[str] = None) -> bool:
     """
     Main function to process and chunk Wikipedia pages.
 
@@ -144,16 +549,28 @@ def main(input_docs_dir: str, output_chunks_dir: str, chunk_size: int, chunk_ove
         chunk_size (int): Size of each chunk in characters.
         chunk_overlap (int): Overlap between chunks in characters.
         embedding_model_name (str): Name of the SentenceTransformer model to use for generating embeddings.
+        batch_size (int): Number of chunks embedded together.
+        num_threads (Optional[int]): Number of torch threads, None keeps the torch default.
+        workers (int): Number of worker processes, each one processing a shard of the documents.
+        cache_path (Optional[str]): Path of the SQLite embedding cache, None disables the cache.
+        output_format (str): 'json' for one JSON file per chunk, 'store' for a chunk store.
+        onnx_model_path (Optional[str]): Path of the ONNX model exported from the embedding model, None uses torch.
+
+    Returns:
+        bool: True if the chunking completed, False if it failed.
     """
     try:
-        # Process documents to create chunks
-        chunks = process_documents(input_docs_dir, chunk_size, chunk_overlap, embedding_model_name)
-        
-        # Save each chunk as a JSON file
-        for chunk in chunks:
-            save_chunk_to_json(chunk, output_chunks_dir)
+        if workers > 1:
+            chunk_documents_in_parallel(input_docs_dir, output_chunks_dir, chunk_size, chunk_overlap, embedding_model_name, batch_size, num_threads, workers, cache_path, output_format, onnx_model_path)
+            return True
+
+        # Process documents to create chunks, saving each chunk as soon as it is created
+        chunks = iter_chunks(input_docs_dir, chunk_size, chunk_overlap, embedding_model_name, batch_size, num_threads, cache_path=cache_path, onnx_model_path=onnx_model_path)
+        save_chunks(chunks, output_chunks_dir, output_format)
+        return True
     except Exception as e:
         print(f"Error: An unexpected error occurred during the chunking process: {e}")
+        return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Wikipedia Chunker")
@@ -162,7 +579,15 @@ if __name__ == "__main__":
     parser.add_argument("--chunk_size", type=int, default=450, help="Size of each chunk in characters (default is 1000).")
     parser.add_argument("--chunk_overlap", type=int, default=20, help="Overlap between chunks in characters (default is 20).")
     parser.add_argument("--embedding_model", type=str, default="all-MiniLM-L6-v2", help="Name of the SentenceTransformer model to use (default is 'all-MiniLM-L6-v2').")
+    parser.add_argument("--onnx_model_path", type=str, default=None, help="Path of the ONNX model, possibly int8 quantized, exported from the embedding model (default is the torch model).")
+    parser.add_argument("--batch_size", type=int, default=64, help="Number of chunks embedded together (default is 64).")
+    parser.add_argument("--num_threads", type=int, default=None, help="Number of threads used by torch in each process (default is the torch default, or the CPU cores split across workers).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each one chunking a shard of the documents (default is 1).")
+    parser.add_argument("--cache_path", type=str, default=None, help="Path of the SQLite embedding cache, re-runs only embed new or changed chunks (default is no cache).")
+    parser.add_argument("--output_format", type=str, default="json", choices=["json", "store"], help="'json' for one JSON file per chunk, 'store' for a columnar chunk store (default is 'json').")
 
     args = parser.parse_args()
 
-    main(args.input_docs_dir, args.output_chunks_dir, args.chunk_size, args.chunk_overlap, args.embedding_model)
+    # A non-zero exit status stops the tasks chaining the chunking, e.g. before committing a refresh
+    if not main(args.input_docs_dir, args.output_chunks_dir, args.chunk_size, args.chunk_overlap, args.embedding_model, args.batch_size, args.num_threads, args.workers, args.cache_path, args.output_format, args.onnx_model_path):
+        sys.exit(1)
@@ -0,0 +1,348 @@
+"""
+Wikipedia Fetcher
+
+This module contains a concurrent client for the MediaWiki API used by the
+document acquisition scripts. Compared to building a new `wikipediaapi.Wikipedia`
+object for every title, it:
+
+- keeps one pooled HTTP session per language, so connections are reused;
+- spaces out the requests sent to each host with a rate limiter;
+- retries throttled (429) and failed (5xx, connection errors) requests with exponential backoff;
+- fetches many titles in parallel with a pool of worker threads and reports the throughput;
+- checks the latest revision of many titles with a single request, for the incremental refresh.
+
+The API endpoint is a template (`--api_url`), so the fetcher can be pointed to a
+local stub HTTP server, e.g. `http://127.0.0.1:8000/w/api.php`.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from progress import ThroughputReporter
+
+USER_AGENT = 'WikiRag (mauo.andretta222@gmail.com)'
+DEFAULT_API_URL = "https://{language}.wikipedia.org/w/api.php"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Maximum number of titles of a single MediaWiki API query
+MAX_TITLES_PER_REQUEST = 50
+
+
+def get_revision(page: Dict) -> Dict:
+    """
+    Get the latest revision of a page returned by the MediaWiki API.
+
+    Args:
+        page (Dict): The page, queried with the 'info' and 'revisions' properties.
+
+    Returns:
+        Dict: The 'revision_id' and its 'timestamp', None if unknown.
+    """
+    revisions = page.get('revisions') or [{}]
+    return {
+        'revision_id': revisions[0].get('revid', page.get('lastrevid')),
+        'timestamp': revisions[0].get('timestamp', page.get('touched')),
+    }
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out the requests sent to a single host.
+    """
+
+    def __init__(self, requests_per_second: float):
+        """
+        Constructor of the class
+
+        Args:
+        requests_per_second (float): maximum number of requests per second, 0 disables the limit
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """
+        Block until the caller is allowed to send the next request
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class WikipediaFetcher:
+    """
+    A class used to fetch Wikipedia pages concurrently through the MediaWiki API.
+    """
+
+    def __init__(
+            self,
+            workers: int = 8,
+            api_url: str = DEFAULT_API_URL,
+            requests_per_second: float = 20.0,
+            max_retries: int = 5,
+            backoff_factor: float = 0.5,
+            timeout: float = 30.0):
+        """
+        Constructor of the class
+
+        Args:
+        workers (int): number of threads fetching pages in parallel
+        api_url (str): URL of the MediaWiki API, '{language}' is replaced with the page language
+        requests_per_second (float): maximum number of requests per second sent to each host
+        max_retries (int): maximum number of retries for a failed request
+        backoff_factor (float): base delay in seconds of the exponential backoff between retries
+        timeout (float): timeout in seconds of each HTTP request
+        """
+        self.workers = workers
+        self.api_url = api_url
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        self._sessions: Dict[str, requests.Session] = {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get_api_url(self, language: str) -> str:
+        """
+        Method to get the API endpoint of a given language
+
+        Args:
+        language (str): the language of the Wikipedia pages
+        """
+        return self.api_url.format(language=language)
+
+    def get_session(self, language: str) -> requests.Session:
+        """
+        Method to get the shared HTTP session of a language, creating it on first use.
+        The connection pool is sized on the number of workers so that every thread
+        can keep its own connection alive.
+
+        Args:
+        language (str): the language of the Wikipedia pages
+        """
+        with self._lock:
+            session = self._sessions.get(language)
+            if session is None:
+                session = requests.Session()
+                session.headers.update({'User-Agent': USER_AGENT})
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.workers, 1))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[language] = session
+            return session
+
+    def get_rate_limiter(self, url: str) -> RateLimiter:
+        """
+        Method to get the rate limiter of the host serving a URL
+
+        Args:
+        url (str): the URL of the request
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._rate_limiters:
+                self._rate_limiters[host] = RateLimiter(self.requests_per_second)
+            return self._rate_limiters[host]
+
+    def request(self, language: str, params: Dict) -> Dict:
+        """
+        Method to send a GET request to the MediaWiki API, retrying throttled and failed
+        requests with exponential backoff.
+
+        Args:
+        language (str): the language of the Wikipedia pages
+        params (Dict): the query parameters of the request
+
+        Returns:
+            Dict: the decoded JSON response.
+        """
+        url = self.get_api_url(language)
+        session = self.get_session(language)
+        rate_limiter = self.get_rate_limiter(url)
+
+        for attempt in range(self.max_retries + 1):
+            rate_limiter.wait()
+            delay = self.backoff_factor * (2 ** attempt)
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(delay)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                retry_after = response.headers.get('Retry-After', '')
+                time.sleep(float(retry_after) if retry_after.isdigit() else delay)
+                continue
+
+            response.raise_for_status()
+            return response.json()
+
+    def fetch_page(self, title: str, language: str) -> Optional[Dict]:
+        """
+        Method to fetch the plain text of a single Wikipedia page
+
+        Args:
+        title (str): the title of the Wikipedia page
+        language (str): the language of the Wikipedia page
+
+        Returns:
+            Optional[Dict]: a dictionary with 'title', 'url', 'language' and 'text' keys,
+            None if the page does not exist.
+        """
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': 2,
+            'prop': 'extracts|info|revisions',
+            'explaintext': 1,
+            'exsectionformat': 'wiki',
+            'inprop': 'url',
+            'rvprop': 'ids|timestamp',
+            'redirects': 1,
+            'titles': title,
+        }
+        data = self.request(language, params)
+        pages = data.get('query', {}).get('pages', [])
+        if not pages or pages[0].get('missing') or pages[0].get('invalid'):
+            return None
+
+        page = pages[0]
+        return {
+            'title': page['title'],
+            'url': page.get('fullurl', ''),
+            'language': language,
+            'text': page.get('extract', ''),
+            **get_revision(page),
+        }
+
+    def fetch_revision_batch(self, titles: List[str], language: str) -> Dict[str, Optional[Dict]]:
+        """
+        Method to get the latest revision of up to MAX_TITLES_PER_REQUEST pages with a single request
+
+        Args:
+        titles (List[str]): the titles of the Wikipedia pages
+        language (str): the language of the Wikipedia pages
+
+        Returns:
+            Dict[str, Optional[Dict]]: by requested title, a dictionary with 'title', 'url', 'revision_id'
+            and 'timestamp' keys, None if the page does not exist.
+        """
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': 2,
+            'prop': 'info|revisions',
+            'inprop': 'url',
+            'rvprop': 'ids|timestamp',
+            'redirects': 1,
+            'titles': '|'.join(titles),
+        }
+        data = self.request(language, params).get('query', {})
+
+        # The API answers with the normalized and redirected titles
+        renamed = {item['from']: item['to'] for key in ('normalized', 'redirects') for item in data.get(key, [])}
+        pages = {page['title']: page for page in data.get('pages', [])}
+
+        revisions = {}
+        for title in titles:
+            resolved = renamed.get(title, title)
+            resolved = renamed.get(resolved, resolved)
+            page = pages.get(resolved)
+            if page is None or page.get('missing') or page.get('invalid'):
+                revisions[title] = None
+            else:
+                revisions[title] = {'title': page['title'], 'url': page.get('fullurl', ''), **get_revision(page)}
+        return revisions
+
+    def fetch_revisions(self, titles: Iterable[str], language: str) -> Dict[str, Optional[Dict]]:
+        """
+        Method to get the latest revision of many pages, MAX_TITLES_PER_REQUEST titles per request,
+        with the requests sent in parallel
+
+        Args:
+        titles (Iterable[str]): the titles of the Wikipedia pages
+        language (str): the language of the Wikipedia pages
+
+        Returns:
+            Dict[str, Optional[Dict]]: by requested title, the revision returned by `fetch_revision_batch`.
+        """
+        titles = list(dict.fromkeys(titles))
+        batches = [titles[start:start + MAX_TITLES_PER_REQUEST] for start in range(0, len(titles), MAX_TITLES_PER_REQUEST)]
+        reporter = ThroughputReporter("revision check", unit="pages", total=len(titles))
+
+        revisions = {}
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            for batch_revisions in executor.map(lambda batch: self.fetch_revision_batch(batch, language), batches):
+                revisions.update(batch_revisions)
+                reporter.update(len(batch_revisions))
+        reporter.report()
+        return revisions
+
+    def fetch_pages(self, titles: Iterable[str], language: str) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """
+        Method to fetch many Wikipedia pages in parallel. Pages are yielded as soon as
+        they are downloaded, so their order is not preserved.
+
+        Args:
+        titles (Iterable[str]): the titles of the Wikipedia pages
+        language (str): the language of the Wikipedia pages
+
+        Returns:
+            Iterator[Tuple[str, Optional[Dict]]]: the requested title and the fetched page,
+            None if the page does not exist or could not be downloaded.
+        """
+        titles: List[str] = list(titles)
+        reporter = ThroughputReporter("acquisition", unit="pages", total=len(titles))
+        pending_titles = iter(titles)
+        # Bound the number of in-flight requests so that downloaded pages do not pile up in memory
+        max_in_flight = max(self.workers, 1) * 2
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for title in islice(pending_titles, max_in_flight):
+                futures[executor.submit(self.fetch_page, title, language)] = title
+
+            while futures:
+                completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    title = futures.pop(future)
+                    try:
+                        page = future.result()
+                    except Exception as e:
+                        print(f"Error: Failed to fetch page '{title}': {e}")
+                        page = None
+                    reporter.update(done=int(page is not None), failed=int(page is None))
+
+                    next_title = next(pending_titles, None)
+                    if next_title is not None:
+                        futures[executor.submit(self.fetch_page, next_title, language)] = next_title
+
+                    yield title, page
+
+        reporter.report()
+
+    def close(self) -> None:
+        """
+        Method to close all the HTTP sessions
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -1 +1,46 @@
-from wiki_rag.wiki_rag import WikiRag
\ No newline at end of file
+"""
+The classes of the package are imported on first access, so that importing wiki_rag
+doesn't load langchain, the Qdrant client or the embedding models.
+"""
+from typing import TYPE_CHECKING
+
+from wiki_rag.startup import STARTUP, lazy_import
+
+# Module of each public class
+_EXPORTS = {
+    "WikiRag": "wiki_rag.wiki_rag",
+    "AnswerCache": "wiki_rag.answer_cache",
+    "CrossEncoderReranker": "wiki_rag.reranker",
+    "VectorStoreBackend": "wiki_rag.vector_stores",
+    "QdrantBackend": "wiki_rag.vector_stores",
+    "NumpyBackend": "wiki_rag.vector_stores",
+    "EmbeddingService": "wiki_rag.embeddings",
+    "Trace": "wiki_rag.tracing",
+    "MetricsExporter": "wiki_rag.tracing",
+    "PrometheusExporter": "wiki_rag.tracing",
+    "JsonLinesExporter": "wiki_rag.tracing",
+}
+
+__all__ = [*_EXPORTS, "STARTUP"]
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'wiki_rag' has no attribute '{name}'")
+    value = getattr(lazy_import(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from wiki_rag.wiki_rag import WikiRag
+    from wiki_rag.answer_cache import AnswerCache
+    from wiki_rag.reranker import CrossEncoderReranker
+    from wiki_rag.vector_stores import VectorStoreBackend, QdrantBackend, NumpyBackend
+    from wiki_rag.embeddings import EmbeddingService
+    from wiki_rag.tracing import Trace, MetricsExporter, PrometheusExporter, JsonLinesExporter
@@ -0,0 +1,285 @@
+"""
+Contains the answer cache of WikiRag.
+
+Answers are looked up first by the normalized text of the question and then by the
+similarity of its embedding with the questions already answered, so that repeated and
+near-duplicate questions skip the retrieval, the web search and the generation.
+
+The cache keeps a small vector index in memory, with TTL and LRU eviction, and can be
+backed by a SQLite database so that the answers survive a restart. Every answer is tagged
+with the version of the collection it was generated from: when the collection is
+reloaded, the answers of the previous version are dropped.
+"""
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a question, so that questions differing only in case, spacing or final
+    punctuation share the same cache entry.
+
+    Args:
+        query (str): The question.
+
+    Returns:
+        str: The normalized question.
+    """
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!.").strip().lower()
+
+
+def filters_key(filters: Optional[Dict[str, Any]]) -> str:
+    """
+    Serialize the metadata filters of a question, since answers retrieved with
+    different filters can't be shared.
+
+    Args:
+        filters (Optional[Dict[str, Any]]): The metadata filters of the retrieval.
+
+    Returns:
+        str: The canonical JSON of the filters.
+    """
+    # Sets are sorted, since their iteration order changes across processes
+    return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False, default=lambda value: sorted(value, key=str))
+
+
+class AnswerCache():
+    """
+    A class used to cache the answers of WikiRag by exact and by semantic match of the question.
+    """
+
+    def __init__(
+            self,
+            similarity_threshold: float = 0.95,
+            max_entries: int = 1024,
+            ttl: Optional[float] = 24 * 3600,
+            path: Optional[str] = None):
+        """
+        Constructor of the class
+
+        Args:
+        similarity_threshold (float): the minimum cosine similarity of two questions sharing an answer, above 1 disables the semantic match
+        max_entries (int): the maximum number of answers kept in memory, the least recently used are evicted
+        ttl (Optional[float]): the number of seconds an answer stays valid, None keeps the answers forever
+        path (Optional[str]): the path of a SQLite database persisting the answers, None keeps them only in memory
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # The vector index: one row per slot, each entry holds the slot of its question
+        self._matrix: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, version TEXT, query TEXT, filters TEXT, "
+                "answer TEXT, sources TEXT, vector BLOB, created REAL)"
+            )
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._slot_keys[entry["slot"]] = None
+        self._free_slots.append(entry["slot"])
+
+    def _insert(self, key: str, entry: Dict[str, Any]) -> None:
+        if key in self._entries:
+            self._remove(key)
+        while not self._free_slots:
+            self._remove(next(iter(self._entries)))
+
+        vector = entry["vector"]
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        slot = self._free_slots.pop()
+        self._matrix[slot] = vector
+        self._slot_keys[slot] = key
+        entry["slot"] = slot
+        self._entries[key] = entry
+
+    def set_version(self, version: str) -> None:
+        """
+        Method to set the version of the collection the answers are generated from. If the
+        version changed, the answers of the previous version are dropped; the persisted
+        answers of the current version are loaded in memory.
+
+        Args:
+        version (str): the version of the collection
+        """
+        with self._lock:
+            if version == self.version:
+                return
+            self.clear()
+            self.version = version
+            if self._connection is None:
+                return
+
+            self._connection.execute("DELETE FROM answers WHERE version != ?", (version,))
+            if self.ttl is not None:
+                self._connection.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            self._connection.commit()
+            rows = self._connection.execute(
+                "SELECT key, query, filters, answer, sources, vector, created FROM answers ORDER BY created DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            for key, query, filters, answer, sources, vector, created in reversed(rows):
+                self._insert(key, {
+                    "query": query,
+                    "filters": filters,
+                    "answer": answer,
+                    "sources": json.loads(sources),
+                    "vector": np.frombuffer(vector, dtype=np.float32),
+                    "created": created,
+                })
+
+    def clear(self) -> None:
+        """
+        Method to drop all the answers kept in memory
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def invalidate(self) -> None:
+        """
+        Method to drop all the answers, in memory and persisted
+        """
+        with self._lock:
+            self.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM answers")
+                self._connection.commit()
+
+    def get_exact(self, query: str, filters: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Method to look up the answer of a question by its normalized text
+
+        Args:
+        query (str): the question
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval
+
+        Returns:
+            Optional[Dict[str, Any]]: the cached 'answer' and 'sources', None if the question is not cached.
+        """
+        key = f"{filters_key(filters)}\x00{normalize_query(query)}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get_similar(self, query_vector: List[float], filters: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Method to look up the answer of the most similar question asked with the same filters
+
+        Args:
+        query_vector (List[float]): the embedding of the question
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval
+
+        Returns:
+            Optional[Dict[str, Any]]: the cached 'answer' and 'sources', None if no question is similar enough.
+        """
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        key_filters = filters_key(filters)
+        with self._lock:
+            if self._matrix is None or self.similarity_threshold > 1 or self._matrix.shape[1] != vector.shape[0]:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ vector
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.similarity_threshold:
+                    break
+                key = self._slot_keys[slot]
+                if key is None or self._entries[key]["filters"] != key_filters:
+                    continue
+                entry = self._entries[key]
+                if self._is_expired(entry):
+                    self._remove(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            return None
+
+    def put(
+            self,
+            query: str,
+            filters: Optional[Dict[str, Any]],
+            query_vector: List[float],
+            answer: str,
+            sources: List[Document]) -> None:
+        """
+        Method to cache the answer of a question
+
+        Args:
+        query (str): the question
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval
+        query_vector (List[float]): the embedding of the question
+        answer (str): the answer
+        sources (List[Document]): the chunks the answer was generated from
+        """
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        key_filters = filters_key(filters)
+        key = f"{key_filters}\x00{normalize_query(query)}"
+        entry = {
+            "query": query,
+            "filters": key_filters,
+            "answer": answer,
+            "sources": [{"page_content": source.page_content, "metadata": source.metadata} for source in sources],
+            "vector": vector,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._insert(key, entry)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO answers (key, version, query, filters, answer, sources, vector, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, self.version, query, key_filters, answer,
+                     json.dumps(entry["sources"], ensure_ascii=False), vector.tobytes(), entry["created"])
+                )
+                self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Method to close the persistent store
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
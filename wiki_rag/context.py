@@ -0,0 +1,189 @@
+"""
+Contains the context packer of WikiRag.
+
+The retrieved chunks and the web results are packed into the prompt within the context
+window of the model, keeping room for the answer:
+
+- chunks that duplicate, or mostly overlap, a better scored chunk are dropped;
+- chunks are added by decreasing score, the last one is truncated to fill the budget;
+- the web results get up to a share of the budget, plus what the chunks leave unused.
+
+Tokens are estimated from the text, since the tokenizer of the Ollama models is not
+available locally; a more accurate counter can be passed to the packer.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text: one token per punctuation mark and per
+    short word, long words are split every 5 characters.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(1 + (len(piece) - 1) // 5 for piece in TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, token_counter: Callable[[str], int] = estimate_tokens) -> str:
+    """
+    Truncate a text at a word boundary, so that it fits in a number of tokens.
+
+    Args:
+        text (str): The text.
+        max_tokens (int): The maximum number of tokens.
+        token_counter (Callable[[str], int]): The function counting the tokens of a text.
+
+    Returns:
+        str: The longest prefix of whole words that fits in the tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    if token_counter(text) <= max_tokens:
+        return text
+
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = text.lower().split()
+    return {tuple(words[index:index + size]) for index in range(max(len(words) - size + 1, 1))}
+
+
+class ContextPacker():
+    """
+    A class used to pack the retrieved chunks and the web results within a token budget.
+    """
+
+    def __init__(
+            self,
+            context_window: int,
+            answer_tokens: int = 512,
+            web_share: float = 0.25,
+            min_chunk_tokens: int = 32,
+            duplicate_threshold: float = 0.8,
+            token_counter: Callable[[str], int] = estimate_tokens):
+        """
+        Constructor of the class
+
+        Args:
+        context_window (int): the number of tokens of the context window of the model
+        answer_tokens (int): the number of tokens kept free for the answer
+        web_share (float): the share of the context budget reserved to the web results
+        min_chunk_tokens (int): the minimum number of tokens of a truncated chunk, shorter ones are dropped
+        duplicate_threshold (float): the share of shared word trigrams above which two chunks are duplicates
+        token_counter (Callable[[str], int]): the function counting the tokens of a text
+        """
+        self.context_window = context_window
+        self.answer_tokens = answer_tokens
+        self.web_share = web_share
+        self.min_chunk_tokens = min_chunk_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.token_counter = token_counter
+
+    def deduplicate(self, documents: List[Document]) -> List[Document]:
+        """
+        Method to sort the chunks by decreasing score, dropping the ones that duplicate a better scored chunk
+
+        Args:
+        documents (List[Document]): the retrieved chunks
+        """
+        ranked = sorted(documents, key=lambda document: document.metadata.get("score", 0.0), reverse=True)
+        kept, kept_shingles = [], []
+        for document in ranked:
+            shingles = _shingles(document.page_content)
+            if any(
+                len(shingles & other) >= self.duplicate_threshold * min(len(shingles), len(other))
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(document)
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def format_document(document: Document) -> str:
+        """
+        Method to format a chunk in the prompt, with the title of its page
+
+        Args:
+        document (Document): the chunk
+        """
+        title = document.metadata.get("title")
+        return f"- {title}: {document.page_content}" if title else f"- {document.page_content}"
+
+    def pack(self, documents: List[Document], web_context: str, prompt_tokens: int = 0) -> Dict[str, Any]:
+        """
+        Method to pack the chunks and the web results within the budget of the context window
+
+        Args:
+        documents (List[Document]): the retrieved chunks
+        web_context (str): the text of the web results
+        prompt_tokens (int): the number of tokens of the prompt without the context
+
+        Returns:
+            Dict[str, Any]: the packed 'context' and 'web_context', the 'sources' kept in the context
+            and a 'report' with the number of tokens and chunks used.
+        """
+        budget = max(self.context_window - self.answer_tokens - prompt_tokens, 0)
+        web_tokens = self.token_counter(web_context) if web_context else 0
+        web_reserved = min(web_tokens, int(budget * self.web_share))
+
+        # Add the chunks by decreasing score, within the budget left by the web results
+        unique_documents = self.deduplicate(documents)
+        remaining = budget - web_reserved
+        lines, sources = [], []
+        truncated = 0
+        for document in unique_documents:
+            line = self.format_document(document)
+            tokens = self.token_counter(line)
+            if tokens > remaining:
+                if remaining < self.min_chunk_tokens:
+                    break
+                line = truncate_to_tokens(line, remaining, self.token_counter)
+                tokens = self.token_counter(line)
+                truncated += 1
+            lines.append(line)
+            sources.append(document)
+            remaining -= tokens
+        context_tokens = budget - web_reserved - remaining
+
+        # The web results can use what the chunks left unused
+        packed_web_context = truncate_to_tokens(web_context, budget - context_tokens, self.token_counter) if web_context else ""
+        packed_web_tokens = self.token_counter(packed_web_context) if packed_web_context else 0
+
+        report = {
+            "context_window": self.context_window,
+            "budget_tokens": budget,
+            "prompt_tokens": prompt_tokens,
+            "context_tokens": context_tokens,
+            "web_context_tokens": packed_web_tokens,
+            "total_tokens": prompt_tokens + context_tokens + packed_web_tokens,
+            "chunks_retrieved": len(documents),
+            "chunks_duplicated": len(documents) - len(unique_documents),
+            "chunks_used": len(sources),
+            "chunks_truncated": truncated,
+            "web_context_truncated": packed_web_tokens < web_tokens,
+        }
+        return {
+            "context": "\n".join(lines),
+            "web_context": packed_web_context,
+            "sources": sources,
+            "report": report,
+        }
@@ -0,0 +1,428 @@
+"""
+Contains the embedding service shared by the vectorization pipeline and WikiRag.
+
+The embeddings are computed by one of two encoders, loaded once per process:
+
+- 'torch': the SentenceTransformer model, the default;
+- 'onnx': the same model exported to ONNX and run with ONNX Runtime on the CPU, optionally
+  quantized to int8, loaded from a local path without downloading anything.
+
+The query embeddings are kept in an LRU cache, since the same questions are often asked
+again. The ONNX encoder must produce the same embeddings as the torch one, since the chunks
+and the queries of a collection have to be embedded by the same model: `check_parity`
+compares the two encoders on sample texts.
+
+Usage:
+    From the root directory of the repository, to export, quantize and check a model:
+
+    optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 models/all-MiniLM-L6-v2
+    python -m wiki_rag.embeddings --onnx_model_path models/all-MiniLM-L6-v2/model.onnx --quantize
+
+Arguments:
+    --onnx_model_path: Path of the ONNX model, its directory must contain the 'tokenizer.json' file.
+    --model_name: Name of the SentenceTransformer model the ONNX model was exported from.
+    --quantize: Quantize the weights of the ONNX model to int8, and check the quantized model.
+    --min_similarity: Minimum cosine similarity between the ONNX and the torch embeddings.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from wiki_rag.startup import STARTUP
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+# Texts used to compare the encoders, in the languages of the KB
+PARITY_TEXTS = [
+    "Quando si sono svolte le prime Olimpiadi moderne?",
+    "Chi ha vinto più medaglie d'oro nella storia dei Giochi olimpici?",
+    "giochi olimpici estivi 1896 atene prima edizione era moderna pierre de coubertin",
+    "When were the first modern Olympic Games held?",
+    "The Summer Olympics are held every four years, the host city is chosen by the IOC.",
+    "fiaccola olimpica accesa olimpia trasportata staffetta città ospitante cerimonia apertura",
+]
+
+
+class TorchEncoder():
+    """
+    A class used to compute the embeddings with a SentenceTransformer model.
+    """
+
+    def __init__(self, model_name: str, num_threads: Optional[int] = None):
+        """
+        Constructor of the class
+
+        Args:
+        model_name (str): the name of the SentenceTransformer model
+        num_threads (Optional[int]): the number of torch threads, None keeps the torch default
+        """
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int, normalize: bool) -> np.ndarray:
+        """
+        Method to compute the embeddings of a list of texts
+
+        Args:
+        texts (List[str]): the texts
+        batch_size (int): the number of texts encoded together
+        normalize (bool): if True, the embeddings have unit length
+        """
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+
+
+class OnnxEncoder():
+    """
+    A class used to compute the embeddings with an ONNX model, running the same mean
+    pooling as the SentenceTransformer models.
+    """
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Constructor of the class
+
+        Args:
+        model_path (str): the path of the ONNX model, its directory must contain the 'tokenizer.json' file
+        num_threads (Optional[int]): the number of ONNX Runtime threads, None keeps the ONNX Runtime default
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_dir = os.path.dirname(os.path.abspath(model_path))
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        # Same maximum length as the SentenceTransformer model, when its config was exported too
+        max_seq_length = 256
+        config_path = os.path.join(model_dir, "sentence_bert_config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as config_file:
+                max_seq_length = json.load(config_file).get("max_seq_length", max_seq_length)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+        self.dimension = int(self.encode(["dimension"], batch_size=1, normalize=False).shape[1])
+
+    def encode(self, texts: List[str], batch_size: int, normalize: bool) -> np.ndarray:
+        """
+        Method to compute the embeddings of a list of texts
+
+        Args:
+        texts (List[str]): the texts
+        batch_size (int): the number of texts encoded together
+        normalize (bool): if True, the embeddings have unit length
+        """
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            inputs = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            token_embeddings = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+
+            # Mean of the token embeddings, without the padding
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            embeddings.append((token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        embeddings = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        if normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+
+# The warm-up and the first request can load the same encoder at the same time
+_ENCODERS_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_encoder(model_name: str, onnx_model_path: Optional[str], num_threads: Optional[int]):
+    with STARTUP.measure(f"load encoder {onnx_model_path or model_name}"):
+        if onnx_model_path:
+            return OnnxEncoder(onnx_model_path, num_threads)
+        return TorchEncoder(model_name, num_threads)
+
+
+def load_encoder(model_name: str, onnx_model_path: Optional[str] = None, num_threads: Optional[int] = None):
+    """
+    Load an encoder, once per process.
+
+    Args:
+        model_name (str): Name of the SentenceTransformer model.
+        onnx_model_path (Optional[str]): Path of the ONNX model, None loads the torch model.
+        num_threads (Optional[int]): Number of threads of the encoder, None keeps the default.
+
+    Returns:
+        Union[TorchEncoder, OnnxEncoder]: The encoder.
+    """
+    with _ENCODERS_LOCK:
+        return _load_encoder(model_name, onnx_model_path, num_threads)
+
+
+class EmbeddingService(Embeddings):
+    """
+    A class used to compute the embeddings of the chunks and of the queries, caching the
+    embeddings of the queries.
+    """
+
+    def __init__(
+            self,
+            model_name: str = DEFAULT_EMBEDDING_MODEL,
+            backend: str = "torch",
+            onnx_model_path: Optional[str] = None,
+            query_cache_size: int = 1024,
+            batch_size: int = 32,
+            num_threads: Optional[int] = None,
+            normalize: bool = True):
+        """
+        Constructor of the class. The encoder is loaded on first use.
+
+        Args:
+        model_name (str): the name of the SentenceTransformer model
+        backend (str): 'torch' for the SentenceTransformer model, 'onnx' for the ONNX model exported from it
+        onnx_model_path (Optional[str]): the path of the ONNX model, possibly quantized, required by the 'onnx' backend
+        query_cache_size (int): the maximum number of cached query embeddings, 0 disables the cache
+        batch_size (int): the number of texts encoded together
+        num_threads (Optional[int]): the number of threads of the encoder, None keeps the default
+        normalize (bool): if True, the embeddings have unit length
+        """
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}', the backends are {', '.join(EMBEDDING_BACKENDS)}")
+        if backend == "onnx" and not onnx_model_path:
+            raise ValueError("The 'onnx' embedding backend needs the path of the ONNX model")
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_model_path = onnx_model_path if backend == "onnx" else None
+        self.query_cache_size = query_cache_size
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.normalize = normalize
+        self.hits = 0
+        self.misses = 0
+
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        """
+        The encoder, shared by the services using the same model
+        """
+        return load_encoder(self.model_name, self.onnx_model_path, self.num_threads)
+
+    @property
+    def name(self) -> str:
+        """
+        The name identifying the embeddings, which differs between the torch and the ONNX models
+        """
+        if self.onnx_model_path:
+            return f"{self.model_name}:{os.path.basename(self.onnx_model_path)}"
+        return self.model_name
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """
+        Method to get the size of the embeddings
+        """
+        return self.encoder.dimension
+
+    def encode(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Method to compute the embeddings of a list of texts
+
+        Args:
+        texts (List[str]): the texts
+        batch_size (Optional[int]): the number of texts encoded together, None uses the batch size of the service
+
+        Returns:
+            np.ndarray: the embeddings, one row per text.
+        """
+        return self.encoder.encode(list(texts), batch_size or self.batch_size, self.normalize)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Method to compute the embeddings of the chunks, without caching them
+
+        Args:
+        texts (List[str]): the texts of the chunks
+        """
+        if not texts:
+            return []
+        return self.encode(texts).tolist()
+
+    def embed_queries(self, queries: Sequence[str]) -> List[List[float]]:
+        """
+        Method to compute the embeddings of many queries, encoding the ones not cached together
+
+        Args:
+        queries (Sequence[str]): the queries
+        """
+        vectors: Dict[str, List[float]] = {}
+        with self._lock:
+            for query in queries:
+                vector = self._query_cache.get(query)
+                if vector is not None:
+                    self._query_cache.move_to_end(query)
+                    vectors[query] = vector
+                    self.hits += 1
+            missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+            self.misses += len(missing)
+
+        if missing:
+            computed = dict(zip(missing, self.embed_documents(missing)))
+            vectors.update(computed)
+            with self._lock:
+                for query, vector in computed.items():
+                    if self.query_cache_size <= 0:
+                        break
+                    self._query_cache[query] = vector
+                    self._query_cache.move_to_end(query)
+                while len(self._query_cache) > max(self.query_cache_size, 0):
+                    self._query_cache.popitem(last=False)
+
+        return [list(vectors[query]) for query in queries]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Method to compute the embedding of a query, from the cache when it was already asked
+
+        Args:
+        text (str): the query
+        """
+        return self.embed_queries([text])[0]
+
+    def clear_cache(self) -> None:
+        """
+        Method to remove all the cached query embeddings
+        """
+        with self._lock:
+            self._query_cache.clear()
+
+
+def quantize_onnx_model(model_path: str, quantized_model_path: Optional[str] = None) -> str:
+    """
+    Quantize the weights of an ONNX model to int8, the activations are quantized at run time.
+
+    Args:
+        model_path (str): Path of the ONNX model.
+        quantized_model_path (Optional[str]): Path of the quantized model, next to the model if None.
+
+    Returns:
+        str: The path of the quantized model.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    if quantized_model_path is None:
+        root, extension = os.path.splitext(model_path)
+        quantized_model_path = f"{root}_quantized{extension}"
+    quantize_dynamic(model_path, quantized_model_path, weight_type=QuantType.QInt8)
+    return quantized_model_path
+
+
+def check_parity(
+        reference: EmbeddingService,
+        candidate: EmbeddingService,
+        texts: Sequence[str] = PARITY_TEXTS) -> Dict[str, float]:
+    """
+    Compare the embeddings of two services, e.g. the torch and the ONNX models.
+
+    Args:
+        reference (EmbeddingService): The service computing the reference embeddings.
+        candidate (EmbeddingService): The service to compare.
+        texts (Sequence[str]): The texts embedded by both services.
+
+    Returns:
+        Dict[str, float]: The minimum and the mean cosine similarity between the embeddings of
+        the same text, the maximum absolute difference and the share of texts whose nearest
+        neighbour among the other texts is the same.
+    """
+    texts = list(texts)
+    expected = reference.encode(texts)
+    actual = candidate.encode(texts)
+    if expected.shape != actual.shape:
+        raise ValueError(f"The embeddings have different shapes: {expected.shape} and {actual.shape}")
+
+    def unit(vectors: np.ndarray) -> np.ndarray:
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    expected, actual = unit(expected), unit(actual)
+    similarities = (expected * actual).sum(axis=1)
+
+    # The nearest neighbours of each text must not change, since they are what the retrieval returns
+    neighbours = []
+    for vectors in (expected, actual):
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        neighbours.append(scores.argmax(axis=1))
+
+    return {
+        "min_similarity": float(similarities.min()),
+        "mean_similarity": float(similarities.mean()),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+        "neighbour_agreement": float((neighbours[0] == neighbours[1]).mean()) if len(texts) > 1 else 1.0,
+    }
+
+
+def main(onnx_model_path: str, model_name: str, quantize: bool = False, min_similarity: float = 0.98) -> bool:
+    """
+    Main function to check that an ONNX model computes the same embeddings as the torch model.
+
+    Args:
+        onnx_model_path (str): Path of the ONNX model.
+        model_name (str): Name of the SentenceTransformer model the ONNX model was exported from.
+        quantize (bool): If True, the model is quantized to int8 and the quantized model is checked.
+        min_similarity (float): Minimum cosine similarity between the ONNX and the torch embeddings.
+
+    Returns:
+        bool: True if the ONNX model passed the check.
+    """
+    if quantize:
+        onnx_model_path = quantize_onnx_model(onnx_model_path)
+        print(f"Quantized model saved as {onnx_model_path}")
+
+    report = check_parity(
+        EmbeddingService(model_name),
+        EmbeddingService(model_name, backend="onnx", onnx_model_path=onnx_model_path),
+    )
+    print(json.dumps(report, indent=4))
+    passed = report["min_similarity"] >= min_similarity and report["neighbour_agreement"] == 1.0
+    if not passed:
+        print(f"Error: The embeddings of '{onnx_model_path}' differ from the ones of '{model_name}'.")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX Embedding Parity Check")
+    parser.add_argument("--onnx_model_path", type=str, required=True, help="Path of the ONNX model, its directory must contain the 'tokenizer.json' file.")
+    parser.add_argument("--model_name", type=str, default=DEFAULT_EMBEDDING_MODEL, help=f"Name of the SentenceTransformer model (default is '{DEFAULT_EMBEDDING_MODEL}').")
+    parser.add_argument("--quantize", action="store_true", help="Quantize the ONNX model to int8 and check the quantized model.")
+    parser.add_argument("--min_similarity", type=float, default=0.98, help="Minimum cosine similarity with the torch embeddings (default is 0.98).")
+
+    args = parser.parse_args()
+
+    sys.exit(0 if main(args.onnx_model_path, args.model_name, args.quantize, args.min_similarity) else 1)
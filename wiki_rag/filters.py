@@ -0,0 +1,48 @@
+"""
+Contains the metadata filters of the WikiRag retrieval.
+
+Filters are plain dictionaries from a payload field of the chunks to the accepted value(s):
+
+    {"language": "it"}                                   # a single value
+    {"language": "it", "title": ["Olimpiadi", "Roma"]}   # an allow-list
+
+They are converted into a Qdrant filter and pushed down into the search, so that
+only the matching chunks are ranked.
+"""
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from wiki_rag.startup import lazy_import
+
+if TYPE_CHECKING:
+    from qdrant_client.models import Filter
+
+# Payload fields that can be used in the filters
+FILTERABLE_FIELDS = ("language", "title", "url")
+
+
+def build_qdrant_filter(filters: Optional[Dict[str, Any]]) -> Optional["Filter"]:
+    """
+    Convert metadata filters into a Qdrant filter.
+
+    Args:
+        filters (Optional[Dict[str, Any]]): The accepted value, or list of values, of each payload field.
+
+    Returns:
+        Optional[Filter]: The Qdrant filter, None if there is nothing to filter.
+    """
+    if not filters:
+        return None
+
+    models = lazy_import("qdrant_client.models")
+    conditions = []
+    for field, value in filters.items():
+        if field not in FILTERABLE_FIELDS:
+            raise ValueError(f"Cannot filter on '{field}', the filterable fields are {', '.join(FILTERABLE_FIELDS)}")
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(models.FieldCondition(key=field, match=models.MatchAny(any=list(value))))
+        else:
+            conditions.append(models.FieldCondition(key=field, match=models.MatchValue(value=value)))
+
+    return models.Filter(must=conditions) if conditions else None
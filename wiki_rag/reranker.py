@@ -0,0 +1,117 @@
+"""
+Contains the reranking stage of WikiRag.
+
+The retriever over-fetches candidates, which are scored together with the query by a
+small cross-encoder running on the CPU; only the best ones are sent to the LLM. The
+candidates are scored in batches, by decreasing retrieval score, within a latency
+budget: when the budget is exceeded the remaining candidates keep their retrieval order,
+after the scored ones.
+"""
+import time
+import threading
+from functools import lru_cache
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from wiki_rag.startup import STARTUP
+
+# Multilingual cross-encoder, since the KB holds Italian and English pages
+DEFAULT_RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+# The warm-up and the first request can load the same model at the same time
+_CROSS_ENCODERS_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_cross_encoder(model_name: str, max_length: int):
+    with STARTUP.measure(f"load cross-encoder {model_name}"):
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+
+def load_cross_encoder(model_name: str, max_length: int = 512):
+    """
+    Load a cross-encoder on the CPU, once per process.
+
+    Args:
+        model_name (str): Name of the cross-encoder model.
+        max_length (int): Maximum number of tokens of a query and chunk pair.
+
+    Returns:
+        CrossEncoder: The cross-encoder.
+    """
+    with _CROSS_ENCODERS_LOCK:
+        return _load_cross_encoder(model_name, max_length)
+
+
+class CrossEncoderReranker():
+    """
+    A class used to rerank the retrieved chunks with a cross-encoder.
+    """
+
+    def __init__(
+            self,
+            model_name: str = DEFAULT_RERANKER_MODEL,
+            batch_size: int = 16,
+            timeout: Optional[float] = 1.0,
+            max_length: int = 512):
+        """
+        Constructor of the class. The model is loaded on first use.
+
+        Args:
+        model_name (str): the name of the cross-encoder model
+        batch_size (int): the number of candidates scored together
+        timeout (Optional[float]): the latency budget of the reranking in seconds, None scores all the candidates
+        max_length (int): the maximum number of tokens of a query and chunk pair
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_length = max_length
+
+    @property
+    def model(self):
+        """
+        The cross-encoder, shared by the rerankers using the same model
+        """
+        return load_cross_encoder(self.model_name, self.max_length)
+
+    def rerank(self, query: str, documents: List[Document], top_k: int) -> List[Document]:
+        """
+        Method to rerank the candidates of a query
+
+        Args:
+        query (str): the query
+        documents (List[Document]): the candidates, sorted by decreasing retrieval score
+        top_k (int): the number of candidates to keep
+
+        Returns:
+            List[Document]: the best candidates. Their 'score' metadata is the cross-encoder score,
+            0 for the candidates not scored within the budget, and 'retrieval_score' the original score.
+        """
+        if not documents:
+            return []
+
+        start = time.monotonic()
+        scores: List[float] = []
+        for batch_start in range(0, len(documents), self.batch_size):
+            if self.timeout is not None and scores and time.monotonic() - start > self.timeout:
+                break
+            batch = documents[batch_start:batch_start + self.batch_size]
+            scores.extend(float(score) for score in self.model.predict(
+                [(query, document.page_content) for document in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            ))
+
+        scored = sorted(zip(scores, documents), key=lambda pair: pair[0], reverse=True)
+        reranked = []
+        for score, document in scored + [(0.0, document) for document in documents[len(scores):]]:
+            metadata = dict(document.metadata)
+            metadata["retrieval_score"] = metadata.get("score")
+            metadata["score"] = score
+            reranked.append(Document(page_content=document.page_content, metadata=metadata))
+        return reranked[:top_k]
@@ -0,0 +1,86 @@
+"""
+Contains the sparse (keyword) encoding of the chunks and of the queries, used by the
+hybrid retrieval of WikiRag.
+
+Each word is mapped to a fixed index by hashing, so that the vocabulary doesn't need to
+be stored, and weighted with the BM25 term frequency saturation. The inverse document
+frequency is computed by Qdrant (`Modifier.IDF`), so the weights of a chunk don't depend
+on the rest of the collection and can be computed while loading it.
+
+The chunks are already lowercased and stripped of stopwords by the vectorization
+pipeline; query words that are not in any chunk, such as stopwords, simply don't match.
+"""
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# Name of the sparse vectors in the Qdrant collection
+SPARSE_VECTOR_NAME = "text"
+
+# BM25 term frequency saturation. The length normalization is left out, since all
+# the chunks have about the same length
+BM25_K1 = 1.2
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase words.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The words.
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+def term_index(term: str) -> int:
+    """
+    Map a word to the index of its dimension in the sparse vectors.
+
+    Args:
+        term (str): The word.
+
+    Returns:
+        int: The index, an unsigned 32 bit integer.
+    """
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def _to_sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    indices = sorted(weights)
+    return indices, [weights[index] for index in indices]
+
+
+def encode_document(text: str) -> Tuple[List[int], List[float]]:
+    """
+    Compute the sparse vector of a chunk.
+
+    Args:
+        text (str): The text of the chunk.
+
+    Returns:
+        Tuple[List[int], List[float]]: The indices and the values of the sparse vector.
+    """
+    weights: Dict[int, float] = {}
+    for term, frequency in Counter(tokenize(text)).items():
+        index = term_index(term)
+        weights[index] = weights.get(index, 0.0) + frequency * (BM25_K1 + 1) / (frequency + BM25_K1)
+    return _to_sparse(weights)
+
+
+def encode_query(text: str) -> Tuple[List[int], List[float]]:
+    """
+    Compute the sparse vector of a query, where every word has the same weight.
+
+    Args:
+        text (str): The query.
+
+    Returns:
+        Tuple[List[int], List[float]]: The indices and the values of the sparse vector.
+    """
+    return _to_sparse({term_index(term): 1.0 for term in tokenize(text)})
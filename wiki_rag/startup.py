@@ -0,0 +1,99 @@
+"""
+Contains the startup instrumentation of WikiRag.
+
+The heavy dependencies (the langchain integrations, the Qdrant client, torch and
+sentence-transformers, ONNX Runtime) are imported, and the models and the clients are
+constructed, on first use. `STARTUP` records how long each of these steps took, so that
+the cold start of a worker or of a CLI can be broken down. The report is printed at exit
+when the `WIKIRAG_STARTUP_REPORT` environment variable is set, e.g.
+
+    WIKIRAG_STARTUP_REPORT=1 python vectorization_pipeline/wikipedia_chunker.py --help
+"""
+import os
+import sys
+import time
+import atexit
+import importlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Dict, Iterator
+
+
+class StartupTimer():
+    """
+    A class used to record the duration of the startup steps of the process.
+    """
+
+    def __init__(self):
+        """
+        Constructor of the class
+        """
+        self.started = time.perf_counter()
+        self._timings: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, step: str) -> Iterator[None]:
+        """
+        Method to time a startup step
+
+        Args:
+        step (str): the name of the step, e.g. 'import qdrant_client'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start)
+
+    def record(self, step: str, seconds: float) -> None:
+        """
+        Method to record the duration of a startup step, replacing a previous one with the same name
+
+        Args:
+        step (str): the name of the step
+        seconds (float): the duration of the step
+        """
+        with self._lock:
+            self._timings[step] = seconds
+
+    def report(self) -> Dict[str, float]:
+        """
+        Method to get the duration of the startup steps, in the order they completed
+        """
+        with self._lock:
+            return dict(self._timings)
+
+    def summary(self) -> str:
+        """
+        Method to describe the startup steps, one per line
+        """
+        lines = [f"Startup: {time.perf_counter() - self.started:.3f}s since wiki_rag was imported"]
+        lines.extend(f"  {step}: {seconds:.3f}s" for step, seconds in self.report().items())
+        return "\n".join(lines)
+
+
+STARTUP = StartupTimer()
+
+
+def lazy_import(module_name: str) -> ModuleType:
+    """
+    Import a module on first use, recording the duration of the import.
+
+    Args:
+        module_name (str): The name of the module.
+
+    Returns:
+        ModuleType: The module.
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with STARTUP.measure(f"import {module_name}"):
+        return importlib.import_module(module_name)
+
+
+if os.environ.get("WIKIRAG_STARTUP_REPORT"):
+    atexit.register(lambda: print(STARTUP.summary()))
@@ -0,0 +1,432 @@
+"""
+Contains the instrumentation of the WikiRag requests.
+
+Every request is recorded in a `Trace`: the time spent in each stage (cache lookup,
+query embedding, retrieval, reranking, web search, context packing, generation and
+cache store), the number and the scores of the retrieved chunks, the prompt tokens
+and the generation speed. A completed trace is sent to a pluggable exporter:
+
+- `PrometheusExporter` aggregates the traces in Prometheus-style counters and
+  histograms, renders them in the text exposition format (optionally served over
+  HTTP) and estimates the percentiles of each stage, e.g. p50 and p99;
+- `JsonLinesExporter` appends the traces to a JSON lines file;
+- any object with an `export(trace)` method can be used.
+
+The stages of a request can overlap, e.g. the web search runs during the retrieval,
+so their sum can exceed the duration of the request.
+"""
+import json
+import time
+import uuid
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from wiki_rag.context import estimate_tokens
+
+STAGES = ("cache_lookup", "embedding", "retrieval", "rerank", "web_search", "context_packing", "generation", "cache_store")
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CHUNKS_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+TOKENS_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Trace():
+    """
+    A class used to record the stages of a WikiRag request.
+    """
+
+    def __init__(self, query: str):
+        """
+        Constructor of the class
+
+        Args:
+        query (str): the query of the request
+        """
+        self.query = query
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+        # Seconds spent in each stage, accumulated when a stage runs more than once
+        self.stages: Dict[str, float] = {}
+        self.attributes: Dict[str, Any] = {}
+
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Method to time a stage of the request
+
+        Args:
+        stage (str): the name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - start)
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        """
+        Method to add the time spent in a stage
+
+        Args:
+        stage (str): the name of the stage
+        seconds (float): the time spent in the stage
+        """
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def set(self, **attributes: Any) -> None:
+        """
+        Method to set attributes of the request, e.g. the number of retrieved chunks
+        """
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def finish(self) -> "Trace":
+        """
+        Method to mark the end of the request, only the first call is recorded
+        """
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+        return self
+
+    def callback(self) -> BaseCallbackHandler:
+        """
+        Method to get the langchain callback recording the generation of the answer in the trace
+        """
+        return GenerationTracer(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Method to convert the trace to a JSON serializable dictionary
+        """
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "query": self.query,
+                "started_at": self.started_at,
+                "duration": self.duration,
+                "stages": dict(self.stages),
+                "attributes": dict(self.attributes),
+            }
+
+    def summary(self) -> str:
+        """
+        Method to describe the trace in a single line
+        """
+        with self._lock:
+            stages = ", ".join(f"{stage} {self.stages[stage]:.3f}s" for stage in STAGES if stage in self.stages)
+            attributes = dict(self.attributes)
+        parts = [f"{self.duration or 0.0:.3f}s total"]
+        if stages:
+            parts.append(stages)
+        if attributes.get("cached"):
+            parts.append(f"{attributes['cached']} cache hit")
+        if "chunks_retrieved" in attributes:
+            parts.append(f"{attributes.get('chunks_used', 0)}/{attributes['chunks_retrieved']} chunks")
+        if "prompt_tokens" in attributes:
+            parts.append(f"{attributes['prompt_tokens']} prompt tokens")
+        if "completion_tokens" in attributes:
+            parts.append(f"{attributes['completion_tokens']} tokens at {attributes.get('tokens_per_second', 0.0):.1f} tokens/s")
+        return "Trace: " + ", ".join(parts)
+
+
+class GenerationTracer(BaseCallbackHandler):
+    """
+    A class used to record in a trace the duration and the tokens of the generation.
+    """
+
+    def __init__(self, trace: Trace):
+        """
+        Constructor of the class
+
+        Args:
+        trace (Trace): the trace of the request
+        """
+        self.trace = trace
+        self._start: Optional[float] = None
+        self._first_token: Optional[float] = None
+        self._tokens = 0
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._start = time.perf_counter()
+        self._first_token = None
+        self._tokens = 0
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self.on_llm_start(serialized, [], **kwargs)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+        self._tokens += 1
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if self._start is None:
+            return
+        end = time.perf_counter()
+        self.trace.add_stage("generation", end - self._start)
+
+        # Ollama reports the generated tokens and the time spent generating them,
+        # otherwise the streamed tokens are counted, or estimated from the answer
+        completion_tokens, generation_seconds = self._tokens, None
+        if response.generations and response.generations[0]:
+            generation = response.generations[0][0]
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None) or {}
+            metadata = getattr(message, "response_metadata", None) or {}
+            completion_tokens = usage.get("output_tokens") or metadata.get("eval_count") or completion_tokens or estimate_tokens(generation.text)
+            if metadata.get("eval_duration"):
+                generation_seconds = metadata["eval_duration"] / 1e9
+            if usage.get("input_tokens"):
+                self.trace.set(llm_prompt_tokens=usage["input_tokens"])
+        if generation_seconds is None:
+            generation_seconds = end - (self._first_token or self._start)
+
+        attributes = {"completion_tokens": completion_tokens}
+        if self._first_token is not None:
+            attributes["time_to_first_token"] = self._first_token - self._start
+        if completion_tokens and generation_seconds > 0:
+            attributes["tokens_per_second"] = completion_tokens / generation_seconds
+        self.trace.set(**attributes)
+
+
+class MetricsExporter():
+    """
+    Interface of the exporters of the traces.
+    """
+
+    def export(self, trace: Trace) -> None:
+        """
+        Method to export a completed trace
+
+        Args:
+        trace (Trace): the trace of the request
+        """
+        raise NotImplementedError
+
+
+class Histogram():
+    """
+    A class used to count observations in cumulative buckets, as a Prometheus histogram.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        """
+        Constructor of the class
+
+        Args:
+        buckets (Sequence[float]): the sorted upper bounds of the buckets, the +Inf bucket is added
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Method to add an observation
+
+        Args:
+        value (float): the observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        """
+        Method to get the number of observations lower or equal to each bound, +Inf included
+        """
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Method to estimate a quantile by linear interpolation within its bucket, as the
+        `histogram_quantile` function of Prometheus
+
+        Args:
+        q (float): the quantile, between 0 and 1
+
+        Returns:
+            Optional[float]: the estimate, None without observations.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, previous = 0.0, 0
+        for bound, cumulative in zip(self.buckets, self.cumulative_counts()):
+            if cumulative >= rank and cumulative > previous:
+                return lower + (bound - lower) * (rank - previous) / (cumulative - previous)
+            lower, previous = bound, cumulative
+        # Observations above the highest bound
+        return self.buckets[-1] if self.buckets else None
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    A class used to aggregate the traces in Prometheus-style counters and histograms.
+    """
+
+    def __init__(self, namespace: str = "wikirag", latency_buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Constructor of the class
+
+        Args:
+        namespace (str): the prefix of the metric names
+        latency_buckets (Sequence[float]): the upper bounds, in seconds, of the latency histogram buckets
+        """
+        self.namespace = namespace
+        self.latency_buckets = tuple(latency_buckets)
+
+        self.requests: Dict[str, int] = {}
+        self.generated_tokens = 0
+        self.request_duration = Histogram(self.latency_buckets)
+        self.stage_duration: Dict[str, Histogram] = {}
+        self.retrieved_chunks = Histogram(CHUNKS_BUCKETS)
+        self.prompt_tokens = Histogram(TOKENS_BUCKETS)
+        self.tokens_per_second = Histogram(TOKENS_PER_SECOND_BUCKETS)
+
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        data = trace.to_dict()
+        attributes = data["attributes"]
+        with self._lock:
+            cached = str(attributes.get("cached") or "none")
+            self.requests[cached] = self.requests.get(cached, 0) + 1
+            if data["duration"] is not None:
+                self.request_duration.observe(data["duration"])
+            for stage, seconds in data["stages"].items():
+                self.stage_duration.setdefault(stage, Histogram(self.latency_buckets)).observe(seconds)
+            if "chunks_retrieved" in attributes:
+                self.retrieved_chunks.observe(attributes["chunks_retrieved"])
+            if "prompt_tokens" in attributes:
+                self.prompt_tokens.observe(attributes["prompt_tokens"])
+            if "tokens_per_second" in attributes:
+                self.tokens_per_second.observe(attributes["tokens_per_second"])
+            self.generated_tokens += attributes.get("completion_tokens", 0)
+
+    def percentiles(self, quantiles: Sequence[float] = (0.5, 0.99)) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Method to estimate the percentiles of the duration of each stage and of the whole request
+
+        Args:
+        quantiles (Sequence[float]): the quantiles, between 0 and 1
+
+        Returns:
+            Dict[str, Dict[str, Optional[float]]]: by stage ('request' for the whole request), the
+            number of observations as 'count' and the estimates as 'p50', 'p99', ...
+        """
+        with self._lock:
+            histograms = {"request": self.request_duration, **self.stage_duration}
+            return {
+                stage: {"count": histogram.count, **{f"p{q * 100:g}": histogram.quantile(q) for q in quantiles}}
+                for stage, histogram in histograms.items()
+            }
+
+    def _render_histogram(self, lines: List[str], name: str, help_text: str, histograms: List[Tuple[str, Histogram]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            separator = "," if labels else ""
+            for bound, cumulative in zip((*histogram.buckets, "+Inf"), histogram.cumulative_counts()):
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {histogram.sum}")
+            lines.append(f"{name}_count{suffix} {histogram.count}")
+
+    def render(self) -> str:
+        """
+        Method to render the metrics in the Prometheus text exposition format
+        """
+        prefix = self.namespace
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_requests_total Number of requests, by answer cache hit.",
+                f"# TYPE {prefix}_requests_total counter",
+            ]
+            lines.extend(f'{prefix}_requests_total{{cached="{cached}"}} {count}' for cached, count in sorted(self.requests.items()))
+            lines.extend([
+                f"# HELP {prefix}_generated_tokens_total Number of tokens generated by the LLM.",
+                f"# TYPE {prefix}_generated_tokens_total counter",
+                f"{prefix}_generated_tokens_total {self.generated_tokens}",
+            ])
+            self._render_histogram(lines, f"{prefix}_request_duration_seconds", "Duration of the requests.", [("", self.request_duration)])
+            self._render_histogram(
+                lines, f"{prefix}_stage_duration_seconds", "Duration of the stages of the requests.",
+                [(f'stage="{stage}"', histogram) for stage, histogram in sorted(self.stage_duration.items())]
+            )
+            self._render_histogram(lines, f"{prefix}_retrieved_chunks", "Number of chunks retrieved by a request.", [("", self.retrieved_chunks)])
+            self._render_histogram(lines, f"{prefix}_prompt_tokens", "Number of tokens of the prompt.", [("", self.prompt_tokens)])
+            self._render_histogram(lines, f"{prefix}_generation_tokens_per_second", "Speed of the generation.", [("", self.tokens_per_second)])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9100, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """
+        Method to serve the metrics on `/metrics`, in a background thread
+
+        Args:
+        port (int): the port of the server
+        host (str): the address the server listens on
+
+        Returns:
+            ThreadingHTTPServer: the server, stopped with `shutdown()`.
+        """
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+class JsonLinesExporter(MetricsExporter):
+    """
+    A class used to append the traces to a JSON lines file.
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor of the class
+
+        Args:
+        path (str): the path of the file, created if it doesn't exist
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
@@ -0,0 +1,423 @@
+"""
+Contains the vector store backends of the WikiRag retrieval.
+
+- `QdrantBackend`: a Qdrant collection, served by a Qdrant server or by the local
+  mode of the client (`QdrantClient(path=...)`), without a server.
+- `NumpyBackend`: an embedded index over a chunk store written by the chunker
+  (`wikipedia_chunker.py --output_format store`). The vectors are memory-mapped and
+  searched by brute force, or through an IVF index for larger stores; the keyword
+  search uses an inverted index built from the text of the chunks.
+
+Every backend returns the hits as (point id, score, payload) tuples.
+"""
+import os
+import json
+import math
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from wiki_rag.filters import FILTERABLE_FIELDS, build_qdrant_filter
+from wiki_rag.sparse import SPARSE_VECTOR_NAME, encode_document
+from wiki_rag.startup import lazy_import
+
+# The Qdrant client is only imported by the Qdrant backend
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import SearchParams
+
+# A search result: the point id, the score and the payload of the chunk
+Hit = Tuple[Any, float, Dict[str, Any]]
+
+# Files of the chunk store, see vectorization_pipeline/chunk_store.py
+VECTORS_FILE = "vectors.npy"
+PAYLOADS_FILE = "payloads.jsonl"
+
+# The loader and the refresh of the pipeline mark each change of a Qdrant collection
+# with a new alias '<collection>__version_<token>', read by QdrantBackend.get_version
+VERSION_ALIAS_SEPARATOR = "__version_"
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hit]], limit: int, k: int = 60) -> List[Hit]:
+    """
+    Fuse many rankings of the same points with reciprocal rank fusion.
+
+    Args:
+        rankings (List[List[Hit]]): The rankings, each sorted by decreasing score.
+        limit (int): The number of points to return.
+        k (int): The rank offset of the fusion.
+
+    Returns:
+        List[Hit]: The fused ranking, the score of each point is the sum of 1 / (k + rank).
+    """
+    scores: Dict[Any, float] = {}
+    payloads: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, (point_id, _, payload) in enumerate(ranking):
+            scores[point_id] = scores.get(point_id, 0.0) + 1.0 / (k + rank + 1)
+            payloads[point_id] = payload
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(point_id, score, payloads[point_id]) for point_id, score in fused]
+
+
+class VectorStoreBackend():
+    """
+    Interface of the vector store backends.
+    """
+
+    def dense_search(self, query_vector: List[float], limit: int, filters: Optional[Dict[str, Any]] = None, score_threshold: Optional[float] = None) -> List[Hit]:
+        """
+        Method to search the chunks most similar to the embedding of the query
+
+        Args:
+        query_vector (List[float]): the embedding of the query
+        limit (int): the maximum number of chunks
+        filters (Optional[Dict[str, Any]]): the accepted value, or list of values, of the payload fields
+        score_threshold (Optional[float]): the minimum cosine similarity of the chunks
+        """
+        raise NotImplementedError
+
+    def sparse_search(self, indices: List[int], values: List[float], limit: int, filters: Optional[Dict[str, Any]] = None) -> List[Hit]:
+        """
+        Method to search the chunks matching the keywords of the query
+
+        Args:
+        indices (List[int]): the indices of the sparse vector of the query
+        values (List[float]): the values of the sparse vector of the query
+        limit (int): the maximum number of chunks
+        filters (Optional[Dict[str, Any]]): the accepted value, or list of values, of the payload fields
+        """
+        raise NotImplementedError
+
+    def hybrid_search(
+            self,
+            query_vector: List[float],
+            indices: List[int],
+            values: List[float],
+            limit: int,
+            candidates: int,
+            filters: Optional[Dict[str, Any]] = None,
+            score_threshold: Optional[float] = None) -> List[Hit]:
+        """
+        Method to fuse the dense and the sparse search with reciprocal rank fusion
+
+        Args:
+        query_vector (List[float]): the embedding of the query
+        indices (List[int]): the indices of the sparse vector of the query
+        values (List[float]): the values of the sparse vector of the query
+        limit (int): the maximum number of chunks
+        candidates (int): the number of candidates of each search
+        filters (Optional[Dict[str, Any]]): the accepted value, or list of values, of the payload fields
+        score_threshold (Optional[float]): the minimum cosine similarity of the dense candidates
+        """
+        return reciprocal_rank_fusion([
+            self.dense_search(query_vector, candidates, filters, score_threshold),
+            self.sparse_search(indices, values, candidates, filters),
+        ], limit)
+
+    def get_version(self) -> str:
+        """
+        Method to get a fingerprint of the content of the store, which changes when it is reloaded
+        or refreshed
+        """
+        raise NotImplementedError
+
+
+class QdrantBackend(VectorStoreBackend):
+    """
+    A class used to search a Qdrant collection.
+    """
+
+    def __init__(self, qdrant_client: "QdrantClient", collection_name: str, search_params: Optional["SearchParams"] = None):
+        """
+        Constructor of the class. The collection must exist and be in a good status.
+
+        Args:
+        qdrant_client (QdrantClient): the Qdrant client, of a server or of the local mode
+        collection_name (str): the name of the collection
+        search_params (Optional[SearchParams]): the params of the dense search, e.g. the HNSW ef and the rescoring
+        """
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.search_params = search_params
+
+        # Check the qudrant collection exists
+        if not qdrant_client.collection_exists(collection_name):
+            raise ValueError(f"Error: Collection {collection_name} does not exist")
+        collection_status = qdrant_client.get_collection(collection_name)
+        if not collection_status.status in ["green"]:
+            raise ValueError(f"Error: Collection {collection_name} is not in a good status: {collection_status.status}")
+
+    def dense_search(self, query_vector, limit, filters=None, score_threshold=None) -> List[Hit]:
+        points = self.qdrant_client.query_points(
+            collection_name=self.collection_name,
+            query=query_vector,
+            query_filter=build_qdrant_filter(filters),
+            search_params=self.search_params,
+            limit=limit,
+            score_threshold=score_threshold,
+            with_payload=True,
+        ).points
+        return [(point.id, point.score, point.payload) for point in points]
+
+    def sparse_search(self, indices, values, limit, filters=None) -> List[Hit]:
+        models = lazy_import("qdrant_client.models")
+        points = self.qdrant_client.query_points(
+            collection_name=self.collection_name,
+            query=models.SparseVector(indices=indices, values=values),
+            using=SPARSE_VECTOR_NAME,
+            query_filter=build_qdrant_filter(filters),
+            limit=limit,
+            with_payload=True,
+        ).points
+        return [(point.id, point.score, point.payload) for point in points]
+
+    def hybrid_search(self, query_vector, indices, values, limit, candidates, filters=None, score_threshold=None) -> List[Hit]:
+        # Both searches and the fusion run in a single request
+        models = lazy_import("qdrant_client.models")
+        query_filter = build_qdrant_filter(filters)
+        points = self.qdrant_client.query_points(
+            collection_name=self.collection_name,
+            prefetch=[
+                models.Prefetch(
+                    query=query_vector,
+                    filter=query_filter,
+                    params=self.search_params,
+                    score_threshold=score_threshold,
+                    limit=candidates,
+                ),
+                models.Prefetch(
+                    query=models.SparseVector(indices=indices, values=values),
+                    using=SPARSE_VECTOR_NAME,
+                    filter=query_filter,
+                    limit=candidates,
+                ),
+            ],
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=limit,
+            with_payload=True,
+        ).points
+        return [(point.id, point.score, point.payload) for point in points]
+
+    def get_version(self) -> str:
+        # The version alias changes on every load and refresh, the number of points also
+        # catches the collections written by other tools
+        prefix = f"{self.collection_name}{VERSION_ALIAS_SEPARATOR}"
+        aliases = self.qdrant_client.get_collection_aliases(self.collection_name).aliases
+        markers = sorted(alias.alias_name[len(prefix):] for alias in aliases if alias.alias_name.startswith(prefix))
+        collection = self.qdrant_client.get_collection(self.collection_name)
+        return f"{self.collection_name}:{','.join(markers) or 'unversioned'}:{collection.points_count}"
+
+
+class NumpyBackend(VectorStoreBackend):
+    """
+    A class used to search a chunk store in process, without a Qdrant server.
+
+    When the chunker rewrites the store, the backend reopens it the next time its version
+    is checked, or on `reload`.
+    """
+
+    def __init__(self, store_dir: str, index: str = "flat", nlist: Optional[int] = None, nprobe: int = 8):
+        """
+        Constructor of the class
+
+        Args:
+        store_dir (str): the directory of the chunk store written by the chunker
+        index (str): 'flat' for the exact brute-force search, 'ivf' for the approximate search
+            of the `nprobe` clusters closest to the query
+        nlist (Optional[int]): the number of clusters of the IVF index, the square root of the number of chunks if None
+        nprobe (int): the number of clusters searched by the IVF index
+        """
+        if index not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index '{index}', the indexes are flat and ivf")
+        self.store_dir = store_dir
+        self.index = index
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._reload_lock = threading.Lock()
+
+        self._signature = self._get_signature()
+        self.vectors = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode='r')
+        num_rows = self.vectors.shape[0]
+
+        # Rows appended later with the same id replace the previous ones, as in Qdrant
+        rows_by_id: Dict[Any, int] = {}
+        self.ids: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+        with open(os.path.join(store_dir, PAYLOADS_FILE), 'r', encoding='utf-8') as payloads_file:
+            for row, line in enumerate(payloads_file):
+                if row >= num_rows:
+                    break
+                record = json.loads(line)
+                rows_by_id[record['id']] = row
+                self.ids.append(record['id'])
+                self.payloads.append(record['payload'])
+        self.rows = np.array(sorted(rows_by_id.values()), dtype=np.int64)
+
+        # Norms of the vectors, for the cosine similarity
+        self.norms = np.ones(num_rows, dtype=np.float32)
+        for start in range(0, num_rows, 65536):
+            block = np.asarray(self.vectors[start:start + 65536], dtype=np.float32)
+            self.norms[start:start + len(block)] = np.linalg.norm(block, axis=1)
+        self.norms[self.norms == 0] = 1.0
+
+        # Rows of each value of the filterable payload fields
+        self.field_rows: Dict[str, Dict[Any, np.ndarray]] = {}
+        for field in FILTERABLE_FIELDS:
+            values_rows: Dict[Any, List[int]] = {}
+            for row in self.rows:
+                value = self.payloads[row].get(field)
+                if value is not None:
+                    values_rows.setdefault(value, []).append(row)
+            self.field_rows[field] = {value: np.array(rows, dtype=np.int64) for value, rows in values_rows.items()}
+
+        self.ivf_centroids = None
+        self.ivf_lists: List[np.ndarray] = []
+        if index == "ivf":
+            self._build_ivf(nlist or max(int(math.sqrt(len(self.rows))), 1))
+
+        # The inverted index of the keyword search is built on first use
+        self.postings: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None
+
+    def _get_signature(self) -> str:
+        """
+        Method to get the size and the modification time of the files of the store, which the
+        chunker changes when it rewrites the store
+        """
+        stats = [os.stat(os.path.join(self.store_dir, name)) for name in (VECTORS_FILE, PAYLOADS_FILE)]
+        return ":".join(f"{stat.st_size}-{stat.st_mtime_ns}" for stat in stats)
+
+    def reload(self) -> None:
+        """
+        Method to reopen the store, with its payloads and its indexes. The new store is loaded
+        before replacing the current one, which keeps serving the searches in the meantime.
+        """
+        with self._reload_lock:
+            reloaded = NumpyBackend(self.store_dir, self.index, self.nlist, self.nprobe)
+            state = dict(reloaded.__dict__)
+            state.pop('_reload_lock')
+            # A single dict update, so other threads see either the old or the new store
+            self.__dict__.update(state)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _build_ivf(self, nlist: int, iterations: int = 10, sample_size: int = 100000) -> None:
+        """
+        Method to cluster the vectors with k-means and to assign every row to its closest centroid
+        """
+        rng = np.random.default_rng(0)
+        nlist = min(nlist, len(self.rows))
+        sample_rows = np.sort(rng.choice(self.rows, size=min(sample_size, len(self.rows)), replace=False))
+        sample = np.asarray(self.vectors[sample_rows], dtype=np.float32) / self.norms[sample_rows, None]
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[assignments == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assignments = np.empty(len(self.rows), dtype=np.int64)
+        for start in range(0, len(self.rows), 65536):
+            rows = self.rows[start:start + 65536]
+            block = np.asarray(self.vectors[rows], dtype=np.float32)
+            assignments[start:start + len(rows)] = np.argmax(block @ centroids.T, axis=1)
+        self.ivf_centroids = centroids
+        self.ivf_lists = [self.rows[assignments == cluster] for cluster in range(nlist)]
+
+    def _filter_rows(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Method to get the rows matching the filters, None if there is nothing to filter
+        """
+        if not filters:
+            return None
+        rows = None
+        for field, value in filters.items():
+            if field not in FILTERABLE_FIELDS:
+                raise ValueError(f"Cannot filter on '{field}', the filterable fields are {', '.join(FILTERABLE_FIELDS)}")
+            if value is None:
+                continue
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            field_rows = [self.field_rows[field].get(item, np.empty(0, dtype=np.int64)) for item in accepted]
+            matching = np.unique(np.concatenate(field_rows)) if field_rows else np.empty(0, dtype=np.int64)
+            rows = matching if rows is None else np.intersect1d(rows, matching, assume_unique=True)
+        return rows
+
+    def _top(self, rows: np.ndarray, scores: np.ndarray, limit: int, score_threshold: Optional[float] = None) -> List[Hit]:
+        if score_threshold is not None:
+            keep = scores >= score_threshold
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(self.ids[row], float(scores[index]), self.payloads[row]) for index, row in ((i, rows[i]) for i in order)]
+
+    def dense_search(self, query_vector, limit, filters=None, score_threshold=None) -> List[Hit]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        rows = self.rows
+        if self.ivf_centroids is not None:
+            clusters = np.argsort(-(self.ivf_centroids @ query))[:self.nprobe]
+            rows = np.sort(np.concatenate([self.ivf_lists[cluster] for cluster in clusters]))
+        filter_rows = self._filter_rows(filters)
+        if filter_rows is not None:
+            rows = np.intersect1d(rows, filter_rows, assume_unique=True)
+        if not len(rows):
+            return []
+
+        if len(rows) == self.vectors.shape[0]:
+            scores = (np.asarray(self.vectors) @ query) / self.norms
+        else:
+            scores = (np.asarray(self.vectors[rows], dtype=np.float32) @ query) / self.norms[rows]
+        return self._top(rows, scores, limit, score_threshold)
+
+    def _build_postings(self) -> None:
+        """
+        Method to build the inverted index of the keyword search, weighting the terms with the
+        IDF in the same way as Qdrant
+        """
+        term_rows: Dict[int, List[int]] = {}
+        term_values: Dict[int, List[float]] = {}
+        for row in self.rows:
+            indices, values = encode_document(self.payloads[row].get('content', ''))
+            for index, value in zip(indices, values):
+                term_rows.setdefault(index, []).append(row)
+                term_values.setdefault(index, []).append(value)
+
+        num_rows = len(self.rows)
+        postings = {}
+        for index, rows in term_rows.items():
+            idf = math.log((num_rows - len(rows) + 0.5) / (len(rows) + 0.5) + 1.0)
+            postings[index] = (np.array(rows, dtype=np.int64), np.array(term_values[index], dtype=np.float32) * idf)
+        self.postings = postings
+
+    def sparse_search(self, indices, values, limit, filters=None) -> List[Hit]:
+        if self.postings is None:
+            self._build_postings()
+
+        scores = np.zeros(self.vectors.shape[0], dtype=np.float32)
+        for index, value in zip(indices, values):
+            if index in self.postings:
+                rows, weights = self.postings[index]
+                scores[rows] += value * weights
+
+        rows = np.flatnonzero(scores)
+        filter_rows = self._filter_rows(filters)
+        if filter_rows is not None:
+            rows = np.intersect1d(rows, filter_rows, assume_unique=True)
+        return self._top(rows, scores[rows], limit)
+
+    def get_version(self) -> str:
+        if self._get_signature() != self._signature:
+            try:
+                self.reload()
+            except Exception as e:
+                # e.g. a store being written, the reload is retried on the next check
+                print(f"Warning: Failed to reload the chunk store '{self.store_dir}': {e}")
+        return f"{os.path.abspath(self.store_dir)}:{self.vectors.shape[0]}:{self._signature}"
@@ -0,0 +1,204 @@
+"""
+Contains the web search used by WikiRag to expand the context.
+
+The search is run by a pluggable backend (DuckDuckGo by default, any object with a
+`search(query) -> str` method can be used, e.g. a local stub in tests) and wrapped by
+`WebSearcher`, which:
+
+- caches the results by query, with TTL and LRU eviction;
+- shares a single request between concurrent identical queries;
+- gives up after a latency budget, so that the answer is generated from the KB only.
+  A search that completes after the budget is still cached for the next queries.
+"""
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, Optional, Tuple
+
+
+class WebSearchBackend():
+    """
+    Interface of the web search backends.
+    """
+
+    def search(self, query: str) -> str:
+        """
+        Method to search the web
+
+        Args:
+        query (str): the query to search
+
+        Returns:
+            str: the text of the results.
+        """
+        raise NotImplementedError
+
+
+class DuckDuckGoBackend(WebSearchBackend):
+    """
+    A class used to search the web with DuckDuckGo.
+    """
+
+    def __init__(self, region: str = "it-it"):
+        """
+        Constructor of the class
+
+        Args:
+        region (str): the region of the results
+        """
+        self.region = region
+        self._tool = None
+        self._lock = threading.Lock()
+
+    def search(self, query: str) -> str:
+        # The tool is created on first use, since it checks that the search client is installed
+        with self._lock:
+            if self._tool is None:
+                from langchain_community.tools import DuckDuckGoSearchRun
+                from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+
+                self._tool = DuckDuckGoSearchRun(api_wrapper=DuckDuckGoSearchAPIWrapper(region=self.region))
+        return self._tool.invoke(query)
+
+
+class WebSearcher():
+    """
+    A class used to run cached and time-bounded web searches.
+    """
+
+    def __init__(
+            self,
+            backend: Optional[WebSearchBackend] = None,
+            timeout: Optional[float] = 3.0,
+            cache_size: int = 256,
+            ttl: Optional[float] = 3600,
+            workers: int = 8,
+            verbose: bool = False):
+        """
+        Constructor of the class
+
+        Args:
+        backend (Optional[WebSearchBackend]): the search backend, DuckDuckGo if None
+        timeout (Optional[float]): the latency budget of a search in seconds, None waits for the results
+        cache_size (int): the maximum number of cached results, the least recently used are evicted
+        ttl (Optional[float]): the number of seconds a result stays valid, None keeps the results forever
+        workers (int): the maximum number of searches running at the same time
+        verbose (bool): if True, searches that fail or exceed the budget are logged
+        """
+        self.backend = backend if backend is not None else DuckDuckGoBackend()
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        # Searches joining an identical one already running
+        self.shared = 0
+        self.timeouts = 0
+
+        self._cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="web-search")
+
+    def _get_cached(self, query: str) -> Optional[str]:
+        entry = self._cache.get(query)
+        if entry is None:
+            return None
+        created, result = entry
+        if self.ttl is not None and time.time() - created > self.ttl:
+            del self._cache[query]
+            return None
+        self._cache.move_to_end(query)
+        return result
+
+    def _run(self, query: str) -> str:
+        try:
+            result = self.backend.search(query)
+        except Exception as e:
+            if self.verbose:
+                print(f"Warning: Web search failed for '{query}': {e}")
+            result = None
+
+        with self._lock:
+            self._in_flight.pop(query, None)
+            if result is not None:
+                self._cache[query] = (time.time(), result)
+                self._cache.move_to_end(query)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result or ""
+
+    def submit(self, query: str) -> Future:
+        """
+        Method to start a search, or to join the one already running for the same query
+
+        Args:
+        query (str): the query to search
+
+        Returns:
+            Future: the future of the text of the results.
+        """
+        with self._lock:
+            cached = self._get_cached(query)
+            if cached is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(cached)
+                return future
+
+            future = self._in_flight.get(query)
+            if future is not None:
+                self.shared += 1
+                return future
+
+            self.misses += 1
+            future = self._executor.submit(self._run, query)
+            self._in_flight[query] = future
+            return future
+
+    def _on_timeout(self, query: str) -> str:
+        self.timeouts += 1
+        if self.verbose:
+            print(f"Warning: Web search for '{query}' exceeded {self.timeout}s, continuing without web context")
+        return ""
+
+    def search(self, query: str) -> str:
+        """
+        Method to search the web within the latency budget
+
+        Args:
+        query (str): the query to search
+
+        Returns:
+            str: the text of the results, empty if the search failed or exceeded the budget.
+        """
+        try:
+            return self.submit(query).result(timeout=self.timeout)
+        except TimeoutError:
+            return self._on_timeout(query)
+
+    async def asearch(self, query: str) -> str:
+        """
+        Method to search the web asynchronously within the latency budget
+
+        Args:
+        query (str): the query to search
+
+        Returns:
+            str: the text of the results, empty if the search failed or exceeded the budget.
+        """
+        future = asyncio.wrap_future(self.submit(query))
+        try:
+            # Shield the search, so that it completes and is cached even after the timeout
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return self._on_timeout(query)
+
+    def close(self) -> None:
+        """
+        Method to stop the search threads
+        """
+        self._executor.shutdown(wait=False)
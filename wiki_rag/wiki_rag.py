@@ -1,39 +1,49 @@
 """
 Contani the main class for the WikiRag 
 """
-import os
-import json
+import time
+import asyncio
+import threading
 from operator import itemgetter
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 # custom imports
 from wiki_rag.prompts import ANSWER_QUESTION_TEMPLATE_IT, ANSWER_QUESTION_TEMPLATE_EN
+from wiki_rag.answer_cache import AnswerCache
+from wiki_rag.web_search import WebSearcher, WebSearchBackend, DuckDuckGoBackend
+from wiki_rag.context import ContextPacker
+from wiki_rag.sparse import encode_query
+from wiki_rag.vector_stores import VectorStoreBackend, QdrantBackend
+from wiki_rag.reranker import CrossEncoderReranker
+from wiki_rag.embeddings import EmbeddingService
+from wiki_rag.tracing import Trace, MetricsExporter
+from wiki_rag.startup import STARTUP, lazy_import
 
 # langchain imports
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_qdrant import QdrantVectorStore
-from langchain_core.vectorstores import VectorStore
+from langchain_core.documents import Document
 from langchain_core.runnables import (    
     Runnable,
     RunnableLambda,
-    RunnablePassthrough,
     RunnableParallel,
 )
 
-from langchain_ollama import ChatOllama
-from langchain_huggingface import HuggingFaceEmbeddings
+# The Ollama and Qdrant integrations are imported when the LLM and the client are first used
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import SearchParams
 
-# web search
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
-
-# qdrant
-from qdrant_client import QdrantClient
+DEFAULT_MODEL = "llama3.1"
 
 MODELS_CONTEXT_WINDOWS = {
     "llama3.1": 2000,
 }
 
+RETRIEVAL_MODES = ("dense", "sparse", "hybrid")
+
 class WikiRag():
     """
     A class used to allow the users to make a conversation leveraging as KB the wikipedia articles.
@@ -41,119 +51,783 @@ class WikiRag():
 
     def __init__(
             self, 
-            qdrant_url: str, 
-            qdrant_collection_name: str,
+            qdrant_url: Optional[str] = None, 
+            qdrant_collection_name: Optional[str] = None,
             expand_context: bool = True,
-            verbose: bool = False):
+            verbose: bool = False,
+            hnsw_ef: Optional[int] = None,
+            rescore: bool = True,
+            oversampling: float = 2.0,
+            top_k: int = 4,
+            score_threshold: float = 0.5,
+            answer_cache: Optional[AnswerCache] = None,
+            cache_version_check_interval: float = 60.0,
+            web_search_backend: Optional[WebSearchBackend] = None,
+            web_search_timeout: Optional[float] = 3.0,
+            web_search_cache_size: int = 256,
+            web_search_ttl: Optional[float] = 3600,
+            answer_tokens: int = 512,
+            retrieval_mode: str = "dense",
+            hybrid_candidates: int = 20,
+            reranker: Optional[CrossEncoderReranker] = None,
+            rerank_candidates: int = 20,
+            qdrant_path: Optional[str] = None,
+            backend: Optional[VectorStoreBackend] = None,
+            embeddings: Optional[EmbeddingService] = None,
+            metrics_exporter: Optional[MetricsExporter] = None,
+            llm: Optional["BaseChatModel"] = None,
+            background_warm_up: bool = False):
         """
-        Constructor of the class
+        Constructor of the class. The LLM, the Qdrant client and the embedding model are
+        created on first use, or by `warm_up`.
 
         Args:
-        qdrant_url (str): the url of the qdrant server
-        qdrant_collection_name (str): the name of the collection in the qdrant server
+        qdrant_url (Optional[str]): the url of the qdrant server
+        qdrant_collection_name (Optional[str]): the name of the collection in the qdrant server
         verbose (bool): if True, the class will print all the logs
         expand_context (bool): if True, the class will search on the web to expand the context
+        hnsw_ef (Optional[int]): the size of the HNSW candidate list at search time, None keeps the collection default
+        rescore (bool): if True, on quantized collections the candidates are rescored with the original vectors
+        oversampling (float): on quantized collections, the factor of extra candidates fetched before rescoring
+        top_k (int): the number of chunks retrieved for each query
+        score_threshold (float): the minimum similarity of the retrieved chunks
+        answer_cache (Optional[AnswerCache]): the cache of the answers to repeated and similar questions, None disables it
+        cache_version_check_interval (float): the number of seconds between two checks that the collection was not reloaded
+        web_search_backend (Optional[WebSearchBackend]): the backend of the web search, DuckDuckGo if None
+        web_search_timeout (Optional[float]): the latency budget of the web search in seconds, after which the answer is generated from the KB only
+        web_search_cache_size (int): the maximum number of cached web search results
+        web_search_ttl (Optional[float]): the number of seconds a web search result stays cached
+        answer_tokens (int): the number of tokens of the context window kept free for the answer
+        retrieval_mode (str): 'dense' for the embedding search, 'sparse' for the keyword search or
+            'hybrid' to fuse the two with reciprocal rank fusion; 'sparse' and 'hybrid' need a
+            collection loaded with sparse vectors (`qdrant_loader.py --sparse`)
+        hybrid_candidates (int): the number of candidates of each search fused by the hybrid retrieval
+        reranker (Optional[CrossEncoderReranker]): the cross-encoder reranking the candidates, None disables the reranking
+        rerank_candidates (int): the number of candidates retrieved and reranked, of which the best `top_k` are kept
+        qdrant_path (Optional[str]): the path of a local on-disk Qdrant database, used instead of the qdrant server
+        backend (Optional[VectorStoreBackend]): the vector store searched by the retrieval, e.g. a `NumpyBackend`
+            over a chunk store; if None, the qdrant collection is searched
+        embeddings (Optional[EmbeddingService]): the service embedding the queries, e.g. with an ONNX model;
+            if None, the torch 'all-MiniLM-L6-v2' model, the one used by the vectorization pipeline
+        metrics_exporter (Optional[MetricsExporter]): the exporter of the traces of the requests, e.g. a
+            `PrometheusExporter`; with `verbose`, the traces are also printed
+        llm (Optional[BaseChatModel]): the chat model answering the questions, e.g. a stub in the benchmarks;
+            if None, 'llama3.1' served by Ollama
+        background_warm_up (bool): if True, the clients and the models are created in a background
+            thread, so that the first request doesn't pay for them
         """
         # Instantiate class attributes
         self.verbose = verbose
+        self.metrics_exporter = metrics_exporter
         self.expand_context = expand_context
+        self.qdrant_collection_name = qdrant_collection_name
+        self.top_k = top_k
+        self.score_threshold = score_threshold
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', the modes are {', '.join(RETRIEVAL_MODES)}")
+        self.retrieval_mode = retrieval_mode
+        self.hybrid_candidates = hybrid_candidates
+        self.reranker = reranker
+        # With a reranker, more candidates are retrieved than the ones sent to the LLM
+        self.retrieval_limit = max(rerank_candidates, top_k) if reranker is not None else top_k
+
+        self.model_name = DEFAULT_MODEL if llm is None else getattr(llm, "model", "")
+        self._llm = llm
 
-        self.chat_ollama = ChatOllama(
-            model="llama3.1",
-            temperature=0.3,
+        # The query embeddings are cached, repeated questions are not embedded again
+        self.embeddings = embeddings if embeddings is not None else EmbeddingService()
+
+        self.qdrant_url = qdrant_url
+        self.qdrant_path = qdrant_path
+        self.hnsw_ef = hnsw_ef
+        self.rescore = rescore
+        self.oversampling = oversampling
+        self._search_params = None
+        self._backend = backend
+        self._vector_store = None
+        # Guards the creation of the LLM, the client and the vector store
+        self._lazy_lock = threading.RLock()
+
+        self.web_search = WebSearcher(
+            backend=web_search_backend if web_search_backend is not None else DuckDuckGoBackend(region="it-it"),
+            timeout=web_search_timeout,
+            cache_size=web_search_cache_size,
+            ttl=web_search_ttl,
+            verbose=verbose,
         )
 
-        self.huggingface_embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2"
+        # The retrieved context is packed within the context window of the model
+        self.prompt_template = PromptTemplate.from_template(ANSWER_QUESTION_TEMPLATE_IT)
+        self.context_packer = ContextPacker(
+            context_window=MODELS_CONTEXT_WINDOWS.get(self.get_model_name(), 2000),
+            answer_tokens=answer_tokens,
         )
 
-        qdrant_client = QdrantClient(url=qdrant_url)
+        # The chains are built once for all the queries
+        self.retrieval_chain = self.build_retrieval_chain()
+        self.answer_chain = self.build_answer_chain()
+        self.chain = self.retrieval_chain | self.answer_chain
+        # Same as the chain, but also returns the retrieved chunks, which are cached with the answer
+        self.answer_with_sources_chain = self.retrieval_chain | RunnableParallel(
+            answer=self.answer_chain,
+            sources=itemgetter("sources"),
+        )
 
-        # Check the qudrant collection exists
-        try:
-            if qdrant_client.collection_exists(qdrant_collection_name):
-                collection_status = qdrant_client.get_collection(qdrant_collection_name)
-                if not collection_status.status in ["green"]:
-                    raise Exception(f"Collection {qdrant_collection_name} is not in a good status: {collection_status.status}")
-            else:
-                raise Exception(f"Collection {qdrant_collection_name} does not exist")
-            
-        except Exception as e:
-            raise(f"Error: {e}")
-        
+        # The answers of a previous version of the collection are dropped by the first lookup
+        self.answer_cache = answer_cache
+        self.cache_version_check_interval = cache_version_check_interval
+        self.cache_version_checked_at = 0.0
 
-        self.vector_store = QdrantVectorStore(
-            client=qdrant_client,
-            collection_name=qdrant_collection_name,
-            embedding=self.huggingface_embeddings,
-        )
+        if background_warm_up:
+            self.warm_up(background=True)
+
+    @property
+    def chat_ollama(self) -> "BaseChatModel":
+        """
+        The LLM answering the questions, created on first use
+        """
+        if self._llm is None:
+            with self._lazy_lock:
+                if self._llm is None:
+                    with STARTUP.measure("WikiRag llm"):
+                        chat_ollama_class = lazy_import("langchain_ollama").ChatOllama
+                        self._llm = chat_ollama_class(model=DEFAULT_MODEL, temperature=0.3)
+        return self._llm
+
+    @property
+    def search_params(self) -> "SearchParams":
+        """
+        The params of the dense search in Qdrant
+        """
+        if self._search_params is None:
+            models = lazy_import("qdrant_client.models")
+            # The quantization params are ignored by collections without quantization
+            self._search_params = models.SearchParams(
+                hnsw_ef=self.hnsw_ef,
+                quantization=models.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling),
+            )
+        return self._search_params
 
-        self.retriver = self.vector_store.as_retriever(
-            search_kwargs={"k": 4,
-                           "score_threshold": 0.5}
+    @property
+    def backend(self) -> VectorStoreBackend:
+        """
+        The vector store searched by the retrieval, the qdrant collection is connected on first use
+        """
+        if self._backend is None:
+            with self._lazy_lock:
+                if self._backend is None:
+                    with STARTUP.measure("WikiRag backend"):
+                        qdrant_client_class = lazy_import("qdrant_client").QdrantClient
+                        # The local mode of the client reads an on-disk database without a server
+                        qdrant_client = qdrant_client_class(path=self.qdrant_path) if self.qdrant_path else qdrant_client_class(url=self.qdrant_url)
+                        self._backend = QdrantBackend(qdrant_client, self.qdrant_collection_name, self.search_params)
+        return self._backend
+
+    @property
+    def qdrant_client(self) -> Optional["QdrantClient"]:
+        """
+        The Qdrant client, None if the backend is not a Qdrant collection
+        """
+        return getattr(self.backend, "qdrant_client", None)
+
+    @property
+    def vector_store(self) -> Optional["VectorStore"]:
+        """
+        The langchain vector store of the qdrant collection, None if the backend is not a Qdrant collection
+        """
+        if self._vector_store is None and self.qdrant_client is not None:
+            with self._lazy_lock:
+                if self._vector_store is None:
+                    # The chunks store their text in the 'content' payload field
+                    self._vector_store = lazy_import("langchain_qdrant").QdrantVectorStore(
+                        client=self.qdrant_client,
+                        collection_name=self.qdrant_collection_name,
+                        embedding=self.embeddings,
+                        content_payload_key="content",
+                    )
+        return self._vector_store
+
+    @property
+    def retriver(self) -> Optional["VectorStoreRetriever"]:
+        """
+        The langchain retriever of the qdrant collection, None if the backend is not a Qdrant collection
+        """
+        if self.vector_store is None:
+            return None
+        return self.vector_store.as_retriever(
+            search_kwargs={"k": self.top_k,
+                           "score_threshold": self.score_threshold,
+                           "search_params": self.search_params}
         )
 
+    def warm_up(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Method to create the clients and load the models before the first request: the
+        vector store backend, the embedding model, the LLM and the reranker
+
+        Args:
+        background (bool): if True, the warm-up runs in a daemon thread and its errors are
+            printed, the first request then creates what failed
+
+        Returns:
+            Optional[threading.Thread]: the thread of the warm-up, None if it already completed.
+        """
+        if background:
+            thread = threading.Thread(target=self._background_warm_up, name="wiki-rag-warm-up", daemon=True)
+            thread.start()
+            return thread
+
+        with STARTUP.measure("WikiRag warm-up"):
+            self.backend
+            self.embeddings.embed_documents(["warm-up"])
+            self.chat_ollama
+            if self.reranker is not None:
+                self.reranker.model
+            self.check_cache_version(force=True)
+        if self.verbose:
+            print(STARTUP.summary())
+        return None
+
+    def _background_warm_up(self) -> None:
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(f"Warning: The warm-up failed: {e}")
+
+    def close(self) -> None:
+        """
+        Method to stop the threads of the web search
+        """
+        self.web_search.close()
+
     def get_model_name(self) -> str:
         """
         Method to get the model name
         """
-        return self.chat_ollama.model
+        return self.model_name
+
+    def retrieve(
+            self,
+            query: str,
+            filters: Optional[Dict[str, Any]] = None,
+            query_vector: Optional[List[float]] = None,
+            trace: Optional[Trace] = None) -> List[Document]:
+        """
+        Method to retrieve the chunks most similar to the query, according to the retrieval mode.
+        The filters are pushed down into the search, which in Qdrant uses the payload indexes created by the loader.
 
-    def web_context_expansion(self, query: str) -> str:
+        Args:
+        query (str): the query to search
+        filters (Optional[Dict[str, Any]]): the accepted value, or list of values, of the
+            'language', 'title' and 'url' payload fields, e.g. {"language": "it", "title": ["Roma"]}
+        query_vector (Optional[List[float]]): the embedding of the query, computed if None
+        trace (Optional[Trace]): the trace of the request, recording the stages and the retrieved chunks
+
+        Returns:
+            List[Document]: the chunks, with the other payload fields and the score as metadata;
+            in hybrid mode the score is the reciprocal rank fusion score, with a reranker the cross-encoder score.
+        """
+        trace = trace if trace is not None else Trace(query)
+        indices, values = encode_query(query) if self.retrieval_mode != "dense" else ([], [])
+        if query_vector is None and (self.retrieval_mode != "sparse" or not indices):
+            with trace.span("embedding"):
+                query_vector = self.embeddings.embed_query(query)
+
+        with trace.span("retrieval"):
+            if self.retrieval_mode == "sparse" and indices:
+                hits = self.backend.sparse_search(indices, values, self.retrieval_limit, filters)
+            elif self.retrieval_mode == "hybrid" and indices:
+                hits = self.backend.hybrid_search(
+                    query_vector, indices, values, self.retrieval_limit, self.hybrid_candidates, filters, self.score_threshold
+                )
+            else:
+                # Dense search, also used when the query has no keywords
+                hits = self.backend.dense_search(query_vector, self.retrieval_limit, filters, self.score_threshold)
+
+        documents = []
+        for point_id, score, payload in hits:
+            metadata = {key: value for key, value in payload.items() if key != "content"}
+            metadata["_id"] = point_id
+            metadata["score"] = score
+            documents.append(Document(page_content=payload.get("content", ""), metadata=metadata))
+
+        if self.reranker is not None:
+            with trace.span("rerank"):
+                documents = self.reranker.rerank(query, documents, self.top_k)
+        trace.set(chunks_retrieved=len(documents), scores=[document.metadata["score"] for document in documents])
+        return documents
+
+    def web_context_expansion(self, query: str, trace: Optional[Trace] = None) -> str:
         """
         Method to search infromation on the web to expand the context, 
         hopefully getting a better answer
 
         Args:
         query (str): the query to search
+        trace (Optional[Trace]): the trace of the request
         """
         # check if the slef.expand_context is True
         if not self.expand_context:
             return ""
         else:
-            wrapper = DuckDuckGoSearchAPIWrapper(region="it-it")
+            # Run the search, within the latency budget
+            with (trace or Trace(query)).span("web_search"):
+                return self.web_search.search(query)
 
-            search = DuckDuckGoSearchRun(api_wrapper=wrapper)
+    async def aweb_context_expansion(self, query: str, trace: Optional[Trace] = None) -> str:
+        """
+        Method to search infromation on the web to expand the context, asynchronously
+
+        Args:
+        query (str): the query to search
+        trace (Optional[Trace]): the trace of the request
+        """
+        if not self.expand_context:
+            return ""
+        with (trace or Trace(query)).span("web_search"):
+            return await self.web_search.asearch(query)
 
-            # Run the search
-            return search.invoke(query)
-    
     
-    def build_chain(self) -> Runnable:
+    def pack_context(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Method to build the chain of the conversation
+        Method to pack the retrieved chunks and the web results within the context window of the model
+
+        Args:
+        inputs (Dict[str, Any]): the 'query', the retrieved 'context', the 'web_context' and the 'trace' of the request
+
+        Returns:
+            Dict[str, Any]: the 'query', the packed 'context' and 'web_context', the 'sources' kept
+            in the context and the 'context_report' with the number of tokens used.
         """
-        token_limit = 2000
+        trace = inputs.get("trace") or Trace(inputs["query"])
+        with trace.span("context_packing"):
+            prompt_tokens = self.context_packer.token_counter(
+                self.prompt_template.format(context="", web_context="", query=inputs["query"])
+            )
+            packed = self.context_packer.pack(inputs["context"], inputs["web_context"], prompt_tokens)
+        report = packed["report"]
+        trace.set(chunks_used=report["chunks_used"], prompt_tokens=report["total_tokens"], web_context_tokens=report["web_context_tokens"])
+        if self.verbose:
+            print(f"Context: {report['total_tokens']}/{report['context_window'] - self.context_packer.answer_tokens} tokens, "
+                  f"{report['chunks_used']}/{report['chunks_retrieved']} chunks, {report['web_context_tokens']} web tokens")
+        return {
+            "query": inputs["query"],
+            "context": packed["context"],
+            "web_context": packed["web_context"],
+            "sources": packed["sources"],
+            "context_report": packed["report"],
+        }
 
-        # Create the chain
+    def build_retrieval_chain(self) -> Runnable:
+        """
+        Method to build the chain retrieving the context of the conversation
+        """
+        # Chain Goal: retrive k documents from the retriever, while searching the web
+        # keys= ["query"]
+        return RunnableParallel(
+            # retrive the web_context from the web
+            web_context = (
+                RunnableLambda(
+                    lambda x: self.web_context_expansion(x["query"], x.get("trace")),
+                    afunc=lambda x: self.aweb_context_expansion(x["query"], x.get("trace")),
+                )
+            ),
+            # retrive the context, applying the metadata filters
+            context = (
+                RunnableLambda(lambda x: self.retrieve(x["query"], x.get("filters"), x.get("query_vector"), x.get("trace")))
+            ),
+            query = itemgetter("query"),
+            trace = RunnableLambda(lambda x: x.get("trace"))
+        ) | RunnableLambda(self.pack_context)
+
+    def build_answer_chain(self) -> Runnable:
+        """
+        Method to build the chain answering the question from the retrieved context
+        """
+        # Chain Goal: answer the question
+        # keys= ["web_context", "context", "query"]
+        # The LLM is looked up at each call, so that it is created on first use
         return (
-            # Chain Goal: retrive k documents from the retriever
-            # keys= ["query"]
-            RunnableParallel(
-                # retrive the web_context from the web
-                web_context = (
-                    RunnableLambda(lambda x: self.web_context_expansion(x["query"]))
-                ),
-                # retrive the context
-                context = (
-                    itemgetter("query")
-                    | self.retriver
-                ),
-                query = itemgetter("query")
-            )
-            # Chain Goal: answer the question
-            | PromptTemplate.from_template(ANSWER_QUESTION_TEMPLATE_IT)
-            | self.chat_ollama
+            self.prompt_template
+            | RunnableLambda(lambda prompt: self.chat_ollama, name="llm")
             | StrOutputParser()
-    )
+        )
+
+    def build_chain(self) -> Runnable:
+        """
+        Method to build the chain of the conversation. The chain is built once by the
+        constructor and stored in `self.chain`.
+        """
+        return self.build_retrieval_chain() | self.build_answer_chain()
 
-    def invoke(self, query: str) -> str:
+    def get_collection_version(self) -> str:
+        """
+        Method to get a fingerprint of the content of the collection, which changes when the
+        collection is reloaded or refreshed. Qdrant collections are versioned by the loader and
+        the refresh of the vectorization pipeline; changes made by other tools are only detected
+        if they change the number of points. Chunk stores are versioned by the size and the
+        modification time of their files.
+        """
+        return self.backend.get_version()
+
+    def check_cache_version(self, force: bool = False) -> None:
+        """
+        Method to drop the cached answers if the collection was reloaded. The collection
+        is checked at most once every `cache_version_check_interval` seconds.
+
+        Args:
+        force (bool): if True, the collection is checked immediately
+        """
+        if self.answer_cache is None:
+            return
+        now = time.monotonic()
+        if force or now - self.cache_version_checked_at >= self.cache_version_check_interval:
+            self.cache_version_checked_at = now
+            self.answer_cache.set_version(self.get_collection_version())
+
+    def lookup_answer(self, query: str, filters: Optional[Dict[str, Any]] = None, trace: Optional[Trace] = None) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """
+        Method to look up the answer of a question in the answer cache, first by its text and then
+        by the similarity of its embedding
+
+        Args:
+        query (str): the query to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval
+        trace (Optional[Trace]): the trace of the request
+
+        Returns:
+            Tuple[Optional[Dict[str, Any]], Optional[List[float]]]: the cached answer, None on a miss,
+            and the embedding of the query, if it was computed.
+        """
+        if self.answer_cache is None:
+            return None, None
+        trace = trace if trace is not None else Trace(query)
+        with trace.span("cache_lookup"):
+            self.check_cache_version()
+            cached = self.answer_cache.get_exact(query, filters)
+        if cached is not None:
+            trace.set(cached="exact")
+            return cached, None
+        with trace.span("embedding"):
+            query_vector = self.embeddings.embed_query(query)
+        with trace.span("cache_lookup"):
+            cached = self.answer_cache.get_similar(query_vector, filters)
+        if cached is not None:
+            trace.set(cached="similar")
+        return cached, query_vector
+
+    def cache_answer(
+            self,
+            query: str,
+            filters: Optional[Dict[str, Any]],
+            query_vector: Optional[List[float]],
+            answer: str,
+            sources: List[Document],
+            trace: Optional[Trace] = None) -> None:
+        """
+        Method to store an answer in the answer cache
+
+        Args:
+        query (str): the query asked to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval
+        query_vector (Optional[List[float]]): the embedding of the query, computed if None
+        answer (str): the answer of the model
+        sources (List[Document]): the chunks the answer was generated from
+        trace (Optional[Trace]): the trace of the request
+        """
+        if self.answer_cache is None:
+            return
+        trace = trace if trace is not None else Trace(query)
+        if query_vector is None:
+            with trace.span("embedding"):
+                query_vector = self.embeddings.embed_query(query)
+        with trace.span("cache_store"):
+            self.answer_cache.put(query, filters, query_vector, answer, sources)
+
+    def invalidate_cache(self) -> None:
+        """
+        Method to drop all the cached answers, e.g. after the collection was reloaded
+        """
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate()
+
+    def finish_trace(self, trace: Trace) -> None:
+        """
+        Method to complete the trace of a request and send it to the exporter
+
+        Args:
+        trace (Trace): the trace of the request
+        """
+        trace.finish()
+        if self.verbose:
+            print(trace.summary())
+        if self.metrics_exporter is not None:
+            try:
+                self.metrics_exporter.export(trace)
+            except Exception as e:
+                # The metrics must never fail a request
+                print(f"Warning: Failed to export the trace: {e}")
+
+    def invoke(self, query: str, filters: Optional[Dict[str, Any]] = None, trace: Optional[Trace] = None) -> str:
         """
         Method to invoke the conversation
 
         Args:
         query (str): the query to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, e.g. {"language": "it"}
+        trace (Optional[Trace]): the trace filled with the stages of the request, a new one if None
         """
-        # Run the chain
-        return self.build_chain().invoke({"query": query})
+        trace = trace if trace is not None else Trace(query)
+        try:
+            cached, query_vector = self.lookup_answer(query, filters, trace)
+            if cached is not None:
+                return cached["answer"]
 
+            # Run the chain
+            result = self.answer_with_sources_chain.invoke(
+                {"query": query, "filters": filters, "query_vector": query_vector, "trace": trace},
+                config={"callbacks": [trace.callback()]},
+            )
+            self.cache_answer(query, filters, query_vector, result["answer"], result["sources"], trace)
+            return result["answer"]
+        finally:
+            self.finish_trace(trace)
+
+    def stream(self, query: str, filters: Optional[Dict[str, Any]] = None, trace: Optional[Trace] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Method to invoke the conversation, streaming the answer as it is generated.
+        The first item holds the retrieved sources, the next ones the tokens of the answer.
+
+        Args:
+        query (str): the query to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, e.g. {"language": "it"}
+        trace (Optional[Trace]): the trace filled with the stages of the request, a new one if None
+
+        Returns:
+            Iterator[Dict[str, Any]]: {"sources": List[Document], "context_report": Dict} first
+            (without the report when the answer is cached), then {"answer": str} for each token.
+        """
+        trace = trace if trace is not None else Trace(query)
+        try:
+            cached, query_vector = self.lookup_answer(query, filters, trace)
+            if cached is not None:
+                yield {"sources": [Document(**source) for source in cached["sources"]]}
+                yield {"answer": cached["answer"]}
+                return
+
+            context = self.retrieval_chain.invoke({"query": query, "filters": filters, "query_vector": query_vector, "trace": trace})
+            yield {"sources": context["sources"], "context_report": context["context_report"]}
+            tokens = []
+            for token in self.answer_chain.stream(context, config={"callbacks": [trace.callback()]}):
+                tokens.append(token)
+                yield {"answer": token}
+            self.cache_answer(query, filters, query_vector, "".join(tokens), context["sources"], trace)
+        finally:
+            self.finish_trace(trace)
+
+    async def astream(self, query: str, filters: Optional[Dict[str, Any]] = None, trace: Optional[Trace] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Method to invoke the conversation asynchronously, streaming the answer as it is generated.
+        The first item holds the retrieved sources, the next ones the tokens of the answer.
+
+        Args:
+        query (str): the query to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, e.g. {"language": "it"}
+        trace (Optional[Trace]): the trace filled with the stages of the request, a new one if None
+
+        Returns:
+            AsyncIterator[Dict[str, Any]]: {"sources": List[Document], "context_report": Dict} first
+            (without the report when the answer is cached), then {"answer": str} for each token.
+        """
+        trace = trace if trace is not None else Trace(query)
+        try:
+            loop = asyncio.get_running_loop()
+            cached, query_vector = await loop.run_in_executor(None, self.lookup_answer, query, filters, trace)
+            if cached is not None:
+                yield {"sources": [Document(**source) for source in cached["sources"]]}
+                yield {"answer": cached["answer"]}
+                return
+
+            context = await self.retrieval_chain.ainvoke({"query": query, "filters": filters, "query_vector": query_vector, "trace": trace})
+            yield {"sources": context["sources"], "context_report": context["context_report"]}
+            tokens = []
+            async for token in self.answer_chain.astream(context, config={"callbacks": [trace.callback()]}):
+                tokens.append(token)
+                yield {"answer": token}
+            await loop.run_in_executor(None, self.cache_answer, query, filters, query_vector, "".join(tokens), context["sources"], trace)
+        finally:
+            self.finish_trace(trace)
+
+    async def ainvoke(self, query: str, filters: Optional[Dict[str, Any]] = None, trace: Optional[Trace] = None) -> str:
+        """
+        Method to invoke the conversation asynchronously
+
+        Args:
+        query (str): the query to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, e.g. {"language": "it"}
+        trace (Optional[Trace]): the trace filled with the stages of the request, a new one if None
+        """
+        trace = trace if trace is not None else Trace(query)
+        try:
+            loop = asyncio.get_running_loop()
+            cached, query_vector = await loop.run_in_executor(None, self.lookup_answer, query, filters, trace)
+            if cached is not None:
+                return cached["answer"]
+
+            result = await self.answer_with_sources_chain.ainvoke(
+                {"query": query, "filters": filters, "query_vector": query_vector, "trace": trace},
+                config={"callbacks": [trace.callback()]},
+            )
+            await loop.run_in_executor(None, self.cache_answer, query, filters, query_vector, result["answer"], result["sources"], trace)
+            return result["answer"]
+        finally:
+            self.finish_trace(trace)
+
+    def build_batch_inputs(self, queries: List[str], filters: Optional[Dict[str, Any]] = None, traces: Optional[List[Trace]] = None) -> List[Dict[str, Any]]:
+        """
+        Method to build the inputs of the chain for many queries, embedding all the queries together
+
+        Args:
+        queries (List[str]): the queries to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, shared by all the queries
+        traces (Optional[List[Trace]]): the traces of the queries, new ones if None
+        """
+        traces = traces if traces is not None else [Trace(query) for query in queries]
+        start = time.perf_counter()
+        query_vectors = self.embeddings.embed_queries(queries) if queries else []
+        # The queries wait for the whole batch to be embedded
+        for trace in traces:
+            trace.add_stage("embedding", time.perf_counter() - start)
+        return [
+            {"query": query, "filters": filters, "query_vector": query_vector, "trace": trace}
+            for query, query_vector, trace in zip(queries, query_vectors, traces)
+        ]
+
+    def prepare_batch(
+            self,
+            queries: List[str],
+            filters: Optional[Dict[str, Any]] = None,
+            traces: Optional[List[Trace]] = None) -> Tuple[List[Optional[str]], List[int], List[Dict[str, Any]]]:
+        """
+        Method to answer from the answer cache as many queries as possible, and to build the
+        inputs of the chain for the other ones
+
+        Args:
+        queries (List[str]): the queries to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, shared by all the queries
+        traces (Optional[List[Trace]]): the traces of the queries, new ones if None
+
+        Returns:
+            Tuple[List[Optional[str]], List[int], List[Dict[str, Any]]]: the answers, None for the queries
+            not cached, the indexes of the queries not cached and their inputs.
+        """
+        traces = traces if traces is not None else [Trace(query) for query in queries]
+        answers: List[Optional[str]] = [None] * len(queries)
+        if self.answer_cache is not None:
+            self.check_cache_version()
+            for index, query in enumerate(queries):
+                with traces[index].span("cache_lookup"):
+                    cached = self.answer_cache.get_exact(query, filters)
+                if cached is not None:
+                    answers[index] = cached["answer"]
+                    traces[index].set(cached="exact")
+
+        pending = [index for index, answer in enumerate(answers) if answer is None]
+        inputs = self.build_batch_inputs([queries[index] for index in pending], filters, [traces[index] for index in pending])
+        if self.answer_cache is None:
+            return answers, pending, inputs
+
+        pending_indexes, pending_inputs = [], []
+        for index, chain_input in zip(pending, inputs):
+            with traces[index].span("cache_lookup"):
+                cached = self.answer_cache.get_similar(chain_input["query_vector"], filters)
+            if cached is not None:
+                answers[index] = cached["answer"]
+                traces[index].set(cached="similar")
+            else:
+                pending_indexes.append(index)
+                pending_inputs.append(chain_input)
+        return answers, pending_indexes, pending_inputs
+
+    def complete_batch(self, answers: List[Optional[str]], pending_indexes: List[int], pending_inputs: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> List[str]:
+        """
+        Method to merge the answers generated by the chain with the cached ones, caching the new answers
+
+        Args:
+        answers (List[Optional[str]]): the cached answers, None for the queries not cached
+        pending_indexes (List[int]): the indexes of the queries not cached
+        pending_inputs (List[Dict[str, Any]]): the inputs of the chain of the queries not cached
+        results (List[Dict[str, Any]]): the answers and the sources generated by the chain
+        """
+        for index, chain_input, result in zip(pending_indexes, pending_inputs, results):
+            answers[index] = result["answer"]
+            self.cache_answer(chain_input["query"], chain_input["filters"], chain_input["query_vector"], result["answer"], result["sources"], chain_input["trace"])
+        return answers
+
+    def batch_configs(self, pending_inputs: List[Dict[str, Any]], max_concurrency: int) -> List[Dict[str, Any]]:
+        """
+        Method to build the config of the chain for each query of a batch, recording the generation in its trace
+
+        Args:
+        pending_inputs (List[Dict[str, Any]]): the inputs of the chain
+        max_concurrency (int): the maximum number of queries processed at the same time
+        """
+        return [
+            {"max_concurrency": max_concurrency, "callbacks": [chain_input["trace"].callback()]}
+            for chain_input in pending_inputs
+        ]
+
+    def batch(
+            self,
+            queries: List[str],
+            filters: Optional[Dict[str, Any]] = None,
+            max_concurrency: int = 8) -> List[str]:
+        """
+        Method to answer many queries concurrently. The retrieval, the web search and the
+        LLM calls of different queries overlap, up to `max_concurrency` queries at a time.
+
+        Args:
+        queries (List[str]): the queries to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, shared by all the queries
+        max_concurrency (int): the maximum number of queries processed at the same time
+
+        Returns:
+            List[str]: the answers, in the same order as the queries.
+        """
+        traces = [Trace(query) for query in queries]
+        try:
+            answers, pending_indexes, pending_inputs = self.prepare_batch(queries, filters, traces)
+            results = self.answer_with_sources_chain.batch(pending_inputs, config=self.batch_configs(pending_inputs, max_concurrency))
+            return self.complete_batch(answers, pending_indexes, pending_inputs, results)
+        finally:
+            for trace in traces:
+                self.finish_trace(trace)
+
+    async def abatch(
+            self,
+            queries: List[str],
+            filters: Optional[Dict[str, Any]] = None,
+            max_concurrency: int = 8) -> List[str]:
+        """
+        Method to answer many queries concurrently and asynchronously. The retrieval, the
+        web search and the LLM calls of different queries overlap, up to `max_concurrency`
+        queries at a time.
+
+        Args:
+        queries (List[str]): the queries to ask to the model
+        filters (Optional[Dict[str, Any]]): the metadata filters of the retrieval, shared by all the queries
+        max_concurrency (int): the maximum number of queries processed at the same time
+
+        Returns:
+            List[str]: the answers, in the same order as the queries.
+        """
+        traces = [Trace(query) for query in queries]
+        try:
+            # Look up the cache and embed the queries in a thread, so that the event loop is not blocked
+            loop = asyncio.get_running_loop()
+            answers, pending_indexes, pending_inputs = await loop.run_in_executor(None, self.prepare_batch, queries, filters, traces)
+            results = await self.answer_with_sources_chain.abatch(pending_inputs, config=self.batch_configs(pending_inputs, max_concurrency))
+            return await loop.run_in_executor(None, self.complete_batch, answers, pending_indexes, pending_inputs, results)
+        finally:
+            for trace in traces:
+                self.finish_trace(trace)